@@ -0,0 +1,124 @@
+import argparse
+import contextlib
+import io
+import random
+import sys
+import time
+from pathlib import Path
+
+# Benchmark for determine_eligible_keepers with synthetic leagues.
+# Run from the top of the repo: python benchmarks/bench_keepers.py
+# Leagues are generated with the given number of teams, roster size and seasons of transactions, so the keeper
+# engine can be checked to scale to leagues much bigger than YAFL 2.0.
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sleeper_keeper import determine_eligible_keepers  # noqa: E402
+
+positions = ['QB', 'RB', 'WR', 'TE', 'K', 'DEF']
+
+
+def build_league(teams, roster_size, seasons, seed=0):
+    """ Build the inputs of determine_eligible_keepers for a synthetic league
+
+    Every team drafts half of its roster. Each season has 18 weeks of adds and drops and a few traded picks.
+
+    Args:
+        teams (int): Number of teams in the league
+        roster_size (int): Number of players on each roster
+        seasons (int): Number of seasons of transactions
+        seed (int): Random seed, so the same league is built every time
+
+    Returns:
+        league (tuple): (roster_dict, player_dict, draft_dict, transactions_dict, traded_picks_dict, kept_players_dict)
+    """
+    rng = random.Random(seed)
+    player_count = teams * roster_size * 4
+
+    player_dict = dict()
+    for player_number in range(player_count):
+        player_id = str(player_number)
+        player_dict[player_id] = dict()
+        player_dict[player_id]['player_name'] = 'Player {}'.format(player_number)
+        player_dict[player_id]['position'] = rng.choice(positions)
+
+    player_ids = list(player_dict)
+    rng.shuffle(player_ids)
+
+    roster_dict = dict()
+    draft_dict = dict()
+    kept_players_dict = dict()
+    for team in range(teams):
+        owner = 'owner_{}'.format(team)
+        roster = player_ids[team * roster_size:(team + 1) * roster_size]
+        roster_dict[owner] = dict()
+        roster_dict[owner]['owner_id'] = str(team)
+        roster_dict[owner]['roster_id'] = team + 1
+        roster_dict[owner]['player_ids'] = roster
+        for pick, player_id in enumerate(roster[:roster_size // 2]):
+            draft_dict[player_id] = dict()
+            draft_dict[player_id]['full_name'] = player_dict[player_id]['player_name']
+            draft_dict[player_id]['keeper'] = None
+            draft_dict[player_id]['pick_number'] = pick * teams + team + 1
+            draft_dict[player_id]['team_id'] = str(team)
+            draft_dict[player_id]['round'] = pick + 1
+        kept_players_dict[roster[-1]] = {'years_kept': '1'}
+
+    transactions_dict = dict()
+    transactions_dict['drops'] = [rng.choice(player_ids) for _ in range(seasons * 18 * teams)]
+    transactions_dict['adds'] = [rng.choice(player_ids) for _ in range(seasons * 18 * teams)]
+
+    traded_picks_dict = dict()
+    for week in range(seasons * 18):
+        traded_picks_dict[week] = list()
+        for _ in range(rng.randint(0, 2)):
+            owner_id, previous_owner_id = rng.sample(range(1, teams + 1), 2)
+            traded_picks_dict[week].append({
+                'season': '2021',
+                'round': rng.randint(1, 16),
+                'roster_id': previous_owner_id,
+                'previous_owner_id': previous_owner_id,
+                'owner_id': owner_id
+            })
+
+    return roster_dict, player_dict, draft_dict, transactions_dict, traded_picks_dict, kept_players_dict
+
+
+def time_keepers(league, repeat):
+    """ Time determine_eligible_keepers for a league
+
+    Args:
+        league (tuple): League built by build_league
+        repeat (int): Number of times to run determine_eligible_keepers
+
+    Returns:
+        seconds (float): Best time of the runs
+    """
+    best = None
+    for _ in range(repeat):
+        # determine_eligible_keepers only reads its inputs, so every run can use the same league
+        roster_dict, player_dict, draft_dict, transactions_dict, traded_picks_dict, kept_players_dict = league
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            determine_eligible_keepers(
+                roster_dict, player_dict, draft_dict, transactions_dict, traded_picks_dict, kept_players_dict)
+            seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark determine_eligible_keepers with synthetic leagues')
+    parser.add_argument('--teams', type=int, nargs='+', default=[12, 32, 64], help='League sizes to benchmark')
+    parser.add_argument('--roster_size', type=int, default=40, help='Number of players on each roster')
+    parser.add_argument('--seasons', type=int, default=3, help='Seasons of transactions')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per league size. The best run is reported.')
+    args = parser.parse_args()
+
+    print('teams  roster  seasons  seconds')
+    for teams in args.teams:
+        league = build_league(teams, args.roster_size, args.seasons)
+        seconds = time_keepers(league, args.repeat)
+        print('{:>5}  {:>6}  {:>7}  {:.4f}'.format(teams, args.roster_size, args.seasons, seconds))
+
+    sys.exit(0)
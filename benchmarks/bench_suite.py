@@ -0,0 +1,300 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# End to end benchmarks for sleeper-keeper.
+# Run from the top of the repo: python benchmarks/bench_suite.py
+# Every benchmark runs in a temporary copy of data_files, with the Sleeper API replaced by FakeSleeper
+# (fake_sleeper.py), so nothing is requested from the live API and the repo's data_files are not changed.
+#
+# For each benchmark the best and median time, the peak memory allocated by Python (tracemalloc) and the number of
+# Sleeper API requests and bytes are recorded. Results are saved to benchmarks/results/. Compare against an older
+# result with --baseline to catch regressions:
+#     python benchmarks/bench_suite.py --baseline benchmarks/results/baseline.json
+#
+# baseline.json is committed, and records the commit and Python version it was run on. Replace it with a new run
+# (results/latest.json) when a change is meant to move the numbers.
+
+repo_dir = Path(__file__).resolve().parent.parent
+results_dir = Path(__file__).resolve().parent / 'results'
+sys.path.insert(0, str(repo_dir))
+
+# Serve cached keeper pages for the whole run. Must be set before keeperwebpage is imported.
+os.environ.setdefault('KEEPER_CACHE_TTL', str(24 * 60 * 60))
+# The fake Sleeper API has no rate limit, and waiting for tokens would hide the time spent in the code. Must be set
+# before sleeper_client is imported.
+os.environ.setdefault('SLEEPER_RATE_LIMIT', '0')
+
+import keeper_persist  # noqa: E402
+import keeperwebpage  # noqa: E402
+import process_kept_csv  # noqa: E402
+import sleeper_client  # noqa: E402
+import sleeper_keeper  # noqa: E402
+from bench_keepers import build_league  # noqa: E402
+from fake_sleeper import FakeSleeper, fixture_routes, synthetic_routes  # noqa: E402
+
+# Files made by runs that are not copied into the benchmark data_files
+generated_files = ('*.db', '*.bin', '*.lock', 'keeper_snapshot.json', 'final_keepers*')
+
+# Synthetic leagues use years after this one, so their data_files do not mix with the saved years
+synthetic_year = 2030
+
+
+class Bench(object):
+    """ Runs benchmarks and collects their results
+
+    Args:
+        fake (FakeSleeper): Fake Sleeper API the requests are counted on
+        repeat (int): Number of timed runs of each benchmark
+    """
+    def __init__(self, fake, repeat):
+        self.fake = fake
+        self.repeat = repeat
+        self.results = dict()
+
+    def run(self, name, function, setup=None, repeat=None):
+        """ Benchmark a function
+
+        The function is run once to warm up, then timed repeat times, then run once more with tracemalloc to measure
+        the peak memory. Requests are counted for the last timed run.
+
+        Args:
+            name (str): Name of the benchmark
+            function (func): Function to benchmark. Called with the arguments returned by setup.
+            setup (func): Function run before every run, outside of the timing. Returns a tuple of arguments.
+            repeat (int): Number of timed runs. Defaults to the repeat of the Bench.
+        """
+        def call():
+            args = setup() if setup else ()
+            # Saving the data files of the last run is not part of this run
+            keeper_persist.wait_for_writes()
+            self.fake.reset_counts()
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                function(*args)
+                return time.perf_counter() - start
+
+        call()
+        times = [call() for _ in range(repeat or self.repeat)]
+        requests = self.fake.requests
+        bytes_sent = self.fake.bytes_sent
+
+        args = setup() if setup else ()
+        keeper_persist.wait_for_writes()
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        result = dict()
+        result['seconds_best'] = min(times)
+        result['seconds_median'] = statistics.median(times)
+        result['peak_memory'] = peak_memory
+        result['requests'] = requests
+        result['bytes'] = bytes_sent
+        self.results[name] = result
+        print('{:<40} {:>10.4f} {:>10.4f} {:>12} {:>8} {:>12}'.format(
+            name, result['seconds_best'], result['seconds_median'], peak_memory, requests, bytes_sent))
+
+
+def copy_data_files(work_dir):
+    """ Copy the saved data_files into a benchmark directory
+
+    Args:
+        work_dir (str): Benchmark directory
+    """
+    shutil.copytree(str(repo_dir / 'data_files'), os.path.join(work_dir, 'data_files'),
+                    ignore=shutil.ignore_patterns(*generated_files))
+
+
+def run_fixture_benchmarks(bench, fake, work_dir):
+    """ Benchmarks that use the saved 2019 and 2020 data files
+
+    Args:
+        bench (Bench): Bench to run the benchmarks on
+        fake (FakeSleeper): Fake Sleeper API
+        work_dir (str): Benchmark directory with a copy of data_files
+    """
+    os.chdir(work_dir)
+    fake.add_routes(fixture_routes(data_dir='data_files'))
+    main_program = sleeper_keeper.main_program
+
+    # The first online run downloads the player dump. After that the player store is fresh.
+    main_program('chilliah', False, True, None, False, 2020)
+
+    for year in (2019, 2020):
+        bench.run('main_program_offline_{}'.format(year),
+                  lambda year=year: main_program('chilliah', False, False, None, True, year))
+    bench.run('main_program_online_2020', lambda: main_program('chilliah', False, True, None, False, 2020))
+
+    def main_program_uncached():
+        # Every Sleeper API request is sent, like the first refresh with an empty response cache
+        os.environ['SLEEPER_RESPONSE_CACHE'] = ''
+        try:
+            main_program('chilliah', False, True, None, False, 2020)
+        finally:
+            del os.environ['SLEEPER_RESPONSE_CACHE']
+
+    bench.run('main_program_online_2020_uncached', main_program_uncached)
+
+    bench.run('get_players_cached', lambda: sleeper_keeper.get_players(False, 2020))
+
+    def get_players_refresh():
+        # The player dump is always old, so it is requested again. The fake answers 304 Not Modified.
+        os.environ['PLAYER_DUMP_MAX_AGE'] = '0'
+        try:
+            sleeper_keeper.get_players(True, 2020)
+        finally:
+            del os.environ['PLAYER_DUMP_MAX_AGE']
+
+    bench.run('get_players_refresh', get_players_refresh)
+
+    process_kept_csv.year = 2020
+    process_kept_csv.convert_csv_to_json()
+    bench.run('add_sleeper_information', process_kept_csv.add_sleeper_information)
+
+    client = keeperwebpage.app.test_client()
+    for route in ('/', '/2019', '/pos/QB', '/round/3', '/kept/2020', '/csv/2020', '/csv/2020?position=RB'):
+        bench.run('route {}'.format(route), lambda route=route: client.get(route).get_data())
+
+
+def run_synthetic_benchmarks(bench, fake, work_dir, teams, roster_size):
+    """ Benchmarks that use synthetic leagues
+
+    Args:
+        bench (Bench): Bench to run the benchmarks on
+        fake (FakeSleeper): Fake Sleeper API
+        work_dir (str): Empty benchmark directory
+        teams (list): League sizes to benchmark
+        roster_size (int): Number of players on each roster
+    """
+    os.chdir(work_dir)
+    for team_count in teams:
+        # Each league size has its own user and year, so each has its own data_files and player store
+        user = 'bench_{}'.format(team_count)
+        year = synthetic_year + team_count
+        fake.add_routes(synthetic_routes(team_count, roster_size, year, username=user))
+        sleeper_keeper.main_program(user, False, True, None, False, year)
+        bench.run('main_program_online_{}_teams'.format(team_count),
+                  lambda: sleeper_keeper.main_program(user, False, True, None, False, year))
+
+        league = build_league(team_count, roster_size, 3)
+        # determine_eligible_keepers only reads its inputs, so every run can use the same league
+        bench.run('determine_eligible_keepers_{}_teams'.format(team_count),
+                  sleeper_keeper.determine_eligible_keepers, lambda league=league: league)
+
+
+def git_commit():
+    """ Get the commit the benchmarks were run on
+
+    Returns:
+        commit (str): Commit hash or None if git is not available
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=str(repo_dir)).decode('ascii').strip()
+    except Exception:
+        return None
+
+
+# Growth smaller than this is noise, even if it is more than the tolerance. Most routes take a fraction of a ms.
+noise_floor = {'seconds_median': 0.001, 'peak_memory': 64 * 1024}
+
+
+def compare(results, baseline, tolerance):
+    """ Compare benchmark results against a baseline
+
+    A benchmark regressed if its median time or peak memory grew by more than the tolerance and the noise_floor, or it
+    makes more Sleeper API requests than before.
+
+    Args:
+        results (dict): Results of this run
+        baseline (dict): Results of an older run
+        tolerance (float): Allowed growth, 0.25 is 25%
+
+    Returns:
+        regressions (list): Description of each regression
+    """
+    regressions = list()
+    for name, result in results['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if old is None:
+            continue
+        for metric in ('seconds_median', 'peak_memory'):
+            growth = result[metric] - old[metric]
+            if old[metric] and growth > old[metric] * tolerance and growth > noise_floor[metric]:
+                regressions.append('{} {}: {:.4g} -> {:.4g}'.format(name, metric, old[metric], result[metric]))
+        if result['requests'] > old['requests']:
+            regressions.append('{} requests: {} -> {}'.format(name, old['requests'], result['requests']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End to end benchmarks for sleeper-keeper')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs of each benchmark')
+    parser.add_argument('--teams', type=int, nargs='+', default=[12, 32], help='Synthetic league sizes')
+    parser.add_argument('--roster_size', type=int, default=30, help='Number of players on each synthetic roster')
+    parser.add_argument('--baseline', type=str, default=None, help='Results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed growth before a regression')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds the fake Sleeper API waits per request')
+    args = parser.parse_args()
+
+    # Load the baseline first, since it can be the latest.json that is about to be replaced
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    fake = FakeSleeper(dict(), latency=args.latency)
+    fake.install(sleeper_client.session)
+    bench = Bench(fake, args.repeat)
+
+    # Keep the output to the benchmark table
+    logging.getLogger('sleeper_keeper').setLevel(logging.WARNING)
+
+    print('{:<40} {:>10} {:>10} {:>12} {:>8} {:>12}'.format(
+        'benchmark', 'best', 'median', 'peak_memory', 'requests', 'bytes'))
+    start_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as fixture_dir, tempfile.TemporaryDirectory() as synthetic_dir:
+        try:
+            copy_data_files(fixture_dir)
+            run_fixture_benchmarks(bench, fake, fixture_dir)
+            run_synthetic_benchmarks(bench, fake, synthetic_dir, args.teams, args.roster_size)
+        finally:
+            # The writer thread saves to paths relative to the benchmark directory
+            keeper_persist.wait_for_writes()
+            os.chdir(start_dir)
+
+    results = dict()
+    results['created'] = datetime.datetime.now().isoformat(timespec='seconds')
+    results['commit'] = git_commit()
+    results['python'] = platform.python_version()
+    results['benchmarks'] = bench.results
+
+    results_dir.mkdir(parents=True, exist_ok=True)
+    results_path = results_dir / '{}.json'.format(datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+    for path in (results_path, results_dir / 'latest.json'):
+        with open(str(path), 'w') as f:
+            f.write(json.dumps(results, indent=4))
+    print('Results saved to {}'.format(results_path))
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        sys.exit(1 if regressions else 0)
+
+    sys.exit(0)
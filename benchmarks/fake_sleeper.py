@@ -0,0 +1,320 @@
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+# Stand in for the Sleeper API, so online mode can be run and benchmarked without the live API.
+# FakeSleeper is a requests transport adapter. Mounting it on the shared session in sleeper_client sends every Sleeper
+# API request made by sleeper_keeper.py, player_store.py and process_kept_csv.py to it instead of the network. It
+# answers from a table of {url: json body}, which is built from the saved data_files of a year (fixture_routes) or for
+# a synthetic league of any size (synthetic_routes).
+#
+# The player dump is served with an ETag, and answers 304 Not Modified to a matching If-None-Match, like Sleeper.
+
+base_url = 'https://api.sleeper.app/v1'
+players_url = '{}/players/nfl'.format(base_url)
+
+# Trade deadline of the leagues. The saved data files do not keep it.
+trade_deadline = 12
+last_week = 17
+
+
+class FakeSleeper(BaseAdapter):
+    """ requests transport adapter that answers Sleeper API requests from a table of responses
+
+    Args:
+        routes (dict): {url: json body}
+        latency (float): Seconds to wait before each response, to act like the network
+    """
+    def __init__(self, routes, latency=0):
+        super().__init__()
+        self.latency = latency
+        self._bodies = dict()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.add_routes(routes)
+
+    def add_routes(self, routes):
+        """ Add responses to the table
+
+        Args:
+            routes (dict): {url: json body}
+        """
+        for url, body in routes.items():
+            content = json.dumps(body).encode('utf-8')
+            self._bodies[url] = (content, '"{}"'.format(hashlib.sha1(content).hexdigest()))
+
+    def reset_counts(self):
+        """ Reset the number of requests and bytes sent """
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def send(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+
+        response = Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict()
+
+        url = request.url.split('?')[0]
+        if url not in self._bodies:
+            response.status_code = 404
+            body = b'null'
+        else:
+            content, etag = self._bodies[url]
+            response.headers['ETag'] = etag
+            if url == players_url and request.headers.get('If-None-Match') == etag:
+                response.status_code = 304
+                body = b''
+            else:
+                response.status_code = 200
+                response.headers['Content-Type'] = 'application/json'
+                body = content
+        # The body is read from raw like a real response, so streamed requests read it in chunks
+        response.raw = io.BytesIO(body)
+        response.headers['Content-Length'] = str(len(body))
+
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += len(body)
+        return response
+
+    def close(self):
+        pass
+
+    def install(self, session):
+        """ Send the Sleeper API requests of a session to the fake
+
+        Args:
+            session (Session): requests session, like sleeper_client.session
+        """
+        session.mount(base_url, self)
+
+
+def league_routes(league_id, draft_id, season, user_dict, roster_dict, draft_dict, weekly_transactions,
+                  previous_league_id=None):
+    """ Responses for one season of a league
+
+    Args:
+        league_id (str): Sleeper league id
+        draft_id (str): Sleeper draft id
+        season (int): Year of the season
+        user_dict (dict): {user_id: user_name}
+        roster_dict (dict): Dictionary of rostered players
+        draft_dict (dict): Dictionary of all drafted players
+        weekly_transactions (dict): {week: [transactions]}
+        previous_league_id (str): League id of the season before
+
+    Returns:
+        routes (dict): {url: json body}
+    """
+    league = '{}/league/{}'.format(base_url, league_id)
+    routes = dict()
+    routes[league] = {
+        'league_id': league_id,
+        'name': 'YAFL 2.0',
+        'season': str(season),
+        'status': 'complete',
+        'previous_league_id': previous_league_id,
+        'settings': {'trade_deadline': trade_deadline},
+    }
+    routes['{}/users'.format(league)] = [
+        {'user_id': user_id, 'display_name': user_name} for user_id, user_name in user_dict.items()]
+    routes['{}/rosters'.format(league)] = [
+        {'owner_id': roster['owner_id'], 'roster_id': roster['roster_id'], 'players': roster['player_ids']}
+        for roster in roster_dict.values()]
+    routes['{}/drafts'.format(league)] = [{'draft_id': draft_id}]
+
+    picks = list()
+    for player_id, pick in draft_dict.items():
+        first_name, _, last_name = pick['full_name'].partition(' ')
+        picks.append({
+            'player_id': player_id,
+            'metadata': {'first_name': first_name, 'last_name': last_name},
+            'is_keeper': pick['keeper'],
+            'pick_no': pick['pick_number'],
+            'picked_by': pick['team_id'],
+            'round': pick['round'],
+        })
+    routes['{}/draft/{}/picks'.format(base_url, draft_id)] = picks
+
+    for week in range(last_week + 1):
+        routes['{}/transactions/{}'.format(league, week)] = weekly_transactions.get(week, [])
+    return routes
+
+
+def player_dump(player_dict):
+    """ Sleeper player dump for a player_dict
+
+    Args:
+        player_dict (dict): {player_id: {'player_name': player name, 'position': position}}
+
+    Returns:
+        dump (dict): {player_id: player information}
+    """
+    dump = dict()
+    for player_id, player in player_dict.items():
+        first_name, _, last_name = player['player_name'].partition(' ')
+        dump[player_id] = {
+            'player_id': player_id,
+            'first_name': first_name,
+            'last_name': last_name,
+            'position': player['position'],
+            'team': None,
+            'active': True,
+        }
+    return dump
+
+
+def user_routes(username, user_id, leagues):
+    """ Responses for a user and the leagues of the user
+
+    Args:
+        username (str): Sleeper username
+        user_id (str): Sleeper user id
+        leagues (dict): {season: league_id}
+
+    Returns:
+        routes (dict): {url: json body}
+    """
+    routes = dict()
+    routes['{}/user/{}'.format(base_url, username)] = {'username': username, 'user_id': user_id}
+    for season, league_id in leagues.items():
+        routes['{}/user/{}/leagues/nfl/{}'.format(base_url, user_id, season)] = [
+            {'name': 'YAFL 2.0', 'league_id': league_id}]
+    return routes
+
+
+def fixture_routes(years=(2019, 2020), data_dir='data_files', username='chilliah'):
+    """ Responses built from the saved data_files of each year
+
+    The saved transactions only have the adds and drops after the trade deadline, so they are all served in the
+    week after the trade deadline. Each traded pick is served in the week it was saved in.
+
+    Args:
+        years (tuple): Years to serve, oldest first
+        data_dir (str): Directory with the saved data files
+        username (str): Sleeper username that is in every league
+
+    Returns:
+        routes (dict): {url: json body}
+    """
+    routes = dict()
+    leagues = dict()
+    player_dict = dict()
+    previous_league_id = None
+    for year in years:
+        def load(name):
+            with open('{}/{}/{}.json'.format(data_dir, year, name)) as f:
+                return json.load(f)
+
+        league_id = 'league_{}'.format(year)
+        transactions = load('transactions')
+        weekly_transactions = dict()
+        weekly_transactions[trade_deadline + 1] = [{
+            'status': 'complete',
+            'type': 'free_agent',
+            'drops': dict.fromkeys(transactions['drops'], 1),
+            'adds': dict.fromkeys(transactions['adds'], 1),
+            'draft_picks': [],
+        }]
+        for week, picks in load('traded_picks').items():
+            if picks:
+                weekly_transactions.setdefault(int(week), list()).append({
+                    'status': 'complete', 'type': 'trade', 'drops': None, 'adds': {}, 'draft_picks': picks})
+
+        routes.update(league_routes(league_id, 'draft_{}'.format(year), year, load('user_dict'), load('rosters'),
+                                    load('draft_dict'), weekly_transactions, previous_league_id))
+        player_dict.update(load('player_dict'))
+        leagues[year] = league_id
+        previous_league_id = league_id
+
+    routes.update(user_routes(username, 'user_{}'.format(username), leagues))
+    routes[players_url] = player_dump(player_dict)
+    routes['{}/state/nfl'.format(base_url)] = {'league_season': str(max(years))}
+    return routes
+
+
+def synthetic_routes(teams, roster_size, year=2020, username='bench', seed=0):
+    """ Responses for a synthetic league of any size
+
+    Every team drafts 16 rounds, a few players are marked as keepers, and each week after the trade deadline has adds,
+    drops and traded picks.
+
+    Args:
+        teams (int): Number of teams in the league
+        roster_size (int): Number of players on each roster
+        year (int): Year of the season
+        username (str): Sleeper username of the first manager
+        seed (int): Random seed, so the same league is built every time
+
+    Returns:
+        routes (dict): {url: json body}
+    """
+    rng = random.Random(seed)
+    positions = ['QB', 'RB', 'WR', 'TE', 'K', 'DEF']
+
+    player_dict = dict()
+    for player_number in range(max(teams * roster_size * 4, 10000)):
+        player_dict[str(player_number)] = {
+            'player_name': 'Player {}'.format(player_number), 'position': rng.choice(positions)}
+    player_ids = list(player_dict)
+    rng.shuffle(player_ids)
+
+    user_dict = dict()
+    roster_dict = dict()
+    draft_dict = dict()
+    rounds = min(16, roster_size)
+    for team in range(teams):
+        user_id = 'user_{}'.format(username) if team == 0 else 'user_{}'.format(team)
+        owner = username if team == 0 else 'owner_{}'.format(team)
+        user_dict[user_id] = owner
+        roster = player_ids[team * roster_size:(team + 1) * roster_size]
+        roster_dict[owner] = {'owner_id': user_id, 'roster_id': team + 1, 'player_ids': roster}
+        for pick, player_id in enumerate(roster[:rounds]):
+            draft_dict[player_id] = {
+                'full_name': player_dict[player_id]['player_name'],
+                'keeper': True if pick >= rounds - 2 else None,
+                'pick_number': pick * teams + team + 1,
+                'team_id': user_id,
+                'round': pick + 1,
+            }
+
+    weekly_transactions = dict()
+    for week in range(trade_deadline + 1, last_week + 1):
+        weekly_transactions[week] = list()
+        for _ in range(teams):
+            weekly_transactions[week].append({
+                'status': rng.choice(['complete', 'complete', 'failed']),
+                'type': 'free_agent',
+                'drops': {rng.choice(player_ids): 1},
+                'adds': {rng.choice(player_ids): 1},
+                'draft_picks': [],
+            })
+        owner_id, previous_owner_id = rng.sample(range(1, teams + 1), 2)
+        weekly_transactions[week].append({
+            'status': 'complete',
+            'type': 'trade',
+            'drops': None,
+            'adds': {},
+            'draft_picks': [{'season': str(year + 1), 'round': rng.randint(1, rounds), 'roster_id': previous_owner_id,
+                             'previous_owner_id': previous_owner_id, 'owner_id': owner_id}],
+        })
+
+    league_id = 'synthetic_{}'.format(teams)
+    routes = league_routes(league_id, 'synthetic_draft_{}'.format(teams), year, user_dict, roster_dict, draft_dict,
+                           weekly_transactions)
+    routes.update(user_routes(username, 'user_{}'.format(username), {year: league_id}))
+    routes[players_url] = player_dump(player_dict)
+    routes['{}/state/nfl'.format(base_url)] = {'league_season': str(year)}
+    return routes
@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from keeper_log import get_logger
+from keeper_metrics import metrics
+
+# This is a helper module for sleeper_keeper.py.
+# Most of the Sleeper API calls made by main_program do not depend on each other. run_stages runs a set of stages,
+# starting each stage as soon as the stages it depends on are finished, so independent calls run at the same time and
+# only the stages that need earlier results wait for them.
+
+logger = get_logger(__name__)
+
+# Maximum number of stages that run at the same time
+max_stage_workers = 4
+
+
+def run_stages(stages, max_workers=max_stage_workers):
+    """ Run stages concurrently in dependency order
+
+    stages has the following structure:
+        {stage_name: (function, [names of stages it depends on])}
+
+    Each function is called with the results of its dependencies as arguments, in the order the dependencies are
+    listed.
+
+    Args:
+        stages (dict): Dictionary of stages to run
+        max_workers (int): Maximum number of stages that run at the same time
+
+    Returns:
+        results (dict): Dictionary of {stage_name: result}
+        timings (dict): Dictionary of {stage_name: seconds the stage took}
+    """
+    for name, (function, dependencies) in stages.items():
+        for dependency in dependencies:
+            assert dependency in stages, 'Stage {} depends on unknown stage {}'.format(name, dependency)
+
+    results = dict()
+    timings = dict()
+    pending = dict(stages)
+    running = dict()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Start every stage whose dependencies are finished
+            for name in list(pending):
+                function, dependencies = pending[name]
+                if all(dependency in results for dependency in dependencies):
+                    del pending[name]
+                    args = [results[dependency] for dependency in dependencies]
+                    running[executor.submit(_timed, name, function, args)] = name
+
+            assert running, 'Stages {} have circular dependencies'.format(list(pending))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], timings[name] = future.result()
+
+    return results, timings
+
+
+def print_timings(timings):
+    """ Log how long each stage took
+
+    Args:
+        timings (dict): Dictionary of {stage_name: seconds the stage took}
+    """
+    logger.info('Stage timings:')
+    for name, seconds in sorted(timings.items(), key=lambda timing: timing[1], reverse=True):
+        logger.info('\t%s: %.3fs', name, seconds)
+
+
+def _timed(name, function, args):
+    """ Call a function and time it. The wall clock and CPU time are also recorded in the stage metrics.
+
+    Args:
+        name (str): Name of the stage
+        function (func): Function to call
+        args (list): Arguments to call function with
+
+    Returns:
+        result: Return value of function
+        seconds (float): Seconds the call took
+    """
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    metrics.record_stage(name, seconds, time.thread_time() - cpu_start)
+    return result, seconds
@@ -0,0 +1,352 @@
+import json
+import sqlite3
+import time
+from keeper_log import get_logger
+from league_config import default_league
+from pathlib import Path
+
+# This is a helper module for sleeper_keeper.py and keeperwebpage.py.
+# Every year used to be its own silo of json files, and a year could only be looked at by running everything for that
+# year again. The HistoryStore keeps the users, rosters, drafts, transactions, trades and kept players of every season
+# of YAFL 2.0 in one SQLite database, keyed by the Sleeper league id of the season. Sleeper gives every season a new
+# league id and links it to the season before with previous_league_id, so the seasons form a chain that can be
+# discovered from the current league.
+#
+# Seasons are ingested one at a time. A finished season never changes, so it is only ingested once. The current season
+# is replaced every time it is ingested.
+
+logger = get_logger(__name__)
+
+# Path of the history store of YAFL 2.0. One store holds every season of a league. Each league has its own store.
+history_path = default_league.history_path
+
+# League statuses of a season that has drafted. Seasons that have not drafted yet have no keepers to show.
+started_statuses = {'in_season', 'post_season', 'complete'}
+
+# Tables holding the data of a season. Every table has a league_id column.
+season_tables = ['users', 'rosters', 'roster_players', 'draft_picks', 'transaction_players', 'traded_players',
+                 'traded_picks', 'kept_players']
+
+schema = [
+    'CREATE TABLE IF NOT EXISTS seasons ('
+    'league_id TEXT PRIMARY KEY, season INTEGER, name TEXT, previous_league_id TEXT, status TEXT, '
+    'trade_deadline INTEGER, ingested_at REAL)',
+    'CREATE INDEX IF NOT EXISTS seasons_season ON seasons (season)',
+    'CREATE TABLE IF NOT EXISTS users ('
+    'league_id TEXT, user_id TEXT, display_name TEXT, PRIMARY KEY (league_id, user_id))',
+    'CREATE TABLE IF NOT EXISTS rosters ('
+    'league_id TEXT, roster_id INTEGER, owner_id TEXT, owner_name TEXT, PRIMARY KEY (league_id, roster_id))',
+    'CREATE TABLE IF NOT EXISTS roster_players (league_id TEXT, roster_id INTEGER, seq INTEGER, player_id TEXT)',
+    'CREATE INDEX IF NOT EXISTS roster_players_league ON roster_players (league_id, roster_id)',
+    'CREATE INDEX IF NOT EXISTS roster_players_player ON roster_players (player_id)',
+    'CREATE TABLE IF NOT EXISTS draft_picks ('
+    'league_id TEXT, player_id TEXT, full_name TEXT, round INTEGER, pick_no INTEGER, picked_by TEXT, '
+    'is_keeper INTEGER, PRIMARY KEY (league_id, player_id))',
+    'CREATE INDEX IF NOT EXISTS draft_picks_player ON draft_picks (player_id)',
+    # Players added or dropped after the trade deadline
+    'CREATE TABLE IF NOT EXISTS transaction_players (league_id TEXT, seq INTEGER, action TEXT, player_id TEXT)',
+    'CREATE INDEX IF NOT EXISTS transaction_players_league ON transaction_players (league_id)',
+    'CREATE TABLE IF NOT EXISTS traded_players (league_id TEXT, seq INTEGER, player_id TEXT)',
+    'CREATE INDEX IF NOT EXISTS traded_players_league ON traded_players (league_id)',
+    'CREATE TABLE IF NOT EXISTS traded_picks ('
+    'league_id TEXT, week INTEGER, seq INTEGER, season TEXT, round INTEGER, owner_id INTEGER, '
+    'previous_owner_id INTEGER, data TEXT)',
+    'CREATE INDEX IF NOT EXISTS traded_picks_league ON traded_picks (league_id)',
+    'CREATE TABLE IF NOT EXISTS kept_players ('
+    'league_id TEXT, player_id TEXT, manager TEXT, years_kept INTEGER, data TEXT, '
+    'PRIMARY KEY (league_id, player_id))',
+    'CREATE INDEX IF NOT EXISTS kept_players_player ON kept_players (player_id)',
+]
+
+
+class HistoryStore(object):
+    """ SQLite store of every season of YAFL 2.0
+
+    Args:
+        path (str): Path of the SQLite database
+    """
+    def __init__(self, path=history_path):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30)
+        with self.connection:
+            for statement in schema:
+                self.connection.execute(statement)
+
+    def close(self):
+        """ Close the database connection """
+        self.connection.close()
+
+    def get_season(self, league_id):
+        """ Get the stored information for a season
+
+        Args:
+            league_id (str): Sleeper league id of the season
+
+        Returns:
+            season (dict): Season information or None if the season has not been ingested
+        """
+        row = self.connection.execute(
+            'SELECT league_id, season, name, previous_league_id, status, trade_deadline, ingested_at '
+            'FROM seasons WHERE league_id = ?', (league_id,)).fetchone()
+        return _season_row(row) if row else None
+
+    def seasons(self, started_only=False):
+        """ Get every stored season, oldest first
+
+        Args:
+            started_only (bool): Only seasons that have drafted
+
+        Returns:
+            seasons (list): Season information for every season
+        """
+        rows = self.connection.execute(
+            'SELECT league_id, season, name, previous_league_id, status, trade_deadline, ingested_at '
+            'FROM seasons ORDER BY season').fetchall()
+        seasons = [_season_row(row) for row in rows]
+        if started_only:
+            seasons = [season for season in seasons if season['status'] in started_statuses]
+        return seasons
+
+    def season_league_id(self, season):
+        """ Get the league id of a season
+
+        Args:
+            season (int): Year of the season
+
+        Returns:
+            league_id (str): Sleeper league id of the season or None if the season has not been ingested
+        """
+        row = self.connection.execute(
+            'SELECT league_id FROM seasons WHERE season = ? ORDER BY ingested_at DESC LIMIT 1', (season,)).fetchone()
+        return row[0] if row else None
+
+    def needs_ingest(self, league_info):
+        """ Check if a season needs to be ingested. Finished seasons are only ingested once.
+
+        Args:
+            league_info (dict): League information from the Sleeper API
+
+        Returns:
+            needs_ingest (bool): True if the season is not stored or can still change
+        """
+        stored = self.get_season(league_info['league_id'])
+        return stored is None or stored['status'] != 'complete'
+
+    def ingest_season(self, league_info, user_dict, roster_dict, draft_dict, transactions, trades, traded_picks,
+                      kept_dict=None):
+        """ Store a season, replacing anything already stored for its league id
+
+        The arguments have the same structure as the results of the get_ functions in sleeper_keeper.py.
+
+        Args:
+            league_info (dict): League information from the Sleeper API
+            user_dict (dict): {user_id: user_name}
+            roster_dict (dict): Dictionary of rostered players
+            draft_dict (dict): Dictionary of all drafted players
+            transactions (dict): Dictionary of all the transactions after the trade deadline
+            trades (list): List of player_ids of traded players
+            traded_picks (dict): Dictionary of traded picks
+            kept_dict (dict): Dictionary of the kept players. None to keep the kept players that are already stored.
+        """
+        league_id = league_info['league_id']
+        with self.connection:
+            tables = season_tables if kept_dict is not None else season_tables[:-1]
+            for table in tables:
+                self.connection.execute('DELETE FROM {} WHERE league_id = ?'.format(table), (league_id,))
+
+            self.connection.execute(
+                'INSERT OR REPLACE INTO seasons VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                    league_id,
+                    int(league_info['season']),
+                    league_info.get('name'),
+                    league_info.get('previous_league_id'),
+                    league_info.get('status'),
+                    league_info['settings']['trade_deadline'],
+                    time.time(),
+                ))
+            self.connection.executemany(
+                'INSERT INTO users VALUES (?, ?, ?)',
+                [(league_id, user_id, user_name) for user_id, user_name in user_dict.items()])
+            self.connection.executemany(
+                'INSERT INTO rosters VALUES (?, ?, ?, ?)',
+                [(league_id, roster['roster_id'], roster['owner_id'], owner) for owner, roster in roster_dict.items()])
+            self.connection.executemany(
+                'INSERT INTO roster_players VALUES (?, ?, ?, ?)',
+                [(league_id, roster['roster_id'], seq, player_id)
+                 for roster in roster_dict.values()
+                 for seq, player_id in enumerate(roster['player_ids'] or [])])
+            self.connection.executemany(
+                'INSERT INTO draft_picks VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(league_id, player_id, pick['full_name'], pick['round'], pick['pick_number'], pick['team_id'],
+                  bool(pick['keeper'])) for player_id, pick in draft_dict.items()])
+            self.connection.executemany(
+                'INSERT INTO transaction_players VALUES (?, ?, ?, ?)',
+                [(league_id, seq, action, player_id)
+                 for action in ('drops', 'adds')
+                 for seq, player_id in enumerate(transactions[action])])
+            self.connection.executemany(
+                'INSERT INTO traded_players VALUES (?, ?, ?)',
+                [(league_id, seq, player_id) for seq, player_id in enumerate(trades)])
+            self.connection.executemany(
+                'INSERT INTO traded_picks VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(league_id, int(week), seq, str(pick['season']), pick['round'], pick['owner_id'],
+                  pick['previous_owner_id'], json.dumps(pick))
+                 for week, picks in traded_picks.items()
+                 for seq, pick in enumerate(picks or [])])
+            if kept_dict is not None:
+                self.connection.executemany(
+                    'INSERT INTO kept_players VALUES (?, ?, ?, ?, ?)',
+                    [(league_id, player_id, kept.get('manager'), int(kept['years_kept']), json.dumps(kept))
+                     for player_id, kept in kept_dict.items()])
+
+        logger.info('Stored the %s season (league %s)', league_info['season'], league_id)
+
+    def draft_dict(self, league_id):
+        """ Get the draft of a season
+
+        Args:
+            league_id (str): Sleeper league id of the season
+
+        Returns:
+            draft_dict (dict): Dictionary of all drafted players, in pick order
+        """
+        draft_dict = dict()
+        picks = self.connection.execute(
+            'SELECT player_id, full_name, round, pick_no, picked_by, is_keeper FROM draft_picks WHERE league_id = ? '
+            'ORDER BY pick_no', (league_id,))
+        for player_id, full_name, round, pick_no, picked_by, is_keeper in picks:
+            draft_dict[player_id] = dict()
+            draft_dict[player_id]['full_name'] = full_name
+            draft_dict[player_id]['keeper'] = bool(is_keeper)
+            draft_dict[player_id]['pick_number'] = pick_no
+            draft_dict[player_id]['team_id'] = picked_by
+            draft_dict[player_id]['round'] = round
+        return draft_dict
+
+    def keeper_inputs(self, league_id):
+        """ Get the Sleeper data determine_eligible_keepers needs for a season
+
+        The kept players are not included. They are worked out from the drafts by keeper_chains.py.
+
+        Args:
+            league_id (str): Sleeper league id of the season
+
+        Returns:
+            inputs (dict): {'roster_dict', 'draft_dict', 'transactions', 'traded_picks'}
+        """
+        inputs = dict()
+
+        roster_dict = dict()
+        rosters = self.connection.execute(
+            'SELECT roster_id, owner_id, owner_name FROM rosters WHERE league_id = ? ORDER BY rowid', (league_id,))
+        for roster_id, owner_id, owner_name in rosters.fetchall():
+            roster_dict[owner_name] = dict()
+            roster_dict[owner_name]['owner_id'] = owner_id
+            roster_dict[owner_name]['roster_id'] = roster_id
+            roster_dict[owner_name]['player_ids'] = list()
+        owners = dict((roster['roster_id'], owner) for owner, roster in roster_dict.items())
+        players = self.connection.execute(
+            'SELECT roster_id, player_id FROM roster_players WHERE league_id = ? ORDER BY roster_id, seq', (league_id,))
+        for roster_id, player_id in players:
+            roster_dict[owners[roster_id]]['player_ids'].append(player_id)
+        inputs['roster_dict'] = roster_dict
+        inputs['draft_dict'] = self.draft_dict(league_id)
+
+        transactions = dict()
+        transactions['drops'] = list()
+        transactions['adds'] = list()
+        rows = self.connection.execute(
+            'SELECT action, player_id FROM transaction_players WHERE league_id = ? ORDER BY seq', (league_id,))
+        for action, player_id in rows:
+            transactions[action].append(player_id)
+        inputs['transactions'] = transactions
+
+        traded_picks = dict()
+        rows = self.connection.execute(
+            'SELECT week, data FROM traded_picks WHERE league_id = ? ORDER BY week, seq', (league_id,))
+        for week, data in rows:
+            traded_picks.setdefault(week, list()).append(json.loads(data))
+        inputs['traded_picks'] = traded_picks
+
+        return inputs
+
+
+def _season_row(row):
+    """ Convert a row of the seasons table to a dictionary
+
+    Args:
+        row (tuple): Row of the seasons table
+
+    Returns:
+        season (dict): Season information
+    """
+    season = dict()
+    season['league_id'] = row[0]
+    season['season'] = row[1]
+    season['name'] = row[2]
+    season['previous_league_id'] = row[3]
+    season['status'] = row[4]
+    season['trade_deadline'] = row[5]
+    season['ingested_at'] = row[6]
+    return season
+
+
+def stored_years(default_years, path=history_path):
+    """ Get the years that can be shown. These are the years that have drafted, and the default years.
+
+    Args:
+        default_years (list): Years to show even if they are not in the history store
+        path (str): Path of the history store
+
+    Returns:
+        years (list): Sorted list of years
+    """
+    years = set(default_years)
+    if Path(path).is_file():
+        store = HistoryStore(path)
+        try:
+            years.update(season['season'] for season in store.seasons(started_only=True))
+        finally:
+            store.close()
+    return sorted(years)
+
+
+def stored_keeper_inputs(season, path=history_path):
+    """ Get the Sleeper data determine_eligible_keepers needs for a season from the history store
+
+    Args:
+        season (int): Year of the season
+        path (str): Path of the history store
+
+    Returns:
+        inputs (dict): Dictionary made by HistoryStore.keeper_inputs or None if the season is not stored
+    """
+    if not Path(path).is_file():
+        return None
+    store = HistoryStore(path)
+    try:
+        league_id = store.season_league_id(season)
+        return store.keeper_inputs(league_id) if league_id is not None else None
+    finally:
+        store.close()
+
+
+def latest_year(default_year, path=history_path):
+    """ Get the newest season in the history store, including a season that has not drafted yet
+
+    Args:
+        default_year (int): Year used if the history store is empty
+        path (str): Path of the history store
+
+    Returns:
+        year (int): Newest season
+    """
+    if not Path(path).is_file():
+        return default_year
+    store = HistoryStore(path)
+    try:
+        seasons = store.seasons()
+    finally:
+        store.close()
+    return max([default_year] + [season['season'] for season in seasons])
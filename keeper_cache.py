@@ -0,0 +1,228 @@
+import fcntl
+import os
+import threading
+import time
+from keeper_log import get_logger
+from keeper_metrics import metrics
+from pathlib import Path
+
+# This is a helper module for keeperwebpage.py.
+# Every page view used to run main_program, which hits the Sleeper API and rewrites all of the data files. The
+# KeeperCache keeps the keeper snapshot in memory for each (league, year) and only reruns main_program once the
+# snapshot is older than the TTL. Stale snapshots are still served while a background thread refreshes them.
+#
+# uWSGI runs several worker processes, and each one has its own KeeperCache. To keep the Sleeper API from being hit
+# once per worker, the refresh is guarded by a lock file and the age of the published snapshot. If another worker
+# published a snapshot within the TTL, that snapshot is loaded instead of running main_program again.
+#
+# Page views never wait on the Sleeper API. Refreshes always run in a background thread, and concurrent refreshes of
+# the same (league, year) are coalesced into one. When nothing has been published yet, the fallback function publishes
+# the results from the saved data files right away and the Sleeper API refresh runs in the background.
+
+logger = get_logger(__name__)
+
+# Default number of seconds before keeper results are refreshed. Can be overridden with KEEPER_CACHE_TTL.
+default_ttl = 900
+
+
+def get_cache_ttl():
+    """ Get the cache TTL from the KEEPER_CACHE_TTL environment variable
+
+    Returns:
+        ttl (int): Number of seconds before cached keeper results are refreshed
+    """
+    try:
+        return int(os.environ.get('KEEPER_CACHE_TTL', default_ttl))
+    except ValueError:
+        logger.warning('KEEPER_CACHE_TTL is not a number. Using default of %s seconds', default_ttl)
+        return default_ttl
+
+
+class SnapshotNotReady(Exception):
+    """ Raised when there is no keeper snapshot to serve yet. One is being generated in the background. """
+    pass
+
+
+class KeeperCache(object):
+    """ In memory cache of keeper snapshots keyed by (league, year)
+
+    Snapshots are dictionaries published by keeper_snapshot.publish_snapshot. The 'created' key is used to determine
+    the age of a snapshot.
+
+    Args:
+        refresh_function (func): Function that takes (league, year) and publishes a new snapshot
+        load_function (func): Function that takes (league, year) and returns the published snapshot or None
+        lock_path (func): Function that takes (league, year) and returns the path of the refresh lock file
+        ttl (int): Number of seconds before cached snapshots are refreshed
+        fallback_function (func): Function that takes (league, year) and quickly publishes a snapshot without the
+            Sleeper API. Used when nothing has been published yet.
+    """
+    def __init__(self, refresh_function, load_function, lock_path, ttl=None, fallback_function=None):
+        self.refresh_function = refresh_function
+        self.load_function = load_function
+        self.lock_path = lock_path
+        self.ttl = get_cache_ttl() if ttl is None else ttl
+        self.fallback_function = fallback_function
+        # {(league, year): snapshot}
+        self._entries = dict()
+        # (league, year) of the background refreshes that are currently running
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, league, year):
+        """ Get the keeper snapshot for a league and year
+
+        Fresh snapshots are returned straight from memory. Stale snapshots are returned immediately and refreshed in
+        a background thread. If there is no snapshot at all, the fallback snapshot is published and returned, and a
+        refresh is started in the background.
+
+        Args:
+            league (str): League to get keeper results for
+            year (int): Year to get keeper results for
+
+        Returns:
+            snapshot (dict): Keeper snapshot
+
+        Raises:
+            SnapshotNotReady: There is no snapshot to serve until the background refresh is finished
+        """
+        key = (league, year)
+        snapshot = self._entries.get(key)
+
+        # Nothing in memory yet, or another worker may have published a newer snapshot.
+        if snapshot is None or self._is_stale(snapshot):
+            published = self.load_function(*key)
+            if published is None:
+                metrics.cache('keeper_snapshot', 'miss')
+                return self._first_snapshot(key)
+            snapshot = published
+            self._entries[key] = snapshot
+
+        if self._is_stale(snapshot):
+            metrics.cache('keeper_snapshot', 'stale')
+            self.refresh_in_background(league, year, time.time() - self.ttl)
+        else:
+            metrics.cache('keeper_snapshot', 'hit')
+        return snapshot
+
+    def invalidate(self, league, year):
+        """ Drop the cached results for a league and year, so the next get regenerates them
+
+        Args:
+            league (str): League to invalidate
+            year (int): Year to invalidate
+        """
+        self._entries.pop((league, year), None)
+
+    def refresh_in_background(self, league, year, not_before=None):
+        """ Start a background thread to refresh the results for a league and year
+
+        If a refresh of the league and year is already running, no new one is started and the running one is shared.
+
+        Args:
+            league (str): League to refresh
+            year (int): Year to refresh
+            not_before (float): Skip the refresh if a snapshot was published at or after this time. Defaults to now.
+
+        Returns:
+            started (bool): False if the refresh was coalesced into one that is already running
+        """
+        key = (league, year)
+        if not_before is None:
+            not_before = time.time()
+
+        with self._lock:
+            if key in self._refreshing:
+                metrics.increment('keeper_refreshes_total', result='coalesced')
+                return False
+            self._refreshing.add(key)
+
+        thread = threading.Thread(target=self._background_refresh, args=(key, not_before), daemon=True)
+        thread.start()
+        return True
+
+    def _first_snapshot(self, key):
+        """ Publish the fallback snapshot for a key that has no snapshot and start a refresh in the background
+
+        Args:
+            key (tuple): (league, year) of the results
+
+        Returns:
+            snapshot (dict): Fallback keeper snapshot
+        """
+        snapshot = None
+        if self.fallback_function is not None:
+            try:
+                snapshot = self._locked_refresh(key, self.fallback_function, 0)
+            except Exception as e:
+                logger.error('Unable to publish the fallback results of %s: %s', key, e)
+
+        # Replace the fallback snapshot with results from the Sleeper API
+        self.refresh_in_background(*key)
+
+        if snapshot is None:
+            raise SnapshotNotReady('Keeper results for {} are being generated'.format(key))
+        self._entries[key] = snapshot
+        return snapshot
+
+    def _is_stale(self, snapshot):
+        """ Check if a snapshot is older than the TTL
+
+        Args:
+            snapshot (dict): Keeper snapshot
+
+        Returns:
+            stale (bool): True if the snapshot should be refreshed
+        """
+        return time.time() - snapshot['created'] >= self.ttl
+
+    def _locked_refresh(self, key, function, not_before):
+        """ Publish a new snapshot for a key
+
+        Only one worker process refreshes a key at a time. Once the lock is held, check if another worker already
+        published a snapshot at or after not_before and use that snapshot if so. This coalesces the refreshes of
+        different workers that were started at the same time.
+
+        Args:
+            key (tuple): (league, year) of the results
+            function (func): Function that takes (league, year) and publishes a new snapshot
+            not_before (float): Skip the refresh if a snapshot was published at or after this time
+
+        Returns:
+            snapshot (dict): Keeper snapshot
+        """
+        lock_path = Path(self.lock_path(*key))
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                snapshot = self.load_function(*key)
+                if snapshot is None or snapshot['created'] < not_before:
+                    function(*key)
+                    snapshot = self.load_function(*key)
+                    metrics.increment('keeper_refreshes_total', result='refreshed')
+                else:
+                    metrics.increment('keeper_refreshes_total', result='published_by_another_worker')
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        if snapshot is None:
+            raise RuntimeError('Refreshing {} did not publish a keeper snapshot'.format(key))
+        return snapshot
+
+    def _background_refresh(self, key, not_before):
+        """ Refresh a key in a background thread. Keep serving the old snapshot if the refresh fails.
+
+        Args:
+            key (tuple): (league, year) of the results
+            not_before (float): Skip the refresh if a snapshot was published at or after this time
+        """
+        try:
+            self._entries[key] = self._locked_refresh(key, self.refresh_function, not_before)
+        except Exception as e:
+            metrics.increment('keeper_refreshes_total', result='failed')
+            logger.error('Background refresh of %s failed: %s', key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+from functools import partial
+from history_store import HistoryStore
+from keeper_log import get_logger
+from keeper_metrics import metrics
+from league_config import default_league
+
+# This is a helper module for sleeper_keeper.py.
+# years_kept used to come only from processed_kept_players.json, which has to be made by hand from kept_players.csv
+# with process_kept_csv.py. Every pick in a Sleeper draft already says if the player was a keeper (is_keeper) and which
+# manager picked him (picked_by). KeeperChains walks the archived drafts back one season at a time to count how many
+# years in a row each player has been kept by the same manager. The kept players of a past season never change, so each
+# season is only worked out once.
+#
+# Sleeper only knows a player was kept if the keeper was marked in the draft. processed_kept_players.json is still
+# used when it exists, but only for the kept players that are not marked in the draft.
+
+logger = get_logger(__name__)
+
+# First season of YAFL 2.0. No one was kept that year.
+first_season = default_league.first_season
+
+
+def load_archived_draft(season, league_config=default_league):
+    """ Load the draft of a season from the history store, or the saved data files if it is not in the store
+
+    Args:
+        season (int): Year of the season
+        league_config (LeagueConfig): League of the season
+
+    Returns:
+        draft_dict (dict): Dictionary of all drafted players or None if the draft has not been saved
+    """
+    if os.path.isfile(league_config.history_path):
+        store = HistoryStore(league_config.history_path)
+        try:
+            league_id = store.season_league_id(season)
+            if league_id is not None:
+                return store.draft_dict(league_id)
+        finally:
+            store.close()
+
+    path = league_config.path(season, 'draft_dict.json')
+    if os.path.isfile(path):
+        with open(path) as f:
+            text = f.read()
+        metrics.json_bytes('read', 'draft_dict.json', len(text))
+        return json.loads(text)
+    return None
+
+
+def load_manual_kept(season, league_config=default_league):
+    """ Load the kept players made by process_kept_csv.py for a season
+
+    Args:
+        season (int): Year of the season
+        league_config (LeagueConfig): League of the season
+
+    Returns:
+        kept_dict (dict): Dictionary of kept players or None if kept_players.csv was not processed for the season
+    """
+    path = league_config.path(season, 'kept_players/processed_kept_players.json')
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        text = f.read()
+    metrics.json_bytes('read', 'processed_kept_players.json', len(text))
+    return json.loads(text)
+
+
+def derive_kept_players(draft_dict, previous_kept, manual_kept=None):
+    """ Work out the kept players of a season from its draft and the kept players of the season before
+
+    A player marked as a keeper in the draft has been kept one year more than the season before, if the same manager
+    kept him the season before. Otherwise this is his first year kept.
+
+    kept_dict has the following structure:
+        {player_id: {'player_name': name of player, 'years_kept': years the player has been kept,
+                     'team_id': user_id of the manager that kept the player}}
+
+    Args:
+        draft_dict (dict): Dictionary of all drafted players in the season
+        previous_kept (dict): kept_dict of the season before
+        manual_kept (dict): Kept players from processed_kept_players.json. Used for players not marked in the draft.
+
+    Returns:
+        kept_dict (dict): Dictionary of kept players
+    """
+    kept_dict = dict()
+
+    for player_id, pick in draft_dict.items():
+        if not pick['keeper']:
+            continue
+        years_kept = 1
+        previous = previous_kept.get(player_id)
+        # Kept players from processed_kept_players.json do not know the user_id of the manager
+        if previous is not None and previous.get('team_id') in (None, pick['team_id']):
+            years_kept += int(previous['years_kept'])
+        kept_dict[player_id] = dict()
+        kept_dict[player_id]['player_name'] = pick['full_name']
+        kept_dict[player_id]['years_kept'] = years_kept
+        kept_dict[player_id]['team_id'] = pick['team_id']
+
+    for player_id, kept in (manual_kept or dict()).items():
+        if player_id not in kept_dict:
+            kept_dict[player_id] = kept
+
+    return kept_dict
+
+
+class KeeperChains(object):
+    """ Kept players of every season, worked out from the archived drafts
+
+    Args:
+        load_draft (func): Function that takes a season and returns its draft_dict, or None if it is not saved
+        load_manual (func): Function that takes a season and returns its processed kept players, or None
+        first_season (int): First season of the league. No one was kept that year.
+    """
+    def __init__(self, load_draft=load_archived_draft, load_manual=load_manual_kept, first_season=first_season):
+        self.load_draft = load_draft
+        self.load_manual = load_manual
+        self.first_season = first_season
+        # {season: kept_dict} of past seasons
+        self._seasons = dict()
+        self._lock = threading.Lock()
+
+    def kept_players(self, season, draft_dict=None):
+        """ Get the kept players of a season
+
+        Args:
+            season (int): Year of the season
+            draft_dict (dict): Draft of the season, if it was just requested from the Sleeper API. The season is
+                worked out again every time a draft_dict is given, since the draft of the current season can change.
+
+        Returns:
+            kept_dict (dict): Dictionary of kept players
+        """
+        if season < self.first_season:
+            return dict()
+        if draft_dict is None:
+            with self._lock:
+                if season in self._seasons:
+                    metrics.cache('keeper_chains', 'hit')
+                    return self._seasons[season]
+            metrics.cache('keeper_chains', 'miss')
+            draft_dict = self.load_draft(season)
+            if draft_dict is None:
+                # Without the draft, the seasons before do not matter. Not remembered, so the season is worked out
+                # again once its draft is saved.
+                logger.debug('The %s draft has not been saved. Only using processed_kept_players.json', season)
+                return derive_kept_players(dict(), dict(), self.load_manual(season))
+            kept_dict = self._derive(season, draft_dict)
+            with self._lock:
+                self._seasons[season] = kept_dict
+            return kept_dict
+        return self._derive(season, draft_dict)
+
+    def clear(self):
+        """ Forget every season that was worked out """
+        with self._lock:
+            self._seasons.clear()
+
+    def _derive(self, season, draft_dict):
+        previous_kept = self.kept_players(season - 1)
+        kept_dict = derive_kept_players(draft_dict, previous_kept, self.load_manual(season))
+        logger.debug('%s kept players in %s', len(kept_dict), season)
+        return kept_dict
+
+
+def league_keeper_chains(league_config):
+    """ KeeperChains for the archived drafts of a league
+
+    Args:
+        league_config (LeagueConfig): League to work out the kept players of
+
+    Returns:
+        keeper_chains (KeeperChains): Kept players of every season of the league
+    """
+    return KeeperChains(partial(load_archived_draft, league_config=league_config),
+                        partial(load_manual_kept, league_config=league_config), league_config.first_season)
@@ -0,0 +1,100 @@
+import logging
+import sys
+from pprint import pformat
+
+# This is a helper module for logging in sleeper_keeper.py and its helper modules.
+# Every module gets a logger under the 'sleeper_keeper' logger. Dumps of whole data structures are logged at debug
+# level with LazyPformat, so pformat is only run when debug logging is turned on with --debug. The handler counts
+# how many bytes have been logged, so a run that floods the logs is easy to spot.
+
+# Name of the logger every module logs under
+root_logger_name = 'sleeper_keeper'
+
+# Log format used by the command line. The webpage uses web_log_format, so its lines can be found in the uWSGI logs.
+cli_log_format = '%(message)s'
+web_log_format = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class LazyPformat(object):
+    """ Pretty prints an object only when the log message is actually formatted
+
+    Use it as an argument of a log call, never format it into the message:
+        logger.debug('Rosters: %s', LazyPformat(roster_dict))
+
+    Args:
+        args: Thing to pretty print
+    """
+    __slots__ = ('args',)
+
+    def __init__(self, args):
+        self.args = args
+
+    def __str__(self):
+        return pformat(self.args)
+
+
+class CountingStreamHandler(logging.StreamHandler):
+    """ Stream handler that counts the bytes it has logged """
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.bytes_logged = 0
+
+    def format(self, record):
+        message = super().format(record)
+        # Count the line terminator too
+        self.bytes_logged += len(message.encode('utf-8')) + len(self.terminator)
+        return message
+
+
+_handler = None
+
+
+def get_logger(name):
+    """ Get the logger for a module
+
+    Args:
+        name (str): __name__ of the module
+
+    Returns:
+        logger (Logger): Logger for the module
+    """
+    if name in (root_logger_name, '__main__'):
+        return logging.getLogger(root_logger_name)
+    return logging.getLogger('{}.{}'.format(root_logger_name, name))
+
+
+def setup_logging(debug=False, log_format=cli_log_format, stream=None):
+    """ Set up logging for sleeper_keeper. Can be called again to change the level.
+
+    Args:
+        debug (bool): Log debug messages, including the dumps of whole data structures
+        log_format (str): Format of each log line
+        stream (file): Stream to log to. Defaults to stdout.
+    """
+    global _handler
+
+    logger = logging.getLogger(root_logger_name)
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    logger.propagate = False
+
+    if _handler is None:
+        _handler = CountingStreamHandler(stream or sys.stdout)
+        logger.addHandler(_handler)
+    elif stream is not None:
+        _handler.setStream(stream)
+    _handler.setFormatter(logging.Formatter(log_format))
+
+
+def bytes_logged():
+    """ Number of bytes logged since the last reset
+
+    Returns:
+        bytes_logged (int): Number of bytes logged
+    """
+    return _handler.bytes_logged if _handler else 0
+
+
+def reset_bytes_logged():
+    """ Reset the count of bytes logged. Called at the start of each run. """
+    if _handler:
+        _handler.bytes_logged = 0
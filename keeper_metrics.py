@@ -0,0 +1,257 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# This is a helper module for sleeper_keeper.py and keeperwebpage.py.
+# Counters that show where the time goes when keeper results are slow:
+#     stage_wall_seconds_total / stage_cpu_seconds_total / stage_runs_total: time spent in each stage of main_program
+#     sleeper_requests_total / sleeper_bytes_total: requests made to the Sleeper API and bytes downloaded
+#     cache_requests_total: hits and misses of each cache
+#     json_bytes_total: bytes of json read and written
+#     keeper_refreshes_total: background keeper refreshes that ran, were coalesced or failed
+#     sleeper_retries_total / sleeper_deduplicated_total / sleeper_rate_limit_wait_seconds_total: Sleeper API requests
+#         that were tried again or shared with another thread, and time spent waiting for the rate limit
+#
+# Counters only go up. A single run is measured by taking a snapshot before the run and the diff after it. The
+# keeperwebpage /metrics route serves the counters in the Prometheus text format. Each uWSGI worker has its own
+# counters.
+
+# Prefix of every metric name
+metric_prefix = 'sleeper_keeper_'
+
+# Description of each metric for the Prometheus HELP line
+metric_help = {
+    'stage_wall_seconds_total': 'Wall clock seconds spent in each stage',
+    'stage_cpu_seconds_total': 'CPU seconds spent in each stage by the thread that ran it',
+    'stage_runs_total': 'Number of times each stage ran',
+    'sleeper_requests_total': 'Requests made to the Sleeper API',
+    'sleeper_bytes_total': 'Bytes downloaded from the Sleeper API',
+    'cache_requests_total': 'Cache lookups by result',
+    'json_bytes_total': 'Bytes of json read and written',
+    'keeper_refreshes_total': 'Background keeper refreshes by result',
+    'sleeper_retries_total': 'Sleeper API requests that were tried again, by reason',
+    'sleeper_deduplicated_total': 'Sleeper API requests that shared the response of an identical request in flight',
+    'sleeper_rate_limit_wait_seconds_total': 'Seconds spent waiting for the Sleeper API rate limit',
+}
+
+# Path segments of a Sleeper API url that come right before an id
+_id_segments = {'user', 'league', 'draft'}
+
+
+class Metrics(object):
+    """ Thread safe registry of counters. Each counter is a metric name and a set of labels. """
+    def __init__(self):
+        # {(name, ((label, value), ...)): value}
+        self._counters = dict()
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        """ Add to a counter
+
+        Args:
+            name (str): Name of the metric
+            value (int/float): Amount to add
+            labels: Labels of the counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def record_stage(self, stage, wall_seconds, cpu_seconds):
+        """ Record a run of a stage
+
+        Args:
+            stage (str): Name of the stage
+            wall_seconds (float): Wall clock seconds the stage took
+            cpu_seconds (float): CPU seconds the stage took
+        """
+        self.increment('stage_wall_seconds_total', wall_seconds, stage=stage)
+        self.increment('stage_cpu_seconds_total', cpu_seconds, stage=stage)
+        self.increment('stage_runs_total', stage=stage)
+
+    @contextmanager
+    def stage(self, stage):
+        """ Time the code in a with block as a stage
+
+        Args:
+            stage (str): Name of the stage
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+    def cache(self, cache, result):
+        """ Count a cache lookup
+
+        Args:
+            cache (str): Name of the cache
+            result (str): Result of the lookup, like 'hit' or 'miss'
+        """
+        self.increment('cache_requests_total', cache=cache, result=result)
+
+    def json_bytes(self, direction, file_name, size):
+        """ Count bytes of json read or written
+
+        Args:
+            direction (str): 'read' or 'write'
+            file_name (str): Name of the file, without the directory
+            size (int): Number of bytes
+        """
+        self.increment('json_bytes_total', size, direction=direction, file=file_name)
+
+    def add(self, counters):
+        """ Add counters from another process, like a refresh worker
+
+        Args:
+            counters (dict): Counters from Metrics.snapshot or Metrics.diff
+        """
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self):
+        """ Copy of every counter
+
+        Returns:
+            counters (dict): {(name, labels): value}
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def diff(self, before):
+        """ Counters that changed since a snapshot
+
+        Args:
+            before (dict): Snapshot taken with snapshot()
+
+        Returns:
+            counters (dict): {(name, labels): amount added since the snapshot}
+        """
+        changed = dict()
+        for key, value in self.snapshot().items():
+            added = value - before.get(key, 0)
+            if added:
+                changed[key] = added
+        return changed
+
+    def prometheus_text(self):
+        """ Every counter in the Prometheus text format
+
+        Returns:
+            text (str): Prometheus text exposition
+        """
+        counters = self.snapshot()
+        lines = list()
+        for name in sorted(set(key[0] for key in counters)):
+            full_name = metric_prefix + name
+            lines.append('# HELP {} {}'.format(full_name, metric_help.get(name, name)))
+            lines.append('# TYPE {} counter'.format(full_name))
+            for (counter_name, labels), value in sorted(counters.items(), key=lambda counter: counter[0]):
+                if counter_name != name:
+                    continue
+                label_text = ','.join('{}="{}"'.format(label, _escape(label_value)) for label, label_value in labels)
+                lines.append('{}{} {}'.format(full_name, '{' + label_text + '}' if label_text else '', value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    """ Escape a label value for the Prometheus text format
+
+    Args:
+        value: Label value
+
+    Returns:
+        value (str): Escaped label value
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def sleeper_endpoint(url):
+    """ Name of the Sleeper API endpoint of a url, with the ids and weeks taken out
+
+    'https://api.sleeper.app/v1/league/1234/transactions/5' becomes 'league/:id/transactions/:n'
+
+    Args:
+        url (str): Sleeper API url
+
+    Returns:
+        endpoint (str): Name of the endpoint
+    """
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment][1:]
+    endpoint = list()
+    for index, segment in enumerate(segments):
+        if index and segments[index - 1] in _id_segments:
+            endpoint.append(':id')
+        elif re.fullmatch(r'\d+', segment):
+            endpoint.append(':n')
+        else:
+            endpoint.append(segment)
+    return '/'.join(endpoint)
+
+
+def count_response(response, *args, **kwargs):
+    """ requests response hook that counts Sleeper API requests and bytes
+
+    Streamed responses are counted by their Content-Length, so the body is not read here.
+
+    Args:
+        response (Response): Response from the Sleeper API
+    """
+    endpoint = sleeper_endpoint(response.url)
+    metrics.increment('sleeper_requests_total', endpoint=endpoint, status=response.status_code)
+    if kwargs.get('stream'):
+        size = int(response.headers.get('Content-Length') or 0)
+    else:
+        size = len(response.content or b'')
+    metrics.increment('sleeper_bytes_total', size, endpoint=endpoint)
+
+
+def summarize(counters):
+    """ Turn counters into a dictionary that is easy to read and save as json
+
+    summary has the following structure:
+        {'stages': {stage: {'wall_seconds', 'cpu_seconds', 'runs'}},
+         'sleeper_requests': {endpoint: {'requests', 'bytes', 'statuses': {status: requests}}},
+         'caches': {cache: {result: lookups}},
+         'json_bytes': {'read' or 'write': {file: bytes}}}
+
+    Args:
+        counters (dict): Counters from Metrics.snapshot or Metrics.diff
+
+    Returns:
+        summary (dict): Summary of the counters
+    """
+    summary = dict()
+    summary['stages'] = dict()
+    summary['sleeper_requests'] = dict()
+    summary['caches'] = dict()
+    summary['json_bytes'] = dict()
+
+    stage_fields = {'stage_wall_seconds_total': 'wall_seconds', 'stage_cpu_seconds_total': 'cpu_seconds',
+                    'stage_runs_total': 'runs'}
+    for (name, labels), value in sorted(counters.items()):
+        labels = dict(labels)
+        if name in stage_fields:
+            summary['stages'].setdefault(labels['stage'], dict())[stage_fields[name]] = value
+        elif name == 'sleeper_requests_total':
+            endpoint = summary['sleeper_requests'].setdefault(
+                labels['endpoint'], {'requests': 0, 'bytes': 0, 'statuses': dict()})
+            endpoint['requests'] += value
+            endpoint['statuses'][str(labels['status'])] = value
+        elif name == 'sleeper_bytes_total':
+            summary['sleeper_requests'].setdefault(
+                labels['endpoint'], {'requests': 0, 'bytes': 0, 'statuses': dict()})['bytes'] += value
+        elif name == 'cache_requests_total':
+            summary['caches'].setdefault(labels['cache'], dict())[labels['result']] = value
+        elif name == 'json_bytes_total':
+            summary['json_bytes'].setdefault(labels['direction'], dict())[labels['file']] = value
+    return summary
+
+
+# Counters of this process
+metrics = Metrics()
@@ -0,0 +1,255 @@
+import sys
+
+# This is a helper module for sleeper_keeper.py, keeper_report.py and keeper_snapshot.py.
+# The keeper_dict used to be {owner: {'owner_id': id, player_id: player, 'lost_draft_picks': pick, ...}}, so everything
+# that walked it had to skip the owner id and traded pick keys, and each player was the shared player_dict entry with
+# the keeper information added to it. Each owner is now an OwnerKeepers record with the eligible keepers and the traded
+# draft picks kept apart, and each keeper is a KeeperCandidate of its own. The records use __slots__, so a keeper takes
+# a fraction of the memory of a dictionary, and positions are interned so every keeper at a position shares one string.
+#
+# keeper_dict has the following structure:
+#     {owner name: OwnerKeepers}
+#
+# keeper_dict.json and the keeper snapshot store each OwnerKeepers as:
+#     {'owner_id': id, 'keepers': {player_id: keeper}, 'pick_trades': [pick trade]}
+
+# Kinds of pick trades. These were the keys of the traded picks in the old keeper_dict.
+lost_pick = 'lost_draft_picks'
+gained_pick = 'gained_draft_picks'
+
+
+def intern_position(position):
+    """ Intern a position, so every keeper at the position shares one string
+
+    Args:
+        position (str): Position of a player. Can be None for players Sleeper does not give a position.
+
+    Returns:
+        position (str): Interned position
+    """
+    if isinstance(position, str):
+        return sys.intern(position)
+    return position
+
+
+class KeeperCandidate(object):
+    """ A rostered player that is eligible to be kept
+
+    Args:
+        player_id (str): Sleeper player id
+        player_name (str): Name of the player
+        position (str): Position of the player
+        keeper_cost (int): Draft round it costs to keep the player
+        years_kept (int): Years in a row the player has been kept. 0 if he was not kept.
+        drafted (bool): The player was drafted this season
+        draft_round (int): Round the player was drafted in. None if he was not drafted.
+        pick_number (int): Pick the player was drafted with. None if he was not drafted.
+        is_keeper (bool): The player was a keeper in the draft. None if he was not drafted.
+    """
+    __slots__ = ('player_id', 'player_name', 'position', 'keeper_cost', 'years_kept', 'drafted', 'draft_round',
+                 'pick_number', 'is_keeper')
+
+    def __init__(self, player_id, player_name, position, keeper_cost, years_kept=0, drafted=False, draft_round=None,
+                 pick_number=None, is_keeper=None):
+        self.player_id = player_id
+        self.player_name = player_name
+        self.position = intern_position(position)
+        self.keeper_cost = keeper_cost
+        self.years_kept = years_kept
+        self.drafted = drafted
+        self.draft_round = draft_round
+        self.pick_number = pick_number
+        self.is_keeper = is_keeper
+
+    def __repr__(self):
+        return 'KeeperCandidate({!r}, {!r}, {!r}, keeper_cost={!r}, years_kept={!r})'.format(
+            self.player_id, self.player_name, self.position, self.keeper_cost, self.years_kept)
+
+    def to_dict(self):
+        """ Dictionary of the keeper for json, with the same keys as the old keeper_dict entries
+
+        Returns:
+            keeper (dict): {'player_name', 'position', 'drafted', 'pick_number', 'round', 'is_keeper', 'keeper_cost',
+                            'years_kept'}. The draft keys are only there if the player was drafted.
+        """
+        keeper = dict()
+        keeper['player_name'] = self.player_name
+        keeper['position'] = self.position
+        keeper['drafted'] = self.drafted
+        if self.drafted:
+            keeper['pick_number'] = self.pick_number
+            keeper['round'] = self.draft_round
+            keeper['is_keeper'] = self.is_keeper
+        keeper['keeper_cost'] = self.keeper_cost
+        keeper['years_kept'] = self.years_kept
+        return keeper
+
+    @classmethod
+    def from_dict(cls, player_id, keeper):
+        """ Make a KeeperCandidate from its json dictionary
+
+        Args:
+            player_id (str): Sleeper player id
+            keeper (dict): Dictionary made by to_dict
+
+        Returns:
+            candidate (KeeperCandidate): Keeper candidate
+        """
+        return cls(player_id, keeper['player_name'], keeper['position'], keeper['keeper_cost'],
+                   keeper.get('years_kept', 0), keeper.get('drafted', False), keeper.get('round'),
+                   keeper.get('pick_number'), keeper.get('is_keeper'))
+
+
+class PickTrade(object):
+    """ A draft pick an owner traded away or acquired
+
+    Args:
+        kind (str): lost_pick or gained_pick
+        draft_round (int): Round of the pick
+        season (str): Season of the pick
+        new_owner (str): Owner on the other side of the trade. None if he is not in the league anymore.
+    """
+    __slots__ = ('kind', 'draft_round', 'season', 'new_owner')
+
+    def __init__(self, kind, draft_round, season, new_owner=None):
+        self.kind = kind
+        self.draft_round = draft_round
+        self.season = season
+        self.new_owner = new_owner
+
+    def __repr__(self):
+        return 'PickTrade({!r}, {!r}, {!r}, {!r})'.format(self.kind, self.draft_round, self.season, self.new_owner)
+
+    def to_dict(self):
+        """ Dictionary of the pick for json
+
+        Returns:
+            pick (dict): {'round': round, 'season': season, 'new_owner': owner on the other side of the trade}
+        """
+        pick = dict()
+        pick['round'] = self.draft_round
+        pick['season'] = self.season
+        pick['new_owner'] = self.new_owner
+        return pick
+
+    @classmethod
+    def from_dict(cls, kind, pick):
+        """ Make a PickTrade from its json dictionary
+
+        Args:
+            kind (str): lost_pick or gained_pick
+            pick (dict): Dictionary made by to_dict
+
+        Returns:
+            trade (PickTrade): Pick trade
+        """
+        return cls(kind, pick['round'], pick['season'], pick.get('new_owner'))
+
+
+class OwnerKeepers(object):
+    """ The eligible keepers and traded draft picks of an owner
+
+    Args:
+        owner_id (str): Sleeper user id of the owner
+    """
+    __slots__ = ('owner_id', 'keepers', 'pick_trades')
+
+    def __init__(self, owner_id):
+        self.owner_id = owner_id
+        # {player_id: KeeperCandidate}, in roster order
+        self.keepers = dict()
+        # PickTrades, in the order they were traded
+        self.pick_trades = list()
+
+    def __repr__(self):
+        return 'OwnerKeepers({!r}, {} keepers, {} pick trades)'.format(
+            self.owner_id, len(self.keepers), len(self.pick_trades))
+
+    def add_keeper(self, keeper):
+        """ Add an eligible keeper
+
+        Args:
+            keeper (KeeperCandidate): Keeper to add
+        """
+        self.keepers[keeper.player_id] = keeper
+
+    def add_pick_trade(self, trade):
+        """ Add a traded draft pick. Only the last trade of each kind is kept, like the old keeper_dict.
+
+        Args:
+            trade (PickTrade): Pick trade to add
+        """
+        for index, kept_trade in enumerate(self.pick_trades):
+            if kept_trade.kind == trade.kind:
+                self.pick_trades[index] = trade
+                return
+        self.pick_trades.append(trade)
+
+    def to_dict(self):
+        """ Dictionary of the owner for json
+
+        Returns:
+            owner (dict): {'owner_id': id, 'keepers': {player_id: keeper}, 'pick_trades': [pick trade]}. Each pick
+                trade also has its 'kind'.
+        """
+        owner = dict()
+        owner['owner_id'] = self.owner_id
+        owner['keepers'] = {player_id: keeper.to_dict() for player_id, keeper in self.keepers.items()}
+        owner['pick_trades'] = list()
+        for trade in self.pick_trades:
+            pick = trade.to_dict()
+            pick['kind'] = trade.kind
+            owner['pick_trades'].append(pick)
+        return owner
+
+    @classmethod
+    def from_dict(cls, owner):
+        """ Make an OwnerKeepers from its json dictionary
+
+        Snapshots published before the keeper records have the old {'owner_id': id, player_id: player, ...} layout.
+        Those are read too, so a running service can serve them until the next refresh.
+
+        Args:
+            owner (dict): Dictionary made by to_dict
+
+        Returns:
+            owner_keepers (OwnerKeepers): Keepers of the owner
+        """
+        owner_keepers = cls(owner.get('owner_id'))
+        if 'keepers' not in owner:
+            for key, value in owner.items():
+                if key in (lost_pick, gained_pick):
+                    owner_keepers.add_pick_trade(PickTrade.from_dict(key, value))
+                elif key != 'owner_id':
+                    owner_keepers.add_keeper(KeeperCandidate.from_dict(key, value))
+            return owner_keepers
+
+        for player_id, keeper in owner['keepers'].items():
+            owner_keepers.add_keeper(KeeperCandidate.from_dict(player_id, keeper))
+        for pick in owner['pick_trades']:
+            owner_keepers.pick_trades.append(PickTrade.from_dict(pick['kind'], pick))
+        return owner_keepers
+
+
+def keeper_dict_to_json(keeper_dict):
+    """ Convert a keeper_dict to plain dictionaries for json
+
+    Args:
+        keeper_dict (dict): {owner name: OwnerKeepers}
+
+    Returns:
+        keeper_json (dict): {owner name: dictionary made by OwnerKeepers.to_dict}
+    """
+    return {owner: owner_keepers.to_dict() for owner, owner_keepers in keeper_dict.items()}
+
+
+def keeper_dict_from_json(keeper_json):
+    """ Convert a keeper_dict loaded from json back to keeper records
+
+    Args:
+        keeper_json (dict): {owner name: dictionary made by OwnerKeepers.to_dict}
+
+    Returns:
+        keeper_dict (dict): {owner name: OwnerKeepers}
+    """
+    return {owner: OwnerKeepers.from_dict(owner_json) for owner, owner_json in keeper_json.items()}
@@ -0,0 +1,158 @@
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from keeper_log import get_logger
+from keeper_metrics import metrics
+from keeper_snapshot import atomic_open
+from league_config import default_data_dir
+from offline_bundle import build_bundle_from_files
+from pathlib import Path
+
+# This is a helper module for sleeper_keeper.py.
+# With --refresh, main_program saves everything it got from the Sleeper API to {data_dir}/{year}, and with --debug it
+# saves the same data to debug_files. Each dataset is serialized once, streamed straight to its file with json.dump,
+# and the debug copy is a hard link to the same file instead of a second copy. The saving is done by a background
+# writer thread, so main_program can publish the keeper results without waiting on the disk.
+#
+# There is only one writer thread, so the writes of two runs never mix. Call wait_for_writes before reading the saved
+# data files, or before the process exits.
+
+logger = get_logger(__name__)
+
+# Directory the debug copies are saved to
+debug_dir = 'debug_files'
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='keeper_persist')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _to_json(obj):
+    """ json.dump default for objects json can not serialize, like a PlayerTable
+
+    Args:
+        obj: Object to serialize
+
+    Returns:
+        data: Data json can serialize
+    """
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError('{} is not JSON serializable'.format(type(obj).__name__))
+
+
+def write_json(path, data):
+    """ Stream data to a file as json. The file is atomically moved into place when it is done.
+
+    Args:
+        path (str): Path of the file
+        data: Data to save
+
+    Returns:
+        size (int): Number of bytes written
+    """
+    with atomic_open(path) as f:
+        json.dump(data, f, default=_to_json)
+        size = f.tell()
+    metrics.json_bytes('write', Path(path).name, size)
+    return size
+
+
+def link_file(source, destination):
+    """ Make destination a hard link to source. Copies the file if a hard link can not be made.
+
+    Args:
+        source (str): Path of the existing file
+        destination (str): Path of the link
+    """
+    Path(destination).parent.mkdir(parents=True, exist_ok=True)
+    temp_path = '{}.link'.format(destination)
+    try:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        os.link(source, temp_path)
+    except OSError:
+        # Hard links do not work across file systems
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, destination)
+
+
+def save_datasets(year, datasets, save, debug, debug_datasets=None, data_dir=default_data_dir):
+    """ Save the datasets of a run
+
+    Args:
+        year (int): Year of YAFL 2.0
+        datasets (dict): {file name: data} saved to {data_dir}/{year} if save and to debug_files if debug
+        save (bool): Save the datasets to {data_dir}/{year} and rebuild the offline bundle
+        debug (bool): Save the datasets and debug_datasets to debug_files
+        debug_datasets (dict): {file name: data} only saved to debug_files
+        data_dir (str): Directory the files of the league are saved to
+    """
+    with metrics.stage('save_data_files'):
+        for file_name, data in datasets.items():
+            data_path = '{}/{}/{}'.format(data_dir, year, file_name)
+            debug_path = '{}/{}'.format(debug_dir, file_name)
+            if save:
+                write_json(data_path, data)
+                if debug:
+                    link_file(data_path, debug_path)
+            elif debug:
+                write_json(debug_path, data)
+
+        if debug:
+            for file_name, data in (debug_datasets or dict()).items():
+                write_json('{}/{}'.format(debug_dir, file_name), data)
+
+    if save:
+        # Bundle everything offline mode needs into one file
+        with metrics.stage('build_offline_bundle'):
+            build_bundle_from_files(year, data_dir)
+
+
+def save_in_background(year, datasets, save, debug, debug_datasets=None, data_dir=default_data_dir):
+    """ Queue the datasets of a run to be saved by the writer thread
+
+    The datasets must not be changed after they are queued.
+
+    Args:
+        year (int): Year of YAFL 2.0
+        datasets (dict): {file name: data} saved to {data_dir}/{year} if save and to debug_files if debug
+        save (bool): Save the datasets to {data_dir}/{year} and rebuild the offline bundle
+        debug (bool): Save the datasets and debug_datasets to debug_files
+        debug_datasets (dict): {file name: data} only saved to debug_files
+        data_dir (str): Directory the files of the league are saved to
+
+    Returns:
+        future (Future): Finishes when the datasets are saved
+    """
+    future = _writer.submit(save_datasets, year, datasets, save, debug, debug_datasets, data_dir)
+    with _pending_lock:
+        _pending.add(future)
+    future.add_done_callback(_finished)
+    return future
+
+
+def _finished(future):
+    """ Log a failed save and forget the future
+
+    Args:
+        future (Future): Future of a save
+    """
+    with _pending_lock:
+        _pending.discard(future)
+    if future.exception() is not None:
+        logger.error('Unable to save the data files: %s', future.exception())
+
+
+def wait_for_writes():
+    """ Wait until every queued save is finished """
+    with _pending_lock:
+        pending = list(_pending)
+    for future in pending:
+        try:
+            future.result()
+        except Exception:
+            # Already logged by _finished
+            pass
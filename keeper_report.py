@@ -0,0 +1,437 @@
+import csv
+import html
+import io
+import json
+from keeper_model import lost_pick
+from keeper_snapshot import atomic_open
+from league_config import default_league
+
+# This is a helper module for sleeper_keeper.py.
+# The keeper reports (final_keepers.txt, final_keepers_{year}.csv, positional_keepers.txt, ...) used to each walk the
+# keeper_dict on their own. render_reports walks the keeper_dict once and hands every owner, traded pick and player to
+# each registered sink. A sink builds its report in memory and writes the whole report at once when it is closed.
+# Adding another report format is adding another sink.
+#
+# The keeper_dict is {owner name: OwnerKeepers}. See keeper_model.py.
+
+# Positions that can be used for a positional report
+eligible_positions = ['QB', 'RB', 'WR', 'TE', 'DEF']
+
+
+class ReportSink(object):
+    """ Base class for a keeper report
+
+    Subclasses override the methods for the parts of the keeper_dict they report on, and call write to add text.
+
+    Args:
+        name (str): Name of the report
+        path (str): Path the report is written to. None to only keep the report in memory.
+    """
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self._parts = list()
+
+    def write(self, text):
+        """ Add text to the report
+
+        Args:
+            text (str): Text to add
+        """
+        self._parts.append(text)
+
+    def start(self):
+        """ Called before the first owner """
+        pass
+
+    def owner(self, owner):
+        """ Called for each owner
+
+        Args:
+            owner (str): Owner name
+        """
+        pass
+
+    def lost_pick(self, owner, pick):
+        """ Called when an owner traded away a draft pick
+
+        Args:
+            owner (str): Owner name
+            pick (PickTrade): Traded pick. new_owner is the owner the pick was traded to.
+        """
+        pass
+
+    def gained_pick(self, owner, pick):
+        """ Called when an owner acquired a draft pick
+
+        Args:
+            owner (str): Owner name
+            pick (PickTrade): Traded pick. new_owner is the owner the pick was acquired from.
+        """
+        pass
+
+    def player(self, owner, player_id, player):
+        """ Called for each eligible keeper of an owner
+
+        Args:
+            owner (str): Owner name
+            player_id (str): Sleeper player id
+            player (KeeperCandidate): Keeper information for the player
+        """
+        pass
+
+    def finish(self):
+        """ Called after the last owner """
+        pass
+
+    def close(self, echo=False):
+        """ Write the report to its path
+
+        Args:
+            echo (bool): Also print the report to stdout
+
+        Returns:
+            text (str): Text of the report
+        """
+        text = ''.join(self._parts)
+        if self.path:
+            with atomic_open(self.path) as f:
+                f.write(text)
+        if echo:
+            print(text, end='')
+        return text
+
+
+class TextReportSink(ReportSink):
+    """ Human readable keeper report. This is the report served by the webpage.
+
+    Args:
+        year (int): Year of YAFL 2.0
+        path (str): Path of the report. Defaults to {data_dir}/{year}/final_keepers.txt
+        league_config (LeagueConfig): League of the report
+    """
+    def __init__(self, year, path=None, league_config=default_league):
+        super().__init__('final_keepers', path or league_config.path(year, 'final_keepers.txt'))
+        self.year = year
+        self.league_name = league_config.name
+
+    def start(self):
+        self.write('The {} Eligible Keepers for {}\n'.format(self.league_name, self.year))
+
+    def owner(self, owner):
+        self.write('Manager: {}\n'.format(owner))
+
+    def lost_pick(self, owner, pick):
+        self.write('\t*Lost a {} round {} draft pick. Traded to {}\n'.format(
+            pick.season, pick.draft_round, pick.new_owner))
+
+    def gained_pick(self, owner, pick):
+        self.write('\t*Gained a {} round {} draft pick acquired from {}\n'.format(
+            pick.season, pick.draft_round, pick.new_owner))
+
+    def player(self, owner, player_id, player):
+        # Only print the years kept if it not 0. Always printing the years kept cluttered the screen
+        if player.years_kept == 0:
+            self.write('\t{} {} - Keeper Cost: Round {}.\n'.format(
+                player.player_name, player.position, player.keeper_cost))
+        else:
+            self.write('\t{} {} - Keeper Cost: Round {}. Years Kept {}\n'.format(
+                player.player_name, player.position, player.keeper_cost, player.years_kept))
+
+
+class CsvReportSink(ReportSink):
+    """ Keeper report as a csv file for Meat "Scope Creep" Wizard
+
+    Args:
+        year (int): Year of YAFL 2.0
+        path (str): Path of the report. Defaults to {data_dir}/{year}/final_keepers_{year}.csv
+        league_config (LeagueConfig): League of the report
+    """
+    def __init__(self, year, path=None, league_config=default_league):
+        super().__init__('final_keepers_csv', path or league_config.path(year, 'final_keepers_{}.csv'.format(year)))
+        self.year = year
+        self.league_name = league_config.name
+
+    def start(self):
+        self.write('The {} Eligible Keepers for {}\n'.format(self.league_name, self.year))
+        self.write('MeatWizard is a little scope-creeping bitch\n')
+        self.write('Delete these first 3 lines and it will import nice as a CSV.\n')
+        self.write('Manager,Player_Name,Position,Keeper_Cost,Years_kept\n')
+
+    def lost_pick(self, owner, pick):
+        self.write('*Lost a {} round {} draft pick. Traded to {},'.format(
+            pick.season, pick.draft_round, pick.new_owner))
+
+    def gained_pick(self, owner, pick):
+        self.write('*Gained a {} round {} draft pick acquired from {},'.format(
+            pick.season, pick.draft_round, pick.new_owner))
+
+    def player(self, owner, player_id, player):
+        self.write('{},{},{},{},{}\n'.format(
+            owner, player.player_name, player.position, player.keeper_cost, player.years_kept))
+
+
+class KeeperIndexSink(ReportSink):
+    """ Per-position and per-cost-round indexes of the eligible keepers
+
+    The indexes are built once per snapshot, so a position or round can be listed without going through the whole
+    keeper_dict. close returns the indexes instead of text.
+
+    indexes has the following structure:
+    {'positions': {position: [keeper, ...] sorted by keeper cost, then player name},
+     'rounds': {keeper cost: [keeper, ...] sorted by position, then player name}}
+
+    keeper: {'manager', 'player_id', 'player_name', 'position', 'keeper_cost', 'years_kept'}
+    """
+    def __init__(self):
+        super().__init__('keeper_indexes', None)
+        self.keepers = list()
+
+    def player(self, owner, player_id, player):
+        keeper = dict()
+        keeper['manager'] = owner
+        keeper['player_id'] = player_id
+        keeper['player_name'] = player.player_name
+        keeper['position'] = player.position
+        keeper['keeper_cost'] = player.keeper_cost
+        keeper['years_kept'] = player.years_kept
+        self.keepers.append(keeper)
+
+    def close(self, echo=False):
+        positions = dict()
+        rounds = dict()
+        for keeper in sorted(self.keepers, key=lambda keeper: (keeper['keeper_cost'], keeper['player_name'])):
+            positions.setdefault(str(keeper['position']).upper(), list()).append(keeper)
+        for keeper in sorted(self.keepers, key=lambda keeper: (str(keeper['position']), keeper['player_name'])):
+            # Keys are strings, so the indexes are the same after a round trip through json
+            rounds.setdefault(str(keeper['keeper_cost']), list()).append(keeper)
+        return {'positions': positions, 'rounds': rounds}
+
+
+class JsonReportSink(ReportSink):
+    """ Keeper report as json
+
+    final_keepers.json has the following structure:
+    {'year': year,
+     'managers': [{'manager': owner name,
+                   'keepers': [{'player_id', 'player_name', 'position', 'keeper_cost', 'years_kept'}],
+                   'lost_draft_picks': [{'round', 'season', 'new_owner'}],
+                   'gained_draft_picks': [{'round', 'season', 'new_owner'}]}]}
+
+    Args:
+        year (int): Year of YAFL 2.0
+        path (str): Path of the report. Defaults to {data_dir}/{year}/final_keepers.json
+        league_config (LeagueConfig): League of the report
+    """
+    def __init__(self, year, path=None, league_config=default_league):
+        super().__init__('final_keepers_json', path or league_config.path(year, 'final_keepers.json'))
+        self.year = year
+        self.managers = list()
+
+    def owner(self, owner):
+        manager = dict()
+        manager['manager'] = owner
+        manager['keepers'] = list()
+        manager['lost_draft_picks'] = list()
+        manager['gained_draft_picks'] = list()
+        self.managers.append(manager)
+
+    def lost_pick(self, owner, pick):
+        self.managers[-1]['lost_draft_picks'].append(pick.to_dict())
+
+    def gained_pick(self, owner, pick):
+        self.managers[-1]['gained_draft_picks'].append(pick.to_dict())
+
+    def player(self, owner, player_id, player):
+        keeper = dict()
+        keeper['player_id'] = player_id
+        keeper['player_name'] = player.player_name
+        keeper['position'] = player.position
+        keeper['keeper_cost'] = player.keeper_cost
+        keeper['years_kept'] = player.years_kept
+        self.managers[-1]['keepers'].append(keeper)
+
+    def finish(self):
+        self.write(json.dumps({'year': self.year, 'managers': self.managers}))
+
+
+class HtmlReportSink(ReportSink):
+    """ Keeper report as an html table
+
+    Args:
+        year (int): Year of YAFL 2.0
+        path (str): Path of the report. Defaults to {data_dir}/{year}/final_keepers.html
+        league_config (LeagueConfig): League of the report
+    """
+    def __init__(self, year, path=None, league_config=default_league):
+        super().__init__('final_keepers_html', path or league_config.path(year, 'final_keepers.html'))
+        self.year = year
+        self.league_name = league_config.name
+
+    def start(self):
+        self.write('<h2>The {} Eligible Keepers for {}</h2>\n<table>\n'.format(
+            html.escape(self.league_name), self.year))
+        self.write('<tr><th>Manager</th><th>Player</th><th>Position</th><th>Keeper Cost</th><th>Years Kept</th></tr>\n')
+
+    def lost_pick(self, owner, pick):
+        self.write('<tr><td>{}</td><td colspan="4">Lost a {} round {} draft pick. Traded to {}</td></tr>\n'.format(
+            html.escape(owner), pick.season, pick.draft_round, html.escape(str(pick.new_owner))))
+
+    def gained_pick(self, owner, pick):
+        self.write('<tr><td>{}</td><td colspan="4">Gained a {} round {} draft pick acquired from {}</td></tr>\n'.format(
+            html.escape(owner), pick.season, pick.draft_round, html.escape(str(pick.new_owner))))
+
+    def player(self, owner, player_id, player):
+        self.write('<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>\n'.format(
+            html.escape(owner),
+            html.escape(player.player_name),
+            html.escape(str(player.position)),
+            player.keeper_cost,
+            player.years_kept))
+
+    def finish(self):
+        self.write('</table>\n')
+
+
+# Optional report formats that can be turned on from the command line
+report_formats = {
+    'json': JsonReportSink,
+    'html': HtmlReportSink,
+}
+
+
+def render_reports(keeper_dict, sinks, echo=False):
+    """ Walk the keeper_dict once and generate every report
+
+    Args:
+        keeper_dict (dict): Dictionary of final keeper information
+        sinks (list): ReportSinks to generate
+        echo (bool): Also print the reports to stdout
+
+    Returns:
+        reports (dict): {report name: text of the report}
+    """
+    for sink in sinks:
+        sink.start()
+
+    for owner in keeper_dict:
+        for sink in sinks:
+            sink.owner(owner)
+
+        owner_keepers = keeper_dict[owner]
+        for player_id, player in owner_keepers.keepers.items():
+            for sink in sinks:
+                sink.player(owner, player_id, player)
+
+        for pick in owner_keepers.pick_trades:
+            # Traded away draft pick information
+            if pick.kind == lost_pick:
+                for sink in sinks:
+                    sink.lost_pick(owner, pick)
+            # Gained draft pick information
+            else:
+                for sink in sinks:
+                    sink.gained_pick(owner, pick)
+
+    reports = dict()
+    for sink in sinks:
+        sink.finish()
+        reports[sink.name] = sink.close(echo)
+    return reports
+
+
+def iter_keepers(keeper_dict, manager=None, position=None, max_cost=None):
+    """ Walk the eligible keepers in a keeper_dict
+
+    Args:
+        keeper_dict (dict): Dictionary of final keeper information
+        manager (str): Only keepers of this manager. Not case sensitive.
+        position (str): Only keepers at this position. Not case sensitive.
+        max_cost (int): Only keepers with a keeper cost round of max_cost or earlier
+
+    Returns:
+        keepers (generator): (manager, player_id, KeeperCandidate) for every matching keeper
+    """
+    for owner in keeper_dict:
+        if manager is not None and owner.lower() != manager.lower():
+            continue
+        for player_id, player in keeper_dict[owner].keepers.items():
+            if position is not None and str(player.position).upper() != position.upper():
+                continue
+            if max_cost is not None and player.keeper_cost > max_cost:
+                continue
+            yield owner, player_id, player
+
+
+def iter_keeper_csv(keeper_dict, manager=None, position=None, max_cost=None):
+    """ Generate a clean csv of the eligible keepers one line at a time
+
+    Unlike final_keepers_{year}.csv, there are no title lines or traded draft picks, so it imports as is.
+
+    Args:
+        keeper_dict (dict): Dictionary of final keeper information
+        manager (str): Only keepers of this manager
+        position (str): Only keepers at this position
+        max_cost (int): Only keepers with a keeper cost round of max_cost or earlier
+
+    Returns:
+        lines (generator): Lines of the csv, starting with the header
+    """
+    line = io.StringIO()
+    writer = csv.writer(line, lineterminator='\n')
+
+    def row(values):
+        writer.writerow(values)
+        text = line.getvalue()
+        line.seek(0)
+        line.truncate()
+        return text
+
+    yield row(['Manager', 'Player_Name', 'Position', 'Keeper_Cost', 'Years_kept'])
+    for owner, player_id, player in iter_keepers(keeper_dict, manager, position, max_cost):
+        yield row([owner, player.player_name, player.position, player.keeper_cost, player.years_kept])
+
+
+def build_keeper_indexes(keeper_dict):
+    """ Build the per-position and per-cost-round indexes for a keeper_dict
+
+    Args:
+        keeper_dict (dict): Dictionary of final keeper information
+
+    Returns:
+        indexes (dict): Indexes built by KeeperIndexSink
+    """
+    return render_reports(keeper_dict, [KeeperIndexSink()])['keeper_indexes']
+
+
+def format_position_keepers(indexes, position):
+    """ List the keeper costs for a position from the keeper indexes
+
+    Args:
+        indexes (dict): Indexes built by KeeperIndexSink
+        position (str): Position to list
+
+    Returns:
+        text (str): Keepers at the position, earliest keeper cost round first
+    """
+    lines = ['{} keeper costs\n'.format(position)]
+    for keeper in indexes['positions'].get(position.upper(), []):
+        lines.append('\t{} ({}) - Keeper Cost: Round {}\n'.format(
+            keeper['player_name'], keeper['manager'], keeper['keeper_cost']))
+    return ''.join(lines)
+
+
+def format_round_keepers(indexes, keeper_cost):
+    """ List the keepers that cost a given round from the keeper indexes
+
+    Args:
+        indexes (dict): Indexes built by KeeperIndexSink
+        keeper_cost (int): Keeper cost round to list
+
+    Returns:
+        text (str): Keepers that cost the round, grouped by position
+    """
+    lines = ['Round {} keepers\n'.format(keeper_cost)]
+    for keeper in indexes['rounds'].get(str(keeper_cost), []):
+        lines.append('\t{} {} ({})\n'.format(keeper['player_name'], keeper['position'], keeper['manager']))
+    return ''.join(lines)
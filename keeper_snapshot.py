@@ -0,0 +1,166 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from keeper_metrics import metrics
+from keeper_model import keeper_dict_from_json, keeper_dict_to_json
+from league_config import default_data_dir
+from pathlib import Path
+
+# This is a helper module for sleeper_keeper.py and keeperwebpage.py.
+# uWSGI runs several worker processes that read the keeper results while main_program may be rewriting them. Files
+# are never written in place. They are written to a temp file in the same directory and renamed over the old file,
+# which is atomic, so a reader always sees either the old file or the new file and never a partially written one.
+#
+# After main_program generates the keeper results, everything the webpage needs is published as a single snapshot
+# file: {data_dir}/{year}/keeper_snapshot.json. Each snapshot has a version stamp, so workers only reload the
+# snapshot when a newer one has been published. The keeper_dict of a loaded snapshot is made of keeper records again,
+# so the webpage walks it the same way main_program does.
+
+# Permissions mask of the process, read the first time a file is written. {'umask': umask}
+_umask = dict()
+_umask_lock = threading.Lock()
+
+# Snapshots already loaded by this process. {path: (stat key, snapshot)}
+_loaded_snapshots = dict()
+
+
+def get_umask():
+    """ Get the permissions mask of the process
+
+    On Linux the mask is read from /proc/self/status. Anywhere else os.umask can only read it by setting it, so it is
+    set to 0 and back, once, under a lock. Files another thread creates in between would get mode 0666.
+
+    Returns:
+        umask (int): Permissions mask of the process
+    """
+    with _umask_lock:
+        if 'umask' not in _umask:
+            try:
+                with open('/proc/self/status') as f:
+                    _umask['umask'] = next(int(line.split()[1], 8) for line in f if line.startswith('Umask:'))
+            except (OSError, StopIteration, IndexError, ValueError):
+                umask = os.umask(0)
+                os.umask(umask)
+                _umask['umask'] = umask
+        return _umask['umask']
+
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    """ Open a file for writing that is atomically moved into place when closed
+
+    If an exception is raised while writing, the temp file is removed and the existing file is left untouched.
+
+    Args:
+        path (str): Path of the file to write
+        mode (str): Write mode, 'w' or 'wb'
+
+    Yields:
+        f (file): File object to write to
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=str(path.parent), prefix='.{}.'.format(path.name), suffix='.tmp')
+    try:
+        # mkstemp creates the file readable only by the owner. Use the same permissions open() would.
+        os.chmod(temp_path, 0o666 & ~get_umask())
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, str(path))
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def snapshot_path(year, data_dir=default_data_dir):
+    """ Path of the published keeper snapshot for a year
+
+    Args:
+        year (int): Year of YAFL 2.0
+        data_dir (str): Directory the files of the league are saved to
+
+    Returns:
+        path (str): Path of the keeper snapshot
+    """
+    return '{}/{}/keeper_snapshot.json'.format(data_dir, year)
+
+
+def publish_snapshot(year, keeper_dict, reports, data_dir=default_data_dir):
+    """ Publish the keeper results for a year as a new snapshot
+
+    The snapshot contains the keeper_dict and the text of the reports generated by main_program.
+
+    snapshot has the following structure:
+    {'version': version stamp, 'year': year, 'created': time created, 'keeper_dict': {owner name: OwnerKeepers},
+     'final_keepers': text of final_keepers.txt, 'final_keepers_csv': text of final_keepers_{year}.csv or None,
+     'indexes': per-position and per-cost-round keeper indexes}
+
+    Args:
+        year (int): Year of YAFL 2.0
+        keeper_dict (dict): Dictionary of final keeper information. {owner name: OwnerKeepers}
+        reports (dict): {report name: text of the report} from keeper_report.render_reports
+        data_dir (str): Directory the files of the league are saved to
+
+    Returns:
+        snapshot (dict): The published snapshot
+    """
+    created = time.time()
+    snapshot = dict()
+    # Nanosecond timestamp, so a newer snapshot always has a larger version
+    snapshot['version'] = time.time_ns()
+    snapshot['year'] = year
+    snapshot['created'] = created
+    snapshot['keeper_dict'] = keeper_dict
+    snapshot['final_keepers'] = reports['final_keepers']
+    snapshot['final_keepers_csv'] = reports.get('final_keepers_csv')
+    snapshot['indexes'] = reports['keeper_indexes']
+
+    with atomic_open(snapshot_path(year, data_dir)) as f:
+        json.dump(dict(snapshot, keeper_dict=keeper_dict_to_json(keeper_dict)), f)
+        metrics.json_bytes('write', 'keeper_snapshot.json', f.tell())
+
+    return snapshot
+
+
+def load_snapshot(year, data_dir=default_data_dir):
+    """ Load the newest published keeper snapshot for a year
+
+    The snapshot is only read from disk when a new one has been published since the last load.
+
+    Args:
+        year (int): Year of YAFL 2.0
+        data_dir (str): Directory the files of the league are saved to
+
+    Returns:
+        snapshot (dict): Newest keeper snapshot, or None if one has not been published
+    """
+    path = snapshot_path(year, data_dir)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    # A published snapshot is a new file, so the inode changes even if the mtime does not
+    stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    loaded = _loaded_snapshots.get(path)
+    if loaded is not None and loaded[0] == stat_key:
+        metrics.cache('snapshot_file', 'hit')
+        return loaded[1]
+
+    metrics.cache('snapshot_file', 'miss')
+    with open(path, 'r') as f:
+        snapshot = json.load(f)
+    metrics.json_bytes('read', 'keeper_snapshot.json', stat.st_size)
+    snapshot['keeper_dict'] = keeper_dict_from_json(snapshot['keeper_dict'])
+
+    _loaded_snapshots[path] = (stat_key, snapshot)
+    return snapshot
+
@@ -1,95 +1,458 @@
-from flask import Flask, render_template, send_file
+import os
+import time
+from flask import Flask, Response, abort, jsonify, render_template, request
+from history_store import stored_years
+from keeper_cache import KeeperCache, SnapshotNotReady
+from keeper_log import get_logger, setup_logging, web_log_format
+from keeper_metrics import metrics
+from keeper_report import build_keeper_indexes, eligible_positions, format_position_keepers, format_round_keepers, \
+    iter_keeper_csv
+from keeper_snapshot import load_snapshot, snapshot_path
+from league_config import default_league, get_league, load_leagues
+from page_cache import PageCache, page_response
 from pprint import pformat
-from sleeper_keeper import main_program
+from refresh_pool import RefreshPool, generate
+from refresh_worker import LeaderLock, RefreshScheduler
 
 app = Flask(__name__)
 
-# Define eligible years as global list
-eligible_years = [2019, 2020]
-# Define curent_year as global. This is to avoid an issue in the off season where yaflkeepers would try to generate
-# a keeper list for the next year before the season started.
-current_year = 2020
+# Keep the uWSGI logs quiet. The dumps of whole data structures are only logged at debug level.
+setup_logging(log_format=web_log_format)
+logger = get_logger(__name__)
+
+# Seconds between checks of the history store for new seasons
+years_check_interval = 60
+# A refresh trigger is ignored if the keeper results were refreshed less than this many seconds ago
+trigger_min_age = 60
+# Seconds a page view waits before trying again when there are no keeper results yet
+retry_after = 5
+
+# Every league is served at /{league_id}/..., and YAFL 2.0 is also served without the league id. The keeper caches
+# below are keyed by league id, so each league has its own results.
+
+# Held by the one uWSGI worker that runs the scheduled refreshes and the refresh pool
+leader_lock = LeaderLock('data_files/refresh_scheduler.lock')
+
+# Worker processes that refresh the keeper results, so several leagues are refreshed at the same time. Only the leader
+# starts them. The other uWSGI workers hand their refreshes to the leader.
+refresh_pool = RefreshPool(leader_lock=leader_lock)
+
+
+def refresh_keepers(league_id, year):
+    """ Refresh the keeper results for a league and year from the Sleeper API
+
+    Args:
+        league_id (str): Id of the league
+        year (int): Year to refresh keeper results for
+    """
+    refresh_pool.refresh(league_id, year)
+
+
+def publish_saved_keepers(league_id, year):
+    """ Publish the keeper results for a league and year from the saved data files, without the Sleeper API
+
+    Used when there are no keeper results to serve yet, so the first page view does not wait on the Sleeper API.
+
+    Args:
+        league_id (str): Id of the league
+        year (int): Year to publish keeper results for
+    """
+    generate(league_id, year, offline=True)
+
+
+def load_keepers(league_id, year):
+    """ Load the published keeper snapshot for a league and year
+
+    Args:
+        league_id (str): Id of the league
+        year (int): Year of the keeper results
+    Returns:
+        snapshot (dict): Keeper snapshot or None if one has not been published
+    """
+    return load_snapshot(year, get_league(league_id).data_dir)
+
+
+def keeper_lock_path(league_id, year):
+    """ Path of the lock file used to refresh the keeper results for a league and year
+
+    Args:
+        league_id (str): Id of the league
+        year (int): Year of the keeper results
+    Returns:
+        path (str): Path of the lock file
+    """
+    return '{}.lock'.format(snapshot_path(year, get_league(league_id).data_dir))
+
+
+# Years of each league. {league_id: {'years': sorted list of years, 'checked': time the history store was checked}}
+_years = dict()
+
+
+def get_eligible_years(league_config=default_league):
+    """ Get the years with keeper results for a league
+
+    Only seasons that have drafted are eligible. This is to avoid an issue in the off season where yaflkeepers would
+    try to generate a keeper list for the next year before the season started.
+
+    Args:
+        league_config (LeagueConfig): League to get the years of
+    Returns:
+        years (list): Sorted list of eligible years
+    """
+    years = _years.setdefault(league_config.league_id, {'years': league_config.default_years, 'checked': None})
+    now = time.monotonic()
+    if years['checked'] is None or now - years['checked'] > years_check_interval:
+        try:
+            years['years'] = stored_years(league_config.default_years, league_config.history_path)
+        except Exception as e:
+            logger.error('Unable to read the history store of %s: %s', league_config.league_id, e)
+        years['checked'] = now
+    return years['years']
+
+
+def get_current_year(league_config=default_league):
+    """ Get the newest year with keeper results for a league
+
+    Args:
+        league_config (LeagueConfig): League to get the current year of
+    Returns:
+        year (int): Current year
+    """
+    return get_eligible_years(league_config)[-1]
+
+
+def get_year(league_config, year):
+    """ Get the year to show for a league. Years that are not eligible show the current year.
+
+    Args:
+        league_config (LeagueConfig): League to show
+        year (str): Year from the url or None
+    Returns:
+        year (int): Year to show
+    """
+    if year is not None and year.isnumeric():
+        year = int(year)
+    if year not in get_eligible_years(league_config):
+        year = get_current_year(league_config)
+    return year
+
+
+def find_league(league_id):
+    """ Get the config of the league in a url. Aborts with 404 if the league is not served.
+
+    Args:
+        league_id (str): Id of the league from the url. None for YAFL 2.0.
+    Returns:
+        league_config (LeagueConfig): League config
+    """
+    league_config = get_league(league_id)
+    if league_config is None:
+        abort(404)
+    return league_config
+
+
+def scheduled_keys():
+    """ Get the current year of every league for the refresh scheduler
+
+    Returns:
+        keys (list): List of (league_id, year)
+    """
+    return [(league_id, get_current_year(league_config)) for league_id, league_config in load_leagues().items()]
+
+
+# Cache of keeper snapshots so page views do not run main_program on every request
+keeper_cache = KeeperCache(refresh_keepers, load_keepers, keeper_lock_path, fallback_function=publish_saved_keepers)
+
+# Refresh the current year of every league in the background, so page views always find recent results
+refresh_scheduler = RefreshScheduler(keeper_cache, scheduled_keys, leader_lock)
+
+# Cache of rendered pages. Pages are rendered once per snapshot version and served from memory after that.
+page_cache = PageCache()
+
+
+def keeper_page(league_config, route, year, get_content):
+    """ Response for a page rendered from the keeper snapshot of a year
+
+    Args:
+        league_config (LeagueConfig): League of the keeper results
+        route (str): Name of the route. Pages with different content for the same year need different routes.
+        year (int): Year of the keeper results
+        get_content (func): Function that takes the snapshot and returns the text of the page
+    Returns:
+        Response with the rendered content.html template
+    """
+    snapshot = keeper_cache.get(league_config.league_id, year)
+    # The year menu is part of the page, so a new season renders the page again
+    version = (snapshot['version'], tuple(get_eligible_years(league_config)))
+    page = page_cache.get('{}/{}'.format(league_config.league_id, route), year, version,
+                          lambda: render_template('content.html', text=get_content(snapshot)))
+    return page_response(page)
+
+
+def file_page(league_config, route, year, path):
+    """ Response for a page rendered from a text file. The page is rendered again when the file changes.
+
+    Args:
+        league_config (LeagueConfig): League of the page
+        route (str): Name of the route
+        year (int): Year of the page
+        path (str): Path of the text file
+    Returns:
+        Response with the rendered content.html template
+    """
+    stat = os.stat(path)
+
+    def render():
+        with open(path, 'r') as f:
+            return render_template('content.html', text=f.read())
+
+    version = (stat.st_mtime_ns, stat.st_size, tuple(get_eligible_years(league_config)))
+    page = page_cache.get(route, year, version, render)
+    return page_response(page)
+
+
+@app.context_processor
+def navbar_links():
+    """ Years and url prefix of the league being shown, for the navbar in nav.html
+
+    Returns:
+        dict with nav_years, the eligible years of the league, and nav_prefix, '' for YAFL 2.0 or /{league_id}
+    """
+    view_args = request.view_args or dict()
+    league_id = view_args.get('league_id')
+    year = view_args.get('year')
+    # /{league_id} shows the current year of a league
+    if league_id is None and year is not None and not str(year).isnumeric():
+        league_id = year
+    league_config = get_league(league_id) or default_league
+
+    links = dict()
+    links['nav_years'] = get_eligible_years(league_config)
+    links['nav_prefix'] = '' if league_config is default_league else '/{}'.format(league_config.league_id)
+    return links
+
+
+@app.before_request
+def start_refresh_scheduler():
+    """ Start the refresh scheduler in this worker process. Only starts it on the first request. """
+    refresh_scheduler.start()
+
+
+@app.errorhandler(SnapshotNotReady)
+def snapshot_not_ready(error):
+    """ Response when there are no keeper results yet. They are generated in the background.
+
+    Returns:
+        503 response that asks the browser to try again in a few seconds
+    """
+    content = 'The keeper results are being generated. Try again in a few seconds.'
+    response = Response(render_template('content.html', text=content), status=503)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
 
 
 @app.route('/')
 def default_main():
     """ Base URL route used only for debugging purposes and to make sure that the webserver is running """
-    year = current_year
-
-    main_program('chilliah', False, False, None, True, year)
+    year = get_current_year()
 
-    text = open('data_files/{}/final_keepers.txt'.format(year), 'r+')
-    content = text.read()
-    text.close()
-    return render_template('content.html', text=content)
+    return keeper_page(default_league, 'keepers', year, lambda snapshot: snapshot['final_keepers'])
 
 
 @app.route('/<year>')
 def main(year):
     """ Year route to choose keeper results for a given year
 
+    A league id instead of a year shows the current year of that league.
+
     Args:
         year(int): Year to get keeper results for.
     Returns:
         Rendered content.html template with keeper results
     """
+    league_config = default_league
+    if not year.isnumeric() and get_league(year) is not None:
+        league_config = get_league(year)
+        year = None
+
     # If year is not in eligible years list, then use the current year.
-    if year.isnumeric():
-        year = int(year)
-    if year not in eligible_years:
-        year = current_year
+    year = get_year(league_config, year)
+
+    return keeper_page(league_config, 'keepers', year, lambda snapshot: snapshot['final_keepers'])
+
+
+@app.route('/<league_id>/<year>')
+def league_main(league_id, year):
+    """ League route to choose keeper results for a given league and year
+
+    Args:
+        league_id(str): Id of the league
+        year(int): Year to get keeper results for.
+    Returns:
+        Rendered content.html template with keeper results
+    """
+    league_config = find_league(league_id)
+    year = get_year(league_config, year)
+
+    return keeper_page(league_config, 'keepers', year, lambda snapshot: snapshot['final_keepers'])
+
+
+def get_keeper_indexes(snapshot):
+    """ Get the per-position and per-cost-round keeper indexes of a snapshot
 
-    main_program('chilliah', False, True, None, False, year)
+    Args:
+        snapshot (dict): Keeper snapshot
+    Returns:
+        indexes (dict): Keeper indexes. Built from the keeper_dict for snapshots published without indexes.
+    """
+    if snapshot.get('indexes') is None:
+        snapshot['indexes'] = build_keeper_indexes(snapshot['keeper_dict'])
+    return snapshot['indexes']
+
+
+@app.route('/pos/<position>')
+@app.route('/pos/<position>/<year>')
+@app.route('/<league_id>/pos/<position>')
+@app.route('/<league_id>/pos/<position>/<year>')
+def position_keepers(position, year=None, league_id=None):
+    """ Position route to list the keeper costs for a position
+
+    Args:
+        position(str): Position to list. One of QB, RB, WR, TE or DEF.
+        year(int): Year to get keeper results for. Defaults to the current year.
+        league_id(str): Id of the league. Defaults to YAFL 2.0.
+    Returns:
+        Rendered content.html template with the keepers at the position
+    """
+    league_config = find_league(league_id)
+    year = get_year(league_config, year)
+    if position.upper() not in eligible_positions:
+        content = 'Position is not in {}'.format(pformat(eligible_positions))
+        return render_template('content.html', text=content)
+
+    position = position.upper()
+    return keeper_page(league_config, 'pos/{}'.format(position), year,
+                       lambda snapshot: format_position_keepers(get_keeper_indexes(snapshot), position))
 
-    text = open('data_files/{}/final_keepers.txt'.format(year), 'r+')
-    content = text.read()
-    text.close()
-    return render_template('content.html', text=content)
+
+@app.route('/round/<int:keeper_cost>')
+@app.route('/round/<int:keeper_cost>/<year>')
+@app.route('/<league_id>/round/<int:keeper_cost>')
+@app.route('/<league_id>/round/<int:keeper_cost>/<year>')
+def round_keepers(keeper_cost, year=None, league_id=None):
+    """ Round route to list the keepers that cost a given draft round
+
+    Args:
+        keeper_cost(int): Keeper cost round to list
+        year(int): Year to get keeper results for. Defaults to the current year.
+        league_id(str): Id of the league. Defaults to YAFL 2.0.
+    Returns:
+        Rendered content.html template with the keepers that cost the round
+    """
+    league_config = find_league(league_id)
+    year = get_year(league_config, year)
+
+    return keeper_page(league_config, 'round/{}'.format(keeper_cost), year,
+                       lambda snapshot: format_round_keepers(get_keeper_indexes(snapshot), keeper_cost))
 
 
 @app.route('/csv/<year>')
-def download_csv(year):
+@app.route('/<league_id>/csv/<year>')
+def download_csv(year, league_id=None):
     """ csv route to download keeper results as a csv for Meat Wizard
 
+    The csv is streamed from the cached keeper results. It can be filtered with query parameters:
+        manager: Only keepers of this manager
+        position: Only keepers at this position
+        max_cost: Only keepers with a keeper cost round of max_cost or earlier
+    For example, /csv/2020?position=RB&max_cost=5
+
     Args:
         year(int): Year to get keeper results for.
+        league_id(str): Id of the league. Defaults to YAFL 2.0.
     Returns:
-        Rendered content.html template with keeper results
+        csv attachment with keeper results
     """
+    league_config = find_league(league_id)
     if year.isnumeric():
         year = int(year)
-    if year not in eligible_years:
-        content = 'Year is not in {}'.format(pformat(eligible_years))
+    if year not in get_eligible_years(league_config):
+        content = 'Year is not in {}'.format(pformat(get_eligible_years(league_config)))
         return render_template('content.html', text=content)
-    path = 'data_files/{}/final_keepers_{}.csv'.format(year, year)
-    print(path)
-    return send_file(path, as_attachment=True)
+
+    manager = request.args.get('manager')
+    position = request.args.get('position')
+    max_cost = request.args.get('max_cost', type=int)
+    logger.info('Streaming the %s %s keeper csv. manager=%s position=%s max_cost=%s', league_config.league_id, year,
+                manager, position, max_cost)
+
+    keeper_dict = keeper_cache.get(league_config.league_id, year)['keeper_dict']
+    response = Response(iter_keeper_csv(keeper_dict, manager, position, max_cost), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=final_keepers_{}.csv'.format(year)
+    return response
 
 
 @app.route('/kept/<year>')
-def kept_players(year):
+@app.route('/<league_id>/kept/<year>')
+def kept_players(year, league_id=None):
     """ Kept route to display the kept players for a given year
 
     Args:
         year(int): Year to get kept results for.
+        league_id(str): Id of the league. Defaults to YAFL 2.0.
     Returns:
         Rendered content.html template with kept player list from year
     """
+    league_config = find_league(league_id)
     if year.isnumeric():
         year = int(year)
-    if year not in eligible_years:
-        content = 'Year is not in {}'.format(pformat(eligible_years))
+    if year not in get_eligible_years(league_config):
+        content = 'Year is not in {}'.format(pformat(get_eligible_years(league_config)))
         return render_template('content.html', text=content)
     # No one was kept in 2019 cause it was the first year of the league. Lets serve a meme.
-    if year == 2019:
-        text = open('data_files/2019/kept_players/kept_players_meme_2019.txt', 'r+')
-        content = text.read()
-        text.close()
-        return render_template('content.html', text=content)
-    text = open('data_files/{}/kept_players/processed_kept_players.txt'.format(year), 'r+')
-    content = text.read()
-    text.close()
-    return render_template('content.html', text=content)
+    if league_config is default_league and year == 2019:
+        return file_page(league_config, 'kept', year, 'data_files/2019/kept_players/kept_players_meme_2019.txt')
+    path = league_config.path(year, 'kept_players/processed_kept_players.txt')
+    if not os.path.isfile(path):
+        return render_template('content.html', text='No kept players for {}'.format(year))
+    return file_page(league_config, '{}/kept'.format(league_config.league_id), year, path)
+
+
+@app.route('/metrics')
+def metrics_page():
+    """ Metrics route for Prometheus
+
+    Returns:
+        Stage timings, Sleeper API calls, cache hits and json bytes of this worker in the Prometheus text format
+    """
+    return Response(metrics.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/refresh', methods=['POST'])
+@app.route('/refresh/<year>', methods=['POST'])
+@app.route('/<league_id>/refresh', methods=['POST'])
+@app.route('/<league_id>/refresh/<year>', methods=['POST'])
+def trigger_refresh(year=None, league_id=None):
+    """ Refresh route to get new keeper results from the Sleeper API in the background
+
+    Returns right away. Triggers that arrive while a refresh is running share that refresh, and triggers within
+    trigger_min_age seconds of the last refresh are ignored. For example, curl -X POST https://yaflkeepers/refresh/2020
+
+    Args:
+        year(int): Year to refresh. Defaults to the current year.
+        league_id(str): Id of the league. Defaults to YAFL 2.0.
+    Returns:
+        202 response with json that says if a new refresh was started and the version of the current results
+    """
+    league_config = find_league(league_id)
+    year = get_year(league_config, year)
+
+    started = keeper_cache.refresh_in_background(league_config.league_id, year, time.time() - trigger_min_age)
+    logger.info('Refresh of %s %s triggered. Started: %s', league_config.league_id, year, started)
+
+    snapshot = load_keepers(league_config.league_id, year)
+    return jsonify(league=league_config.league_id, year=year, started=started,
+                   version=snapshot['version'] if snapshot else None), 202
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+from keeper_log import get_logger
+
+# This is a helper module for sleeper_keeper.py and keeperwebpage.py.
+# The keeper service can host more than one league. Each league has a LeagueConfig with how to find it in the Sleeper
+# API, where its files are saved and its keeper rules. YAFL 2.0 is always served and keeps its files in data_files.
+# Other leagues are listed in leagues.json and keep their files in data_files/leagues/{league_id}:
+#
+#     [{"league_id": "dynasty", "name": "Dynasty League", "user": "chilliah", "default_years": [2020],
+#       "first_season": 2020, "undrafted_cost": 10, "draft_cost_offset": 2}]
+#
+# league_id is the id of the league in the keeper service urls, like /dynasty/2020. league_id, name, user and
+# default_years or first_season are required. The player store is shared by every league.
+
+logger = get_logger(__name__)
+
+# Directory the files of YAFL 2.0 are saved to
+default_data_dir = 'data_files'
+# File with the other leagues to serve
+leagues_path = 'leagues.json'
+
+
+class LeagueConfig(object):
+    """ How to find a league in the Sleeper API, where its files are saved and its keeper rules
+
+    Args:
+        league_id (str): Id of the league in the keeper service
+        name (str): Name of the league in Sleeper
+        user (str): Username of a manager in the league. Used to find the league in the Sleeper API.
+        data_dir (str): Directory the files of the league are saved to. Defaults to data_files/leagues/{league_id}.
+        default_years (list): Years to show even if they are not in the history store. Defaults to [first_season].
+        first_season (int): First season of the league. No one was kept that year. Defaults to the first default year.
+        undrafted_cost (int): Keeper cost round of a player that was not drafted
+        draft_cost_offset (int): Rounds taken off the draft round of a player to get his keeper cost
+    """
+    def __init__(self, league_id, name, user, data_dir=None, default_years=None, first_season=None,
+                 undrafted_cost=8, draft_cost_offset=1):
+        self.league_id = league_id
+        self.name = name
+        self.user = user
+        self.data_dir = data_dir or '{}/leagues/{}'.format(default_data_dir, league_id)
+        assert default_years or first_season, 'League {} needs default_years or first_season'.format(league_id)
+        self.default_years = sorted(default_years or [first_season])
+        self.first_season = first_season if first_season is not None else self.default_years[0]
+        self.undrafted_cost = undrafted_cost
+        self.draft_cost_offset = draft_cost_offset
+
+    def __repr__(self):
+        return 'LeagueConfig({!r}, {!r})'.format(self.league_id, self.name)
+
+    def path(self, year, file_name):
+        """ Path of a file of the league for a year
+
+        Args:
+            year (int): Year of the league
+            file_name (str): Name of the file
+
+        Returns:
+            path (str): {data_dir}/{year}/{file_name}
+        """
+        return '{}/{}/{}'.format(self.data_dir, year, file_name)
+
+    @property
+    def history_path(self):
+        """ Path of the history store of the league """
+        return '{}/history.db'.format(self.data_dir)
+
+    @classmethod
+    def from_dict(cls, config):
+        """ Make a LeagueConfig from an entry of leagues.json
+
+        Args:
+            config (dict): Entry of leagues.json
+
+        Returns:
+            league (LeagueConfig): League config
+        """
+        for key in ('league_id', 'name', 'user'):
+            assert key in config, 'League {} in {} is missing {}'.format(config, leagues_path, key)
+        return cls(**config)
+
+
+# The league the keeper service was made for
+default_league = LeagueConfig('yafl', 'YAFL 2.0', 'chilliah', default_data_dir, [2019, 2020], 2019)
+
+# Leagues loaded from leagues.json. {'leagues': {league_id: LeagueConfig}, 'mtime': mtime of leagues.json}
+_loaded = {'leagues': None, 'mtime': None}
+_lock = threading.Lock()
+
+
+def load_leagues(path=leagues_path):
+    """ Get every league that is served. leagues.json is only read again when it changes.
+
+    Args:
+        path (str): Path of leagues.json
+
+    Returns:
+        leagues (dict): {league_id: LeagueConfig}, with the default league first
+    """
+    mtime = os.path.getmtime(path) if os.path.isfile(path) else None
+    with _lock:
+        if _loaded['leagues'] is not None and _loaded['mtime'] == mtime:
+            return _loaded['leagues']
+
+        leagues = dict()
+        leagues[default_league.league_id] = default_league
+        if mtime is not None:
+            with open(path) as f:
+                for config in json.load(f):
+                    league = LeagueConfig.from_dict(config)
+                    leagues[league.league_id] = league
+            logger.info('Serving %s leagues from %s', len(leagues), path)
+
+        _loaded['leagues'] = leagues
+        _loaded['mtime'] = mtime
+        return leagues
+
+
+def get_league(league_id):
+    """ Get the config of a league
+
+    Args:
+        league_id (str): Id of the league in the keeper service
+
+    Returns:
+        league (LeagueConfig): League config or None if the league is not served
+    """
+    if league_id is None:
+        return default_league
+    return load_leagues().get(league_id)
@@ -0,0 +1,159 @@
+import json
+import os
+import sqlite3
+import tempfile
+from keeper_log import get_logger
+from keeper_metrics import metrics
+from league_config import default_data_dir
+from pathlib import Path
+from player_table import PlayerTable
+
+# This is a helper module for sleeper_keeper.py.
+# Offline mode used to open and parse six separate json files. The OfflineBundle stores all of the saved Sleeper data
+# for a year in one SQLite file, {data_dir}/{year}/offline.db. The bundle is opened and validated once, and each
+# section is only decoded the first time it is used.
+#
+# The player_dict section holds the bytes of a PlayerTable. Every other section holds json.
+
+logger = get_logger(__name__)
+
+bundle_version = 1
+
+# Sections stored in the bundle and the file each section is built from
+section_files = {
+    'player_dict': 'player_table.bin',
+    'draft_dict': 'draft_dict.json',
+    'rosters': 'rosters.json',
+    'transactions': 'transactions.json',
+    'trades': 'trades.json',
+    'traded_picks': 'traded_picks.json',
+}
+
+
+def bundle_path(year, data_dir=default_data_dir):
+    """ Path of the offline bundle for a year
+
+    Args:
+        year (int): Year of YAFL 2.0
+        data_dir (str): Directory the files of the league are saved to
+
+    Returns:
+        path (str): Path of the offline bundle
+    """
+    return '{}/{}/offline.db'.format(data_dir, year)
+
+
+class OfflineBundle(object):
+    """ Saved Sleeper data for offline mode, loaded one section at a time
+
+    Args:
+        path (str): Path of the offline bundle
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+        self._sections = dict()
+
+        meta = dict(self.connection.execute('SELECT key, value FROM meta'))
+        assert meta.get('version') == str(bundle_version), \
+            '{} is version {}. Expected version {}'.format(path, meta.get('version'), bundle_version)
+
+        stored = set(row[0] for row in self.connection.execute('SELECT name FROM sections'))
+        missing = set(section_files) - stored
+        assert not missing, '{} is missing {}'.format(path, sorted(missing))
+
+    def __getitem__(self, name):
+        if name not in self._sections:
+            row = self.connection.execute('SELECT data FROM sections WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                raise KeyError(name)
+            if name == 'player_dict':
+                self._sections[name] = PlayerTable(row[0])
+            else:
+                metrics.json_bytes('read', 'offline.db:{}'.format(name), len(row[0]))
+                self._sections[name] = json.loads(row[0])
+        return self._sections[name]
+
+    def close(self):
+        """ Close the database connection """
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_bundle(path, sections):
+    """ Write an offline bundle and atomically move it into place
+
+    Args:
+        path (str): Path of the offline bundle
+        sections (dict): {section name: encoded bytes of the section}
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=str(Path(path).parent), prefix='.offline.', suffix='.tmp')
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(temp_path)
+        with connection:
+            connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE sections (name TEXT PRIMARY KEY, data BLOB)')
+            connection.execute('INSERT INTO meta VALUES (?, ?)', ('version', str(bundle_version)))
+            connection.executemany('INSERT INTO sections VALUES (?, ?)', list(sections.items()))
+        connection.close()
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def build_bundle_from_files(year, data_dir=default_data_dir):
+    """ Build the offline bundle for a year from the saved data files
+
+    Args:
+        year (int): Year of YAFL 2.0
+        data_dir (str): Directory the files of the league are saved to
+    """
+    sections = dict()
+    for name, file_name in section_files.items():
+        with open('{}/{}/{}'.format(data_dir, year, file_name), 'rb') as f:
+            sections[name] = f.read()
+
+    write_bundle(bundle_path(year, data_dir), sections)
+
+
+def open_offline_bundle(year, data_dir=default_data_dir):
+    """ Open the offline bundle for a year
+
+    If the bundle does not exist, or any of the saved data files are newer than it, the bundle is built from the
+    saved data files first.
+
+    Args:
+        year (int): Year of YAFL 2.0
+        data_dir (str): Directory the files of the league are saved to
+
+    Returns:
+        bundle (OfflineBundle): Offline bundle for year
+    """
+    path = bundle_path(year, data_dir)
+
+    bundle_time = os.path.getmtime(path) if os.path.isfile(path) else None
+    for file_name in section_files.values():
+        file_path = '{}/{}/{}'.format(data_dir, year, file_name)
+        if bundle_time is not None and os.path.isfile(file_path) and os.path.getmtime(file_path) > bundle_time:
+            bundle_time = None
+            break
+
+    if bundle_time is None:
+        logger.info('Building %s from the saved data files', path)
+        metrics.cache('offline_bundle', 'miss')
+        build_bundle_from_files(year, data_dir)
+    else:
+        metrics.cache('offline_bundle', 'hit')
+
+    return OfflineBundle(path)
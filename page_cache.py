@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import threading
+from flask import Response, request
+from keeper_metrics import metrics
+
+# This is a helper module for keeperwebpage.py.
+# The keeper pages only change when a new keeper snapshot is published, so each page is rendered once per
+# (route, year, snapshot version) and kept in memory along with a gzipped copy and a strong ETag. Repeat views are
+# served from memory, and browsers that already have the page get a 304 Not Modified.
+#
+# The ETag is a hash of the page, so every uWSGI worker gives the same ETag for the same page.
+
+# Seconds browsers may use a page before checking if it changed
+page_max_age = 60
+
+
+class CachedPage(object):
+    """ A rendered page with its gzipped copy and ETag
+
+    Args:
+        body (str): Rendered html
+    """
+    __slots__ = ('body', 'gzip_body', 'etag')
+
+    def __init__(self, body):
+        self.body = body.encode('utf-8')
+        self.gzip_body = gzip.compress(self.body, compresslevel=9)
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+
+class PageCache(object):
+    """ Cache of rendered pages. Only the newest version of each (route, year) page is kept. """
+    def __init__(self):
+        # {(route, year): (version, CachedPage)}
+        self._pages = dict()
+        self._lock = threading.Lock()
+
+    def get(self, route, year, version, render):
+        """ Get a rendered page, rendering it if this version has not been rendered yet
+
+        Args:
+            route (str): Name of the route
+            year (int): Year of the page
+            version: Version of the data the page is rendered from, like the snapshot version
+            render (func): Function that renders the page html
+
+        Returns:
+            page (CachedPage): Rendered page
+        """
+        key = (route, year)
+        cached = self._pages.get(key)
+        if cached is not None and cached[0] == version:
+            metrics.cache('page', 'hit')
+            return cached[1]
+
+        metrics.cache('page', 'miss')
+        page = CachedPage(render())
+        with self._lock:
+            self._pages[key] = (version, page)
+        return page
+
+    def clear(self):
+        """ Drop every rendered page """
+        with self._lock:
+            self._pages.clear()
+
+
+def page_response(page):
+    """ Build the response for a cached page for the current request
+
+    Returns 304 Not Modified if the browser already has the page, and the gzipped page if the browser accepts gzip.
+
+    Args:
+        page (CachedPage): Rendered page
+
+    Returns:
+        response (Response): Flask response
+    """
+    if request.if_none_match.contains(page.etag):
+        response = Response(status=304)
+    elif request.accept_encodings['gzip']:
+        response = Response(page.gzip_body, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(page.body, mimetype='text/html')
+
+    response.set_etag(page.etag)
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(page_max_age)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
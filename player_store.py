@@ -0,0 +1,509 @@
+import codecs
+import difflib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sleeper_client
+import sqlite3
+import time
+import unicodedata
+from functools import partial
+from keeper_log import get_logger
+from keeper_metrics import metrics
+from pathlib import Path
+
+# This is a helper module for sleeper_keeper.py and process_kept_csv.py.
+# The Sleeper player dump (every NFL player Sleeper knows about) is several MB, and Sleeper asks that it is requested
+# at most once a day. The PlayerStore keeps the dump in a SQLite database with one row per player, and only downloads
+# the dump again once it is older than the max age. The download is a conditional request using the ETag and
+# Last-Modified headers from the last download. If the dump did change, only the players that were added, changed or
+# removed are written to the database.
+#
+# The store also keeps an index of normalized player names, so kept players can be matched to a player_id with a
+# lookup instead of comparing against every player in the dump.
+#
+# The dump is the same for every league and year, so there is one store shared by all of them. Refreshes are guarded by
+# a lock file, so leagues refreshed at the same time by different processes only download the dump once.
+#
+# The dump has dozens of fields for each player, but only a few are ever used. It is parsed one player at a time as it
+# is read from the response body or from disk, and each player is cut down to player_fields right away, so the whole
+# dump is never in memory at once.
+
+logger = get_logger(__name__)
+
+players_url = 'https://api.sleeper.app/v1/players/nfl'
+
+# Default number of seconds before the player dump is downloaded again. Can be overridden with PLAYER_DUMP_MAX_AGE.
+default_max_age = 24 * 60 * 60
+
+# Suffixes dropped from player names before matching. 'Odell Beckham Jr.' matches 'Odell Beckham'.
+name_suffixes = {'jr', 'sr', 'ii', 'iii', 'iv', 'v'}
+
+# Positions that can be rostered in YAFL 2.0. When several players share a name, these players are matched first.
+fantasy_positions = {'QB', 'RB', 'WR', 'TE', 'K', 'DEF'}
+
+# Fields of each player kept in the store
+player_fields = ('player_id', 'first_name', 'last_name', 'position', 'team', 'active')
+# Bytes of the player dump read at a time
+chunk_size = 64 * 1024
+
+
+def get_max_age():
+    """ Get the player dump max age from the PLAYER_DUMP_MAX_AGE environment variable
+
+    Returns:
+        max_age (int): Number of seconds before the player dump is downloaded again
+    """
+    try:
+        return int(os.environ.get('PLAYER_DUMP_MAX_AGE', default_max_age))
+    except ValueError:
+        logger.warning('PLAYER_DUMP_MAX_AGE is not a number. Using default of %s seconds', default_max_age)
+        return default_max_age
+
+
+# Path of the player store shared by every league and year
+store_path = 'data_files/players.db'
+
+
+def normalize_name(name):
+    """ Normalize a player name for matching
+
+    Lowercase, remove accents and punctuation, and drop suffixes like Jr. and III. 'A.J. Brown' becomes 'aj brown'.
+
+    Args:
+        name (str): Player name
+
+    Returns:
+        name (str): Normalized player name
+    """
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').lower()
+    # Periods and apostrophes are part of the name (A.J., Le'Veon). Other punctuation separates words.
+    name = re.sub(r"[.']", '', name)
+    words = re.sub(r'[^a-z0-9]+', ' ', name).split()
+    while len(words) > 1 and words[-1] in name_suffixes:
+        words.pop()
+    return ' '.join(words)
+
+
+def player_hash(player):
+    """ Hash the information for a player, so changed players can be found without comparing every field
+
+    Args:
+        player (dict): Player information from the Sleeper player dump
+
+    Returns:
+        hash (str): Hash of the player information
+    """
+    return hashlib.sha1(json.dumps(player, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def project_player(player):
+    """ Cut the information for a player from the Sleeper player dump down to player_fields
+
+    Args:
+        player (dict): Player information from the Sleeper player dump
+
+    Returns:
+        player (dict): Only the player_fields the player has
+    """
+    return {field: player[field] for field in player_fields if field in player}
+
+
+def iter_json_object(chunks):
+    """ Parse a json object one member at a time, reading more of it only when it is needed
+
+    Only the text of the members that have not been parsed yet is kept, so parsing a large object takes about as much
+    memory as its largest member.
+
+    Args:
+        chunks (iterable): Bytes of a utf-8 json object, in pieces of any size
+
+    Returns:
+        members (generator): (key, value) for each member of the object
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+
+    def read_more():
+        """ Add the next chunk to the buffer, dropping the text that was already parsed. False at the end. """
+        nonlocal buffer, position
+        while True:
+            chunk = next(chunks, None)
+            text = utf8.decode(chunk or b'', final=chunk is None)
+            if text:
+                buffer = buffer[position:] + text
+                position = 0
+                return True
+            if chunk is None:
+                return False
+
+    def next_char():
+        """ Skip whitespace and return the next character, or '' at the end """
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\n\r':
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                return ''
+
+    def parse_value():
+        """ Parse the json value at the position """
+        nonlocal position
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The value goes on in the next chunk
+                if not read_more():
+                    raise
+                continue
+            # A value must be followed by a delimiter, or a number cut off by the end of a chunk like -12. would be
+            # read as -12
+            if (end == len(buffer) or buffer[end] not in ' \t\n\r,:}') and read_more():
+                continue
+            position = end
+            return value
+
+    if next_char() != '{':
+        raise ValueError('Expected a json object')
+    position += 1
+    char = next_char()
+    if char == '}':
+        return
+    while True:
+        if char != '"':
+            raise ValueError('Expected a key at character {} of the json object, not {!r}'.format(position, char))
+        key = parse_value()
+        if next_char() != ':':
+            raise ValueError('Expected a : after key {!r}'.format(key))
+        position += 1
+        next_char()
+        yield key, parse_value()
+        char = next_char()
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError('Expected a , or }} after key {!r}, not {!r}'.format(key, char))
+        position += 1
+        char = next_char()
+
+
+def parse_player_dump(chunks):
+    """ Parse the Sleeper player dump one player at a time, keeping only the player_fields of each player
+
+    Args:
+        chunks (iterable): Bytes of the player dump, in pieces of any size
+
+    Returns:
+        players (dict): {player_id: player information cut down to player_fields}
+    """
+    return {player_id: project_player(player) for player_id, player in iter_json_object(chunks)}
+
+
+class PlayerStore(object):
+    """ SQLite store of the Sleeper player dump
+
+    Args:
+        path (str): Path of the SQLite database
+    """
+    def __init__(self, path):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS players ('
+                'player_id TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, position TEXT, team TEXT, '
+                'hash TEXT, data TEXT)'
+            )
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS player_names (name TEXT, player_id TEXT)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS player_names_name ON player_names (name)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS player_names_player_id ON player_names (player_id)')
+
+        # Stores created before the name index existed need the index built once
+        if self.count() and not self.connection.execute('SELECT 1 FROM player_names LIMIT 1').fetchone():
+            self.build_name_index()
+
+    def close(self):
+        """ Close the database connection """
+        self.connection.close()
+
+    def get_meta(self, key):
+        """ Get a value from the meta table
+
+        Args:
+            key (str): Key of the value
+
+        Returns:
+            value (str): Stored value or None
+        """
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        """ Set a value in the meta table
+
+        Args:
+            key (str): Key of the value
+            value (str): Value to store. None removes the key.
+        """
+        if value is None:
+            self.connection.execute('DELETE FROM meta WHERE key = ?', (key,))
+        else:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def count(self):
+        """ Number of players in the store
+
+        Returns:
+            count (int): Number of players
+        """
+        return self.connection.execute('SELECT COUNT(*) FROM players').fetchone()[0]
+
+    def is_fresh(self, max_age):
+        """ Check if the player dump was downloaded within max_age seconds
+
+        Args:
+            max_age (int): Number of seconds before the player dump is downloaded again
+
+        Returns:
+            fresh (bool): True if the player dump does not need to be downloaded
+        """
+        fetched_at = self.get_meta('fetched_at')
+        if fetched_at is None or self.count() == 0:
+            return False
+        return time.time() - float(fetched_at) < max_age
+
+    def refresh(self, max_age=None, force=False):
+        """ Download the player dump from the Sleeper API if it is older than max_age
+
+        Args:
+            max_age (int): Number of seconds before the player dump is downloaded again
+            force (bool): Download even if the player dump is not older than max_age
+
+        Returns:
+            changed (int): Number of players that were added, changed or removed
+        """
+        if max_age is None:
+            max_age = get_max_age()
+        if not force and self.is_fresh(max_age):
+            logger.info('Player dump is less than %s seconds old. Skipping download', max_age)
+            metrics.cache('player_dump', 'hit')
+            return 0
+
+        headers = dict()
+        if self.count():
+            etag = self.get_meta('etag')
+            last_modified = self.get_meta('last_modified')
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        logger.info('Getting all players from Sleeper API...')
+        response = sleeper_client.get(players_url, headers=headers, stream=True)
+        with response:
+            if response.status_code == 304:
+                logger.info('Player dump has not changed')
+                metrics.cache('player_dump', 'not_modified')
+                with self.connection:
+                    self.set_meta('fetched_at', time.time())
+                return 0
+            response.raise_for_status()
+
+            # The body is hashed and parsed as it is downloaded
+            content_hash = hashlib.sha256()
+            size = 0
+
+            def chunks():
+                nonlocal size
+                for chunk in response.iter_content(chunk_size):
+                    content_hash.update(chunk)
+                    size += len(chunk)
+                    yield chunk
+
+            players = parse_player_dump(chunks())
+
+        content_hash = content_hash.hexdigest()
+        metrics.json_bytes('read', 'players/nfl', size)
+        if content_hash == self.get_meta('content_hash'):
+            logger.info('Player dump has not changed')
+            metrics.cache('player_dump', 'unchanged')
+            changed = 0
+        else:
+            metrics.cache('player_dump', 'miss')
+            changed = self.apply(players)
+
+        with self.connection:
+            self.set_meta('fetched_at', time.time())
+            self.set_meta('content_hash', content_hash)
+            self.set_meta('etag', response.headers.get('ETag'))
+            self.set_meta('last_modified', response.headers.get('Last-Modified'))
+
+        return changed
+
+    def apply(self, players):
+        """ Update the store to match a player dump, only writing the players that were added, changed or removed
+
+        Args:
+            players (dict): Sleeper player dump {player_id: player information}, cut down by parse_player_dump
+
+        Returns:
+            changed (int): Number of players that were added, changed or removed
+        """
+        stored_hashes = dict(self.connection.execute('SELECT player_id, hash FROM players'))
+
+        updated = list()
+        for player_id, player in players.items():
+            new_hash = player_hash(player)
+            if stored_hashes.pop(player_id, None) != new_hash:
+                updated.append((
+                    player_id,
+                    player.get('first_name'),
+                    player.get('last_name'),
+                    player.get('position'),
+                    player.get('team'),
+                    new_hash,
+                    json.dumps(player)
+                ))
+        # Any player left in stored_hashes is no longer in the player dump
+        removed = [(player_id,) for player_id in stored_hashes]
+
+        # Only the names of the players that changed need to be indexed again
+        names = list()
+        for player_id, first_name, last_name, _, _, _, _ in updated:
+            names.append((normalize_name('{} {}'.format(first_name, last_name)), player_id))
+
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?, ?, ?, ?)', updated)
+            self.connection.executemany('DELETE FROM players WHERE player_id = ?', removed)
+            self.connection.executemany('DELETE FROM player_names WHERE player_id = ?', removed)
+            self.connection.executemany(
+                'DELETE FROM player_names WHERE player_id = ?', [(row[0],) for row in updated])
+            self.connection.executemany('INSERT INTO player_names VALUES (?, ?)', names)
+            if updated or removed:
+                # Used to tell if files built from the store, like the player table, are out of date
+                self.set_meta('updated_at', time.time())
+
+        logger.info('Player dump: %s players added or changed, %s removed', len(updated), len(removed))
+        return len(updated) + len(removed)
+
+    def build_name_index(self):
+        """ Rebuild the normalized name index for every player in the store """
+        names = list()
+        for player_id, first_name, last_name, _ in self.get_player_names():
+            names.append((normalize_name('{} {}'.format(first_name, last_name)), player_id))
+
+        with self.connection:
+            self.connection.execute('DELETE FROM player_names')
+            self.connection.executemany('INSERT INTO player_names VALUES (?, ?)', names)
+
+    def find_players(self, name):
+        """ Find the players with a name
+
+        When several players share a name, they are ranked so the most likely player is first: players at a YAFL
+        position, then players on a team, then active players.
+
+        Args:
+            name (str): Player name
+
+        Returns:
+            players (list): Sleeper player information for each matching player, most likely player first
+        """
+        rows = self.connection.execute(
+            'SELECT players.data FROM player_names JOIN players ON players.player_id = player_names.player_id '
+            'WHERE player_names.name = ?', (normalize_name(name),)
+        ).fetchall()
+
+        players = [json.loads(row[0]) for row in rows]
+        players.sort(key=lambda player: (
+            player.get('position') not in fantasy_positions,
+            player.get('team') is None,
+            not player.get('active', True),
+        ))
+        return players
+
+    def suggest_names(self, name, limit=5):
+        """ Suggest player names that are close to a name that was not found
+
+        Args:
+            name (str): Player name that was not found
+            limit (int): Maximum number of suggestions
+
+        Returns:
+            suggestions (list): (suggested name, [player_ids]) ranked by how close the name is
+        """
+        index = dict()
+        for indexed_name, player_id in self.connection.execute('SELECT name, player_id FROM player_names'):
+            index.setdefault(indexed_name, list()).append(player_id)
+
+        matches = difflib.get_close_matches(normalize_name(name), list(index), n=limit, cutoff=0.75)
+        return [(match, index[match]) for match in matches]
+
+    def import_dump(self, dump_path):
+        """ Load an old dump_players.json into the store
+
+        Args:
+            dump_path (str): Path of dump_players.json
+        """
+        with open(dump_path, 'rb') as f:
+            self.apply(parse_player_dump(iter(partial(f.read, chunk_size), b'')))
+
+    def get_players(self):
+        """ Get the information for every player in the store
+
+        Returns:
+            players (dict): {player_id: player information}. Only the player_fields are stored.
+        """
+        players = dict()
+        for player_id, data in self.connection.execute('SELECT player_id, data FROM players'):
+            players[player_id] = json.loads(data)
+        return players
+
+    def get_player_names(self):
+        """ Get the name and position of every player in the store
+
+        Returns:
+            rows (list): List of (player_id, first_name, last_name, position)
+        """
+        return self.connection.execute('SELECT player_id, first_name, last_name, position FROM players').fetchall()
+
+
+def open_player_store(year, refresh=False):
+    """ Open the shared player store
+
+    If the store is empty, a dump_players.json for the year from before the store existed is imported. If there is no
+    old dump either and refresh is set, the player dump is downloaded from the Sleeper API.
+
+    Args:
+        year (int): Year of YAFL 2.0. Only used to find an old dump_players.json.
+        refresh (bool): Download the player dump if it is older than the max age
+
+    Returns:
+        store (PlayerStore): Player store
+    """
+    store = PlayerStore(store_path)
+    dump_path = 'data_files/{}/dump_players.json'.format(year)
+
+    if store.count() == 0 and os.path.isfile(dump_path):
+        logger.info('Importing %s into %s', dump_path, store.path)
+        store.import_dump(dump_path)
+
+    if refresh:
+        # Only one process downloads the dump. The others find it fresh once they get the lock.
+        with open('{}.lock'.format(store_path), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                store.refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    return store
@@ -0,0 +1,246 @@
+import json
+import mmap
+import struct
+from bisect import bisect_left
+from keeper_snapshot import atomic_open
+
+# This is a helper module for sleeper_keeper.py.
+# The player_dict has an entry for every player Sleeper knows about (~10k players), but only the rostered players are
+# ever looked up. The PlayerTable stores the player ids, names and positions in a compact binary file that is memory
+# mapped, so opening it does not parse anything and a lookup only touches the rows it needs.
+#
+# File layout (little-endian):
+#     header: magic, format version, number of players, length of the source stamp
+#     source stamp: utf-8 string identifying the data the table was built from
+#     positions: json list of the distinct positions. Each player stores the index of its position in this list.
+#     id offsets: (count + 1) uint32 offsets into the id blob. Ids are sorted, so they can be binary searched.
+#     name offsets: (count + 1) uint32 offsets into the name blob
+#     position codes: count uint8 indexes into the positions list
+#     id blob: utf-8 player ids
+#     name blob: utf-8 player names
+
+magic = b'SKPT'
+format_version = 1
+_header = struct.Struct('<4sHII')
+_offset = struct.Struct('<I')
+
+
+class PlayerTable(object):
+    """ Read only table of player names and positions, keyed by player_id
+
+    Behaves like the player_dict returned by get_players. Looking up a player returns a new dictionary:
+        {'player_name': player name, 'position': position}
+
+    Args:
+        buffer (bytes/mmap): Table built by build_player_table
+    """
+    __slots__ = ('source', '_buffer', '_count', '_positions', '_id_offsets', '_name_offsets', '_position_codes',
+                 '_ids', '_names')
+
+    def __init__(self, buffer):
+        file_magic, version, count, source_length = _header.unpack_from(buffer, 0)
+        assert file_magic == magic, 'Not a player table'
+        assert version == format_version, 'Player table version {} is not supported'.format(version)
+
+        position = _header.size
+        self.source = bytes(buffer[position:position + source_length]).decode('utf-8')
+        position += source_length
+
+        (positions_length,) = _offset.unpack_from(buffer, position)
+        position += _offset.size
+        self._positions = json.loads(bytes(buffer[position:position + positions_length]).decode('utf-8'))
+        position += positions_length
+
+        self._buffer = buffer
+        self._count = count
+        self._id_offsets = position
+        position += (count + 1) * _offset.size
+        self._name_offsets = position
+        position += (count + 1) * _offset.size
+        self._position_codes = position
+        position += count
+        self._ids = position
+        position += self._offset(self._id_offsets, count)
+        self._names = position
+
+    @classmethod
+    def open(cls, path):
+        """ Memory map a player table file
+
+        Args:
+            path (str): Path of the player table
+
+        Returns:
+            table (PlayerTable): Player table
+        """
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self._id(index)
+
+    def __contains__(self, player_id):
+        return self._find(player_id) is not None
+
+    def __getitem__(self, player_id):
+        index = self._find(player_id)
+        if index is None:
+            raise KeyError(player_id)
+        return self._row(index)
+
+    def __repr__(self):
+        return '<PlayerTable {} players>'.format(self._count)
+
+    def get(self, player_id, default=None):
+        """ Get a player, or default if the player is not in the table
+
+        Args:
+            player_id (str): Sleeper player id
+            default: Value returned if the player is not in the table
+
+        Returns:
+            player (dict): {'player_name': player name, 'position': position}
+        """
+        index = self._find(player_id)
+        if index is None:
+            return default
+        return self._row(index)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for index in range(self._count):
+            yield self._id(index), self._row(index)
+
+    def to_dict(self):
+        """ Expand the table into a player_dict
+
+        Returns:
+            player_dict (dict): {player_id: {'player_name': player name, 'position': position}}
+        """
+        return dict(self.items())
+
+    def _offset(self, table, index):
+        return _offset.unpack_from(self._buffer, table + index * _offset.size)[0]
+
+    def _id(self, index):
+        start = self._ids + self._offset(self._id_offsets, index)
+        end = self._ids + self._offset(self._id_offsets, index + 1)
+        return bytes(self._buffer[start:end]).decode('utf-8')
+
+    def _row(self, index):
+        start = self._names + self._offset(self._name_offsets, index)
+        end = self._names + self._offset(self._name_offsets, index + 1)
+        player = dict()
+        player['player_name'] = bytes(self._buffer[start:end]).decode('utf-8')
+        player['position'] = self._positions[self._buffer[self._position_codes + index]]
+        return player
+
+    def _find(self, player_id):
+        """ Binary search the sorted ids for a player id
+
+        Args:
+            player_id (str): Sleeper player id
+
+        Returns:
+            index (int): Row of the player, or None if the player is not in the table
+        """
+        if not isinstance(player_id, str):
+            return None
+        index = bisect_left(_IdView(self), player_id)
+        if index < self._count and self._id(index) == player_id:
+            return index
+        return None
+
+
+class _IdView(object):
+    """ Sequence of the sorted ids of a PlayerTable, so bisect can search them without decoding every id """
+    __slots__ = ('table',)
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table._count
+
+    def __getitem__(self, index):
+        return self.table._id(index)
+
+
+def build_player_table(players, source=''):
+    """ Build a player table
+
+    Args:
+        players (iterable): (player_id, player_name, position) for every player
+        source (str): Stamp identifying the data the table was built from
+
+    Returns:
+        table (bytes): Player table that can be loaded with PlayerTable
+    """
+    rows = sorted(players, key=lambda row: row[0])
+
+    positions = list()
+    position_codes = dict()
+    id_offsets = [0]
+    name_offsets = [0]
+    codes = bytearray()
+    id_blob = bytearray()
+    name_blob = bytearray()
+
+    for player_id, player_name, position in rows:
+        if position not in position_codes:
+            position_codes[position] = len(positions)
+            positions.append(position)
+        codes.append(position_codes[position])
+        id_blob += player_id.encode('utf-8')
+        id_offsets.append(len(id_blob))
+        name_blob += player_name.encode('utf-8')
+        name_offsets.append(len(name_blob))
+
+    assert len(positions) <= 256, 'Too many positions for a player table'
+
+    source_bytes = source.encode('utf-8')
+    positions_bytes = json.dumps(positions).encode('utf-8')
+
+    table = bytearray(_header.pack(magic, format_version, len(rows), len(source_bytes)))
+    table += source_bytes
+    table += _offset.pack(len(positions_bytes))
+    table += positions_bytes
+    table += struct.pack('<{}I'.format(len(id_offsets)), *id_offsets)
+    table += struct.pack('<{}I'.format(len(name_offsets)), *name_offsets)
+    table += codes
+    table += id_blob
+    table += name_blob
+    return bytes(table)
+
+
+def player_dict_rows(player_dict):
+    """ Rows for build_player_table from a player_dict
+
+    Args:
+        player_dict (dict): {player_id: {'player_name': player name, 'position': position}}
+
+    Returns:
+        rows (generator): (player_id, player_name, position) for every player
+    """
+    for player_id, player in player_dict.items():
+        yield player_id, player['player_name'], player['position']
+
+
+def write_player_table(path, players, source=''):
+    """ Build a player table and atomically write it to a file
+
+    Args:
+        path (str): Path of the player table
+        players (iterable): (player_id, player_name, position) for every player
+        source (str): Stamp identifying the data the table was built from
+    """
+    table = build_player_table(players, source)
+    with atomic_open(path, 'wb') as f:
+        f.write(table)
@@ -1,9 +1,9 @@
 import csv
 import json
-import os
 import sys
-from pprint import pformat
-from sleeper_wrapper import Players
+from history_store import latest_year
+from keeper_log import LazyPformat, get_logger, setup_logging
+from player_store import open_player_store
 
 # This is a helper script for sleeper_keeper.py.
 # Take the kept_players.csv generated from the list Andrew sends and convert it to a json file kept_players.json.
@@ -11,21 +11,25 @@ from sleeper_wrapper import Players
 #     PlayerName,Manager,Years Kept
 #     Lamar Jackson,chilliah,1
 #     Austin Ekeler,chilliah,1
-# Takes the kept_players.json file and fills it with data from the dump_players.json file, which is the json dump
-# of all the players sleeper contains. Saves that file as processed_kept_players.json. This is the json file that
-# sleeper_keeper.py will use when determining eligible keepers.
+# Takes the kept_players.json file and fills it with data from the player store (player_store.py), which holds the
+# dump of all the players sleeper contains. Saves that file as processed_kept_players.json. sleeper_keeper.py works out
+# the kept players from the Sleeper drafts (keeper_chains.py), and uses this file for kept players that were not marked
+# as keepers in the draft.
 
-# Change this to the current year.
+logger = get_logger(__name__)
+
+# Year the kept players are processed for. Defaults to the newest season in the history store. Can be set with the
+# first argument, for example: python process_kept_csv.py 2021
 year = 2020
 
 
 def nice_print(args):
-    """ Pretty print args
+    """ Pretty print args to the debug log
 
     Args:
         args: Thing to pretty print
     """
-    print('{}'.format(pformat(args)))
+    logger.debug('%s', LazyPformat(args))
 
 
 def convert_csv_to_json():
@@ -70,9 +74,9 @@ def add_sleeper_information():
     """ Adds information from the sleeper api to the new kept_players dictionary and generates a new dictionary with
     that information added.
 
-    Loads the kept_players.json and dump_players.json files. Loops through the kept_players dictionary and attempts to
-    match the kept_players name with the name from dump_players. From the dump_players dictionary obtain the player_id,
-    team, and position. Combine all this into a new dictionary and save that dictionary to
+    Loads the kept_players.json file and opens the player store. Loops through the kept_players dictionary and looks
+    up the kept_players name in the name index of the player store. From the player store obtain the player_id, team,
+    and position. Combine all this into a new dictionary and save that dictionary to
     data_files/{year}/processed_kept_players.json
 
     processed_kept_players.json structured as:
@@ -88,49 +92,52 @@ def add_sleeper_information():
     with open('data_files/{}/kept_players/kept_players.json'.format(year), 'r') as f:
         kept_dict = json.load(f)
 
-    # If dump_players.json doesn't exist, run the get_players function from sleeper_keeper to generate it.
-    # This fixed a dependency bug with sleeper_keeper and
-    if os.path.isfile('data_files/{}/dump_players.json'.format(year)):
-        with open('data_files/{}/dump_players.json'.format(year), 'r') as f:
-            players = json.load(f)
-    else:
-        print('Getting all players from Sleeper API...')
-        players = Players().get_all_players()
-
-        nice_print(players)
+    # Get the players from the player store. The player dump is only downloaded from the Sleeper API if the store is
+    # empty or older than the max age.
+    store = open_player_store(year, refresh=True)
 
     # Empty dictionary to store processed kept players in
     player_dict = dict()
 
     # Loop through players in the dictionary of kept players to get their player id
     for player_name in kept_dict:
-        # Go through all the players in the dump_players.json file. For each player get the id. Then compare
-        # the player name in the kept_players dictionary to the player name in the dump_players dictionary.
-        # If they match, add a new entry in the player_dict that starts with the player id. Also add additional
-        # information (position and team) to determine if the player is correct. If there is not a match, then print
-        # a warning and do not replace the player_name with player_id.
+        # Look up the player name in the name index of the player store. Names are normalized, so case, punctuation
+        # and suffixes like Jr. do not matter. If there is a match, add a new entry in the player_dict that starts with
+        # the player id. Also add additional information (position and team) to determine if the player is correct.
+        # If there is not a match, then print a warning with the closest names and do not replace the player_name
+        # with player_id.
         #
         # The intent of this is that if a player name is not matched, go look up the player name and fix the player name
         # in the csv file.
-        for player in players:
-            player_id = players[player]['player_id']
-            player_name_dump = '{} {}'.format(players[player]['first_name'], players[player]['last_name'])
-            # nice_print(players[player])
-            if player_name.lower() == player_name_dump.lower():
-                print('{} has id {}'.format(player_name, player_id))
-                player_dict[player_id] = dict()
-                player_dict[player_id]['player_name'] = player_name
-                player_dict[player_id]['years_kept'] = kept_dict[player_name]['Years Kept']
-                player_dict[player_id]['team'] = players[player]['team']
-                player_dict[player_id]['position'] = players[player]['position']
-                player_dict[player_id]['manager'] = kept_dict[player_name]['Manager']
-                break
+        players = store.find_players(player_name)
+        if players:
+            player = players[0]
+            player_id = player['player_id']
+            print('{} has id {}'.format(player_name, player_id))
+            if len(players) > 1:
+                print('*** {} matches {} players. Using {} {} {}. Check the other ids: {} ***'.format(
+                    player_name,
+                    len(players),
+                    player['position'],
+                    player['team'],
+                    player_id,
+                    ', '.join(other['player_id'] for other in players[1:])))
+            player_dict[player_id] = dict()
+            player_dict[player_id]['player_name'] = player_name
+            player_dict[player_id]['years_kept'] = kept_dict[player_name]['Years Kept']
+            player_dict[player_id]['team'] = player['team']
+            player_dict[player_id]['position'] = player['position']
+            player_dict[player_id]['manager'] = kept_dict[player_name]['Manager']
         else:
             print('*** {} id not found. Add manually ***'.format(player_name))
+            for suggestion, player_ids in store.suggest_names(player_name):
+                print('\tDid you mean {}? ids: {}'.format(suggestion, ', '.join(player_ids)))
             player_dict[player_name] = dict()
             player_dict[player_name]['player_name'] = player_name
             player_dict[player_name]['years_kept'] = kept_dict[player_name]['Years Kept']
 
+    store.close()
+
     # Debug print statements
     # nice_print(player_name)
     # nice_print(kept_dict)
@@ -176,6 +183,9 @@ def pretty_print_kept(player_dict):
 
 
 if __name__ == "__main__":
+    setup_logging()
+    year = int(sys.argv[1]) if len(sys.argv) > 1 else latest_year(year)
+    logger.info('Processing the kept players for %s', year)
     convert_csv_to_json()
     player_dict = add_sleeper_information()
     pretty_print_kept(player_dict)
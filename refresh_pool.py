@@ -0,0 +1,336 @@
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from keeper_log import get_logger, setup_logging, web_log_format
+from keeper_metrics import metrics
+from pathlib import Path
+
+# This is a helper module for keeperwebpage.py.
+# main_program is mostly Python code, so refreshes run in threads of one process take turns on the GIL, and refreshing
+# N leagues takes N times as long as one. The RefreshPool runs the refreshes in a pool of worker processes instead, so
+# leagues are refreshed on as many cores as there are workers. The counters of each refresh are sent back and added to
+# the metrics of the process that asked for the refresh.
+#
+# The worker processes are started with spawn, because forking a process that is running threads is not safe. With
+# KEEPER_REFRESH_PROCESSES=0 the refreshes are run in the calling thread instead.
+#
+# Each of the uWSGI workers is its own process, and a pool in every one of them would start workers * processes
+# interpreters. Only the leader, the worker holding the refresh_worker.LeaderLock, starts the pool. The other workers
+# hand their refreshes to it through the RefreshQueue, a table in SQLite, and wait for them. If the leader dies, a
+# waiting worker takes the lock and runs the queue.
+
+logger = get_logger(__name__)
+
+# Path of the queue the uWSGI workers hand their refreshes to the leader through
+queue_path = 'data_files/refresh_queue.db'
+# Seconds between checks of the refresh queue
+poll_interval = 0.5
+# Seconds a worker waits for the leader to finish a refresh
+refresh_timeout = 600
+
+
+def get_refresh_processes():
+    """ Get the number of refresh worker processes from the KEEPER_REFRESH_PROCESSES environment variable
+
+    Returns:
+        processes (int): Number of worker processes. 0 runs refreshes in the calling thread.
+    """
+    default = min(4, os.cpu_count() or 1)
+    try:
+        return int(os.environ.get('KEEPER_REFRESH_PROCESSES', default))
+    except ValueError:
+        logger.warning('KEEPER_REFRESH_PROCESSES is not a number. Using default of %s', default)
+        return default
+
+
+def generate(league_id, year, offline):
+    """ Generate the keeper results of a league
+
+    Args:
+        league_id (str): Id of the league in the keeper service
+        year (int): Year to generate keeper results for
+        offline (bool): Use the saved data files instead of the Sleeper API
+    """
+    # Imported here so the pool can be made without importing all of sleeper_keeper
+    from keeper_persist import wait_for_writes
+    from league_config import get_league
+    from sleeper_keeper import main_program
+
+    league_config = get_league(league_id)
+    assert league_config is not None, 'League {} is not in leagues.json'.format(league_id)
+    main_program(league_config.user, False, not offline, None, offline, year, league_config=league_config)
+    # The data files must be saved before offline mode can use them
+    wait_for_writes()
+
+
+def start_worker(cwd, parent_pid):
+    """ Set up a worker process
+
+    Args:
+        cwd (str): Working directory of the process that made the pool. Paths are relative to it.
+        parent_pid (int): Process that made the pool. The worker exits if it dies, so a new leader does not leave the
+            workers of the old one behind.
+    """
+    os.chdir(cwd)
+    setup_logging(log_format=web_log_format)
+
+    def watch_parent():
+        while os.getppid() == parent_pid:
+            time.sleep(poll_interval)
+        os._exit(1)
+
+    threading.Thread(target=watch_parent, name='watch_parent', daemon=True).start()
+
+
+def run_refresh(league_id, year, offline):
+    """ Generate the keeper results of a league in a worker process
+
+    Args:
+        league_id (str): Id of the league in the keeper service
+        year (int): Year to generate keeper results for
+        offline (bool): Use the saved data files instead of the Sleeper API
+
+    Returns:
+        counters (dict): Metrics counters of the refresh
+    """
+    before = metrics.snapshot()
+    generate(league_id, year, offline)
+    return metrics.diff(before)
+
+
+class RefreshQueue(object):
+    """ SQLite queue of the refreshes the uWSGI workers hand to the leader
+
+    Each thread of each process has its own connection.
+
+    Args:
+        path (str): Path of the SQLite database
+    """
+    def __init__(self, path=queue_path):
+        self.path = path
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS refreshes (request_id INTEGER PRIMARY KEY, league_id TEXT, '
+                               'year INTEGER, offline INTEGER, status TEXT, error TEXT)')
+
+    def _connection(self):
+        """ Get the connection of this thread. Connections are not shared across a fork.
+
+        Returns:
+            connection (Connection): SQLite connection
+        """
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.connection.execute('PRAGMA journal_mode=WAL')
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def submit(self, league_id, year, offline):
+        """ Add a refresh to the queue
+
+        Args:
+            league_id (str): Id of the league in the keeper service
+            year (int): Year to generate keeper results for
+            offline (bool): Use the saved data files instead of the Sleeper API
+
+        Returns:
+            request_id (int): Id of the refresh in the queue
+        """
+        cursor = self._connection().execute('INSERT INTO refreshes (league_id, year, offline, status) VALUES '
+                                            '(?, ?, ?, ?)', (league_id, year, offline, 'queued'))
+        return cursor.lastrowid
+
+    def take(self):
+        """ Take every queued refresh and mark it running
+
+        Returns:
+            refreshes (list): [(request_id, league_id, year, offline)]
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            refreshes = connection.execute('SELECT request_id, league_id, year, offline FROM refreshes '
+                                           'WHERE status = ? ORDER BY request_id', ('queued',)).fetchall()
+            connection.execute('UPDATE refreshes SET status = ? WHERE status = ?', ('running', 'queued'))
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return [(request_id, league_id, year, bool(offline)) for request_id, league_id, year, offline in refreshes]
+
+    def requeue_running(self):
+        """ Queue the refreshes again that a leader that died was running """
+        self._connection().execute('UPDATE refreshes SET status = ? WHERE status = ?', ('queued', 'running'))
+
+    def finish(self, request_id, error=None):
+        """ Mark a refresh done, or failed if there is an error
+
+        Args:
+            request_id (int): Id of the refresh in the queue
+            error (str): Why the refresh failed. None if it was done.
+        """
+        self._connection().execute('UPDATE refreshes SET status = ?, error = ? WHERE request_id = ?',
+                                   ('done' if error is None else 'failed', error, request_id))
+
+    def status(self, request_id):
+        """ Get the status of a refresh
+
+        Args:
+            request_id (int): Id of the refresh in the queue
+
+        Returns:
+            status (tuple): (status, error). status is queued, running, done or failed.
+        """
+        row = self._connection().execute('SELECT status, error FROM refreshes WHERE request_id = ?',
+                                         (request_id,)).fetchone()
+        return row if row is not None else ('failed', 'The refresh is not in the queue')
+
+    def remove(self, request_id):
+        """ Remove a refresh from the queue
+
+        Args:
+            request_id (int): Id of the refresh in the queue
+        """
+        self._connection().execute('DELETE FROM refreshes WHERE request_id = ?', (request_id,))
+
+
+class RefreshPool(object):
+    """ Pool of worker processes that generate keeper results
+
+    Args:
+        processes (int): Number of worker processes. 0 runs refreshes in the calling thread.
+        leader_lock (LeaderLock): Lock held by the only process that starts the pool. The other processes hand their
+            refreshes to it through the RefreshQueue. None starts a pool in every process.
+        queue_path (str): Path of the RefreshQueue
+    """
+    def __init__(self, processes=None, leader_lock=None, queue_path=queue_path):
+        self.processes = get_refresh_processes() if processes is None else processes
+        self.leader_lock = leader_lock
+        self.queue_path = queue_path
+        self._queue = None
+        self._executor = None
+        # Process the executor was made in. uWSGI forks the workers after the app is imported.
+        self._pid = None
+        # Process the queue is run in
+        self._serving_pid = None
+        self._lock = threading.Lock()
+        if leader_lock is not None:
+            leader_lock.on_acquire(self._start_serving)
+
+    @property
+    def queue(self):
+        """ RefreshQueue, made the first time it is used """
+        with self._lock:
+            if self._queue is None:
+                self._queue = RefreshQueue(self.queue_path)
+            return self._queue
+
+    def refresh(self, league_id, year, offline=False):
+        """ Generate the keeper results of a league and wait for them
+
+        Args:
+            league_id (str): Id of the league in the keeper service
+            year (int): Year to generate keeper results for
+            offline (bool): Use the saved data files instead of the Sleeper API
+        """
+        if not self.processes:
+            generate(league_id, year, offline)
+            return
+        if self.leader_lock is None or self.leader_lock.hold():
+            self._run(league_id, year, offline)
+            return
+
+        request_id = self.queue.submit(league_id, year, offline)
+        deadline = time.monotonic() + refresh_timeout
+        try:
+            while True:
+                status, error = self.queue.status(request_id)
+                if status == 'done':
+                    return
+                if status == 'failed':
+                    raise RuntimeError('Refreshing {} {} failed: {}'.format(league_id, year, error))
+                if time.monotonic() > deadline:
+                    raise RuntimeError('Refreshing {} {} timed out in the refresh queue'.format(league_id, year))
+                # Take over the queue, this refresh included, if the leader has died
+                self.leader_lock.hold()
+                time.sleep(poll_interval)
+        finally:
+            self.queue.remove(request_id)
+
+    def _run(self, league_id, year, offline):
+        """ Generate the keeper results of a league in the pool and wait for them
+
+        Args:
+            league_id (str): Id of the league in the keeper service
+            year (int): Year to generate keeper results for
+            offline (bool): Use the saved data files instead of the Sleeper API
+        """
+        future = self._get_executor().submit(run_refresh, league_id, year, offline)
+        try:
+            counters = future.result()
+        except BrokenProcessPool:
+            # A worker died. Make a new pool for the next refresh.
+            with self._lock:
+                self._executor = None
+            raise
+        metrics.add(counters)
+
+    def _start_serving(self):
+        """ Start running the refresh queue in this process. Called when this process becomes the leader. """
+        with self._lock:
+            if self._serving_pid == os.getpid():
+                return
+            self._serving_pid = os.getpid()
+        thread = threading.Thread(target=self._serve, name='refresh_queue', daemon=True)
+        thread.start()
+
+    def _serve(self):
+        """ Run the refreshes handed to the leader. Each refresh runs in its own thread, so they share the pool. """
+        self.queue.requeue_running()
+        while True:
+            try:
+                refreshes = self.queue.take()
+            except sqlite3.Error as e:
+                logger.error('Unable to read the refresh queue: %s', e)
+                refreshes = list()
+            for refresh in refreshes:
+                thread = threading.Thread(target=self._serve_refresh, args=refresh, daemon=True)
+                thread.start()
+            time.sleep(poll_interval)
+
+    def _serve_refresh(self, request_id, league_id, year, offline):
+        """ Run a refresh from the queue and mark it done or failed
+
+        Args:
+            request_id (int): Id of the refresh in the queue
+            league_id (str): Id of the league in the keeper service
+            year (int): Year to generate keeper results for
+            offline (bool): Use the saved data files instead of the Sleeper API
+        """
+        try:
+            self._run(league_id, year, offline)
+        except Exception as e:
+            logger.error('Refresh of %s %s from the queue failed: %s', league_id, year, e)
+            self.queue.finish(request_id, str(e) or type(e).__name__)
+        else:
+            self.queue.finish(request_id)
+
+    def _get_executor(self):
+        """ Get the process pool, making it the first time it is used in this process
+
+        Returns:
+            executor (ProcessPoolExecutor): Process pool
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=start_worker,
+                                                     initargs=(os.getcwd(), os.getpid()))
+                self._pid = os.getpid()
+            return self._executor
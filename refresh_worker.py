@@ -0,0 +1,132 @@
+import fcntl
+import os
+import threading
+import time
+from keeper_cache import get_cache_ttl
+from keeper_log import get_logger
+from pathlib import Path
+
+# This is a helper module for keeperwebpage.py.
+# The RefreshScheduler refreshes the keeper results on an interval, so page views find fresh results instead of
+# starting the refresh themselves. It is a daemon thread in each uWSGI worker process, but only the worker holding the
+# LeaderLock refreshes. If that worker dies, the lock is released and another worker takes over on its next tick. The
+# same worker owns the refresh_pool.RefreshPool processes.
+#
+# uWSGI imports the app in the master process and forks the workers, and threads do not survive a fork. start is
+# called on every request and only starts the thread the first time it is called in a process.
+
+logger = get_logger(__name__)
+
+
+def get_refresh_interval():
+    """ Get the refresh interval from the KEEPER_REFRESH_INTERVAL environment variable
+
+    Returns:
+        interval (int): Number of seconds between scheduled refreshes. Defaults to the cache TTL.
+    """
+    ttl = get_cache_ttl()
+    try:
+        return int(os.environ.get('KEEPER_REFRESH_INTERVAL', ttl))
+    except ValueError:
+        logger.warning('KEEPER_REFRESH_INTERVAL is not a number. Using the cache TTL of %s seconds', ttl)
+        return ttl
+
+
+class LeaderLock(object):
+    """ Lock file held by one worker process, the leader, until it exits
+
+    Args:
+        lock_path (str): Path of the lock file
+    """
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        # Functions called with no arguments when this process becomes the leader
+        self._listeners = list()
+        self._lock_file = None
+        # Process holding _lock_file. A lock file inherited from before a fork is not ours.
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def on_acquire(self, listener):
+        """ Call a function when this process becomes the leader
+
+        Args:
+            listener (func): Function that takes no arguments
+        """
+        self._listeners.append(listener)
+
+    def hold(self):
+        """ Take the lock if no other process holds it
+
+        Returns:
+            held (bool): True if this process is the leader
+        """
+        with self._lock:
+            if self._lock_file is not None and self._pid == os.getpid():
+                return True
+
+            path = Path(self.lock_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            lock_file = open(path, 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+
+            # The lock is held until the process exits
+            self._lock_file = lock_file
+            self._pid = os.getpid()
+        logger.info('Process %s is the refresh leader', os.getpid())
+        for listener in self._listeners:
+            listener()
+        return True
+
+
+class RefreshScheduler(object):
+    """ Background thread that refreshes the results in a KeeperCache on an interval
+
+    Args:
+        keeper_cache (KeeperCache): Cache to refresh
+        get_keys (func): Function that returns a list of (league, year) to refresh
+        leader_lock (LeaderLock): Lock held by the worker that does the scheduled refreshes
+        interval (int): Number of seconds between scheduled refreshes
+    """
+    def __init__(self, keeper_cache, get_keys, leader_lock, interval=None):
+        self.keeper_cache = keeper_cache
+        self.get_keys = get_keys
+        self.leader_lock = leader_lock
+        self.interval = get_refresh_interval() if interval is None else interval
+        # Process the thread was started in
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """ Start the scheduler thread, unless it is already running in this process """
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run, name='refresh_scheduler', daemon=True)
+            thread.start()
+
+    def _run(self):
+        """ Refresh every key on each tick while this process holds the scheduler lock """
+        while True:
+            if self.leader_lock.hold():
+                self.tick()
+            time.sleep(self.interval)
+
+    def tick(self):
+        """ Refresh every key that nothing was published for since the last tick """
+        try:
+            keys = self.get_keys()
+        except Exception as e:
+            logger.error('Unable to get the keeper results to refresh: %s', e)
+            return
+
+        not_before = time.time() - self.interval
+        for league, year in keys:
+            self.keeper_cache.refresh_in_background(league, year, not_before)
@@ -0,0 +1,266 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from keeper_log import get_logger
+from keeper_metrics import metrics
+from pathlib import Path
+
+# This is a helper module for sleeper_client.py.
+# Every refresh used to request everything from the Sleeper API again, but most of it never changes. A draft is final
+# once it is complete, the transactions of a week are final once the week is over, and everything about a league is
+# final once its season is complete. The ResponseCache keeps the decoded Sleeper API responses in a SQLite database
+# keyed by url. Each endpoint has a policy that decides how long its response is kept:
+#
+#     league/{id}, league/{id}/users, league/{id}/rosters    forever once the league is complete, otherwise short_ttl
+#     league/{id}/drafts, draft/{id}/picks                    forever once the draft is complete, otherwise short_ttl
+#     league/{id}/transactions/{week}                         forever once the week is over, otherwise short_ttl
+#     state/nfl                                               state_ttl
+#     user/...                                                user_ttl
+#
+# Urls without a policy, and failed requests, are never cached. The player dump is not requested through here. The
+# PlayerStore already downloads it at most once a day with a conditional request.
+#
+# A week is over once the NFL state is past it. The cache remembers the season and status of each league and the status
+# of each draft from their responses, so a policy can tell if a response is final without another request.
+
+logger = get_logger(__name__)
+
+# Default path of the response cache. Can be overridden with SLEEPER_RESPONSE_CACHE. An empty value turns it off.
+default_cache_path = 'data_files/sleeper_responses.db'
+
+# Seconds live league responses are kept, like the rosters during the season
+short_ttl = 5 * 60
+# Seconds the NFL state is kept. It only changes once a week.
+state_ttl = 60 * 60
+# Seconds user lookups and the leagues of a user are kept
+user_ttl = 24 * 60 * 60
+
+base_url = 'https://api.sleeper.app/v1/'
+nfl_state_url = '{}state/nfl'.format(base_url)
+
+
+def get_cache_path():
+    """ Get the path of the response cache from the SLEEPER_RESPONSE_CACHE environment variable
+
+    Returns:
+        path (str): Path of the response cache or None if the cache is turned off
+    """
+    return os.environ.get('SLEEPER_RESPONSE_CACHE', default_cache_path) or None
+
+
+def league_policy(cache, match, data):
+    """ league/{id}. Remembers the season and status of the league. """
+    league_id = match.group(1)
+    cache.remember_league(league_id, data.get('season'), data.get('status'))
+    return None if data.get('status') == 'complete' else short_ttl
+
+
+def league_member_policy(cache, match, data):
+    """ league/{id}/users and league/{id}/rosters """
+    return None if cache.league_complete(match.group(1)) else short_ttl
+
+
+def league_drafts_policy(cache, match, data):
+    """ league/{id}/drafts. Remembers the status of each draft. The drafts of a complete league are complete. """
+    league_complete = cache.league_complete(match.group(1))
+    all_complete = True
+    for draft in data:
+        complete = league_complete or draft.get('status') == 'complete'
+        cache.remember_draft(draft['draft_id'], 'complete' if complete else draft.get('status'))
+        all_complete = all_complete and complete
+    return None if all_complete else short_ttl
+
+
+def draft_picks_policy(cache, match, data):
+    """ draft/{id}/picks """
+    return None if cache.draft_complete(match.group(1)) else short_ttl
+
+
+def transactions_policy(cache, match, data):
+    """ league/{id}/transactions/{week} """
+    return None if cache.week_over(match.group(1), int(match.group(2))) else short_ttl
+
+
+def state_policy(cache, match, data):
+    """ state/nfl """
+    return state_ttl
+
+
+def user_policy(cache, match, data):
+    """ user/{name} and user/{id}/leagues/nfl/{season} """
+    return user_ttl
+
+
+# (url pattern, policy). A policy takes the cache, the url match and the decoded response and returns the number of
+# seconds to keep the response, None to keep it forever, or 0 to not cache it.
+policies = [
+    (re.compile(r'league/([^/]+)$'), league_policy),
+    (re.compile(r'league/([^/]+)/(?:users|rosters)$'), league_member_policy),
+    (re.compile(r'league/([^/]+)/drafts$'), league_drafts_policy),
+    (re.compile(r'draft/([^/]+)/picks$'), draft_picks_policy),
+    (re.compile(r'league/([^/]+)/transactions/(\d+)$'), transactions_policy),
+    (re.compile(r'state/nfl$'), state_policy),
+    (re.compile(r'user/'), user_policy),
+]
+
+
+class ResponseCache(object):
+    """ SQLite cache of decoded Sleeper API responses, keyed by url
+
+    Safe to use from several threads and processes. Each thread of each process has its own connection.
+
+    Args:
+        path (str): Path of the SQLite database
+        fetch (func): Function that takes a url and returns the decoded response, or the HTTPError if it failed
+    """
+    def __init__(self, path, fetch):
+        self.path = path
+        self.fetch = fetch
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, data TEXT, fetched REAL, expires REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS leagues (league_id TEXT PRIMARY KEY, season TEXT, '
+                               'status TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS drafts (draft_id TEXT PRIMARY KEY, status TEXT)')
+
+    def _connection(self):
+        """ Get the connection of this thread. Connections are not shared across a fork.
+
+        Returns:
+            connection (Connection): SQLite connection
+        """
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=30)
+            self._local.connection.execute('PRAGMA journal_mode=WAL')
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, url):
+        """ Get a url from the cache, or from the Sleeper API if it is not cached or has expired
+
+        Args:
+            url (str): Sleeper API url
+
+        Returns:
+            result (dict/list): Decoded json response, or the HTTPError if the request failed
+        """
+        row = self._connection().execute('SELECT data, expires FROM responses WHERE url = ?', (url,)).fetchone()
+        if row is not None and (row[1] is None or row[1] > time.time()):
+            metrics.cache('sleeper_response', 'hit')
+            return json.loads(row[0])
+
+        metrics.cache('sleeper_response', 'miss' if row is None else 'expired')
+        result = self.fetch(url)
+        if isinstance(result, Exception):
+            return result
+
+        max_age = self.max_age(url, result)
+        if max_age != 0:
+            fetched = time.time()
+            expires = None if max_age is None else fetched + max_age
+            with self._connection() as connection:
+                connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                                   (url, json.dumps(result), fetched, expires))
+        return result
+
+    def max_age(self, url, data):
+        """ Number of seconds to keep a response, from the policy of its endpoint
+
+        Args:
+            url (str): Sleeper API url
+            data (dict/list): Decoded json response
+
+        Returns:
+            max_age (int): Seconds to keep the response, None to keep it forever, or 0 to not cache it
+        """
+        if not url.startswith(base_url):
+            return 0
+        endpoint = url[len(base_url):]
+        for pattern, policy in policies:
+            match = pattern.match(endpoint)
+            if match is not None:
+                try:
+                    return policy(self, match, data)
+                except (AttributeError, KeyError, TypeError, ValueError) as e:
+                    # The response is not what the policy expected. Do not keep it.
+                    logger.warning('Not caching %s: %s', url, e)
+                    return 0
+        return 0
+
+    def remember_league(self, league_id, season, status):
+        """ Remember the season and status of a league
+
+        Args:
+            league_id (str): Sleeper league id
+            season (str): Season of the league
+            status (str): Status of the league, like 'in_season' or 'complete'
+        """
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO leagues VALUES (?, ?, ?)', (league_id, season, status))
+
+    def remember_draft(self, draft_id, status):
+        """ Remember the status of a draft
+
+        Args:
+            draft_id (str): Sleeper draft id
+            status (str): Status of the draft, like 'drafting' or 'complete'
+        """
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO drafts VALUES (?, ?)', (draft_id, status))
+
+    def league_complete(self, league_id):
+        """ Check if the season of a league is complete
+
+        Args:
+            league_id (str): Sleeper league id
+
+        Returns:
+            complete (bool): True if the league was complete the last time it was requested
+        """
+        row = self._connection().execute('SELECT status FROM leagues WHERE league_id = ?', (league_id,)).fetchone()
+        return row is not None and row[0] == 'complete'
+
+    def draft_complete(self, draft_id):
+        """ Check if a draft is complete
+
+        Args:
+            draft_id (str): Sleeper draft id
+
+        Returns:
+            complete (bool): True if the draft was complete the last time the drafts of its league were requested
+        """
+        row = self._connection().execute('SELECT status FROM drafts WHERE draft_id = ?', (draft_id,)).fetchone()
+        return row is not None and row[0] == 'complete'
+
+    def week_over(self, league_id, week):
+        """ Check if a week of a league is over, so its transactions are final
+
+        Args:
+            league_id (str): Sleeper league id
+            week (int): Week of the season
+
+        Returns:
+            over (bool): True if the week is over
+        """
+        row = self._connection().execute(
+            'SELECT season, status FROM leagues WHERE league_id = ?', (league_id,)).fetchone()
+        if row is None or row[0] is None:
+            return False
+        season, status = row
+        if status == 'complete':
+            return True
+
+        state = self.get(nfl_state_url)
+        if not isinstance(state, dict) or state.get('season') is None:
+            return False
+        if int(season) != int(state['season']):
+            return int(season) < int(state['season'])
+        if state.get('season_type') in ('post', 'off'):
+            return True
+        return state.get('season_type') == 'regular' and week < int(state.get('week') or 0)
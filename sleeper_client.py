@@ -0,0 +1,334 @@
+import copy
+import fcntl
+import os
+import random
+import requests
+import threading
+import time
+from concurrent.futures import Future
+from keeper_log import get_logger
+from keeper_metrics import count_response, metrics, sleeper_endpoint
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from response_cache import ResponseCache, get_cache_path
+from sleeper_wrapper.base_api import BaseApi
+
+# This is a helper module for sleeper_keeper.py.
+# sleeper_wrapper calls requests.get for every request, which opens a new connection to the Sleeper API each time.
+# All of the sleeper_wrapper objects (User, League, Drafts, Players) make their requests through BaseApi._call, so
+# install() replaces BaseApi._call with a version that uses one shared session. The session keeps connections to the
+# Sleeper API alive and reuses them, and is sized for the concurrent requests made by main_program.
+#
+# Responses that are final, like complete drafts and the transactions of past weeks, are kept in the ResponseCache, so
+# a refresh only requests the endpoints that can still change. See response_cache.py for how long each is kept.
+#
+# Every request to the Sleeper API goes through get, which:
+#     waits for a token from a token bucket, so no more than SLEEPER_RATE_LIMIT requests a second are sent
+#     times out instead of waiting forever on a slow response
+#     tries again after a connection error, a timeout, a 429 or a 5xx, waiting a random part of an exponential backoff
+#         so workers that failed at the same time do not all try again at the same time
+# Identical requests made at the same time by different threads of a process share one request. The token bucket is
+# kept in a lock file under data_files, so the uWSGI workers and refresh processes all take from the same bucket.
+
+logger = get_logger(__name__)
+
+# Maximum number of connections kept open to the Sleeper API
+pool_size = 16
+# Seconds to wait for a connection to the Sleeper API, and for each read of a response
+connect_timeout = 5
+read_timeout = 30
+# Number of times a failed request is tried again
+max_retries = 3
+# Seconds of backoff before the first retry. Doubles with each retry, up to backoff_max.
+backoff_base = 0.5
+backoff_max = 10
+# Response status codes that are worth trying again
+retry_statuses = {429, 500, 502, 503, 504}
+# Default requests a second to the Sleeper API from every process together. Sleeper asks for less than 1000 a minute.
+default_rate_limit = 10
+# Requests that can be sent at once after the client has been idle
+rate_limit_burst = 20
+# File the token bucket shared by every process is kept in
+rate_limit_path = 'data_files/sleeper_rate_limit'
+
+
+def get_rate_limit():
+    """ Get the rate limit from the SLEEPER_RATE_LIMIT environment variable
+
+    Returns:
+        rate_limit (float): Requests a second to the Sleeper API from every process. 0 turns off the rate limit.
+    """
+    try:
+        return float(os.environ.get('SLEEPER_RATE_LIMIT', default_rate_limit))
+    except ValueError:
+        logger.warning('SLEEPER_RATE_LIMIT is not a number. Using default of %s', default_rate_limit)
+        return default_rate_limit
+
+
+class TokenBucket(object):
+    """ Token bucket rate limiter shared by every thread and process using the same file
+
+    The file holds the tokens in the bucket and the time they were counted, and is locked while a token is taken. If
+    the file can not be used, the bucket is kept in this process only.
+
+    Args:
+        rate (float): Tokens added a second. 0 turns off the rate limit.
+        burst (int): Most tokens the bucket holds
+        path (str): Path of the file the bucket is kept in
+    """
+    def __init__(self, rate, burst, path=rate_limit_path):
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        # Bucket of this process, used if the file can not be
+        self._state = (burst, time.time())
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Take a token, waiting until one is available
+
+        Returns:
+            waited (float): Seconds waited for the token
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            try:
+                tokens = self._take_shared()
+            except OSError as e:
+                logger.warning('Unable to use the rate limit file %s: %s', self.path, e)
+                self._state = self._take(self._state)
+                tokens = self._state[0]
+        wait = -tokens / self.rate if tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def _take(self, state):
+        """ Take a token from a bucket
+
+        The token is taken now, even if the bucket goes below 0. Callers waiting at the same time each wait for their
+        own token.
+
+        Args:
+            state (tuple): (tokens, time the tokens were counted)
+
+        Returns:
+            state (tuple): (tokens left, now)
+        """
+        tokens, updated = state
+        now = time.time()
+        tokens = min(self.burst, tokens + max(0, now - updated) * self.rate)
+        return tokens - 1, now
+
+    def _take_shared(self):
+        """ Take a token from the bucket in the file
+
+        Returns:
+            tokens (float): Tokens left in the bucket. Below 0 if the caller has to wait.
+        """
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = tuple(float(value) for value in f.read().split())
+                except ValueError:
+                    state = ()
+                if len(state) != 2:
+                    state = (self.burst, time.time())
+                tokens, updated = self._take(state)
+                f.seek(0)
+                f.truncate()
+                f.write('{} {}'.format(tokens, updated))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return tokens
+
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+# Count every request and the bytes downloaded
+session.hooks['response'].append(count_response)
+
+rate_limiter = TokenBucket(get_rate_limit(), rate_limit_burst)
+
+# Requests in flight in this process. {url: Future}
+_in_flight = dict()
+_in_flight_lock = threading.Lock()
+
+
+# Response cache of each cache path. {absolute path: ResponseCache}
+_response_caches = dict()
+_response_caches_lock = threading.Lock()
+
+
+def get_response_cache():
+    """ Get the response cache at the path set by SLEEPER_RESPONSE_CACHE
+
+    Returns:
+        response_cache (ResponseCache): Response cache or None if it is turned off
+    """
+    path = get_cache_path()
+    if path is None:
+        return None
+    # Relative paths are relative to the working directory, which can change between runs
+    path = os.path.abspath(path)
+    with _response_caches_lock:
+        if path not in _response_caches:
+            _response_caches[path] = ResponseCache(path, fetch)
+        return _response_caches[path]
+
+
+def backoff(attempt):
+    """ Seconds to wait before trying a request again
+
+    Args:
+        attempt (int): Number of the attempt that failed, starting at 0
+
+    Returns:
+        delay (float): Random number of seconds up to the exponential backoff of the attempt
+    """
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+
+def retry_after(response):
+    """ Seconds the Sleeper API asked to wait before trying again
+
+    Args:
+        response (Response): Response with a 429 or 5xx status
+
+    Returns:
+        delay (float): Seconds from the Retry-After header, up to backoff_max, or None if there is no header
+    """
+    try:
+        return min(backoff_max, float(response.headers['Retry-After']))
+    except (KeyError, ValueError):
+        return None
+
+
+def get(url, headers=None, stream=False):
+    """ Send a GET request to the Sleeper API with the rate limit, timeouts and retries
+
+    Args:
+        url (str): Sleeper API url
+        headers (dict): Extra request headers
+        stream (bool): Do not download the body until it is read
+
+    Returns:
+        response (Response): Response from the Sleeper API. The last response if every attempt failed.
+    """
+    for attempt in range(max_retries + 1):
+        waited = rate_limiter.acquire()
+        if waited:
+            metrics.increment('sleeper_rate_limit_wait_seconds_total', waited)
+        try:
+            response = session.get(url, headers=headers, stream=stream, timeout=(connect_timeout, read_timeout))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == max_retries:
+                raise
+            reason = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'connection'
+            delay = backoff(attempt)
+        else:
+            if response.status_code not in retry_statuses or attempt == max_retries:
+                return response
+            reason = str(response.status_code)
+            delay = retry_after(response) or backoff(attempt)
+            response.close()
+
+        metrics.increment('sleeper_retries_total', endpoint=sleeper_endpoint(url), reason=reason)
+        logger.warning('Sleeper API request to %s failed (%s). Trying again in %.1f seconds', url, reason, delay)
+        time.sleep(delay)
+
+
+def _fetch(url):
+    """ Get a url from the Sleeper API and decode it
+
+    Args:
+        url (str): Sleeper API url
+
+    Returns:
+        result (dict/list): Decoded json response, or the HTTPError if the request failed
+    """
+    response = get(url)
+    try:
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        return e
+
+    return response.json()
+
+
+def fetch(url):
+    """ Get a url from the Sleeper API using the shared session, without the response cache
+
+    If another thread is already requesting the url, its response is shared instead of sending the request again.
+
+    Args:
+        url (str): Sleeper API url
+
+    Returns:
+        result (dict/list): Decoded json response, or the HTTPError if the request failed
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(url)
+        in_flight = future is not None
+        if not in_flight:
+            future = Future()
+            _in_flight[url] = future
+
+    if in_flight:
+        metrics.increment('sleeper_deduplicated_total', endpoint=sleeper_endpoint(url))
+        result = future.result()
+        # Each caller gets its own copy, so a caller that changes the response does not change it for the others
+        return result if isinstance(result, Exception) else copy.deepcopy(result)
+
+    try:
+        result = _fetch(url)
+        future.set_result(result)
+        # The callers sharing the request copy the result, so this caller gets a copy too. If it changed the result
+        # while another caller was copying it, that copy would be torn.
+        return result if isinstance(result, Exception) else copy.deepcopy(result)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[url]
+
+
+def call(url):
+    """ Get a url from the response cache, or from the Sleeper API using the shared session
+
+    Behaves the same as BaseApi._call. If the request fails, the HTTPError is returned instead of raised.
+
+    Args:
+        url (str): Sleeper API url
+
+    Returns:
+        result (dict/list): Decoded json response
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return fetch(url)
+    return response_cache.get(url)
+
+
+def _base_api_call(self, url):
+    """ Replacement for BaseApi._call that uses the shared session
+
+    Args:
+        url (str): Sleeper API url
+
+    Returns:
+        result (dict/list): Decoded json response
+    """
+    return call(url)
+
+
+def install():
+    """ Make every sleeper_wrapper object use the shared session """
+    BaseApi._call = _base_api_call
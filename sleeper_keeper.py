@@ -1,30 +1,81 @@
 import argparse
 import json
 import os
+import sleeper_client
 import sys
-from pathlib import Path
-from pprint import pformat
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fetch_scheduler import print_timings, run_stages
+from history_store import HistoryStore, stored_keeper_inputs
+from keeper_chains import KeeperChains, league_keeper_chains, load_manual_kept
+from keeper_log import LazyPformat, bytes_logged, get_logger, reset_bytes_logged, setup_logging
+from keeper_metrics import metrics, summarize
+from keeper_model import KeeperCandidate, OwnerKeepers, PickTrade, gained_pick, lost_pick
+from keeper_persist import save_in_background, wait_for_writes
+from keeper_report import (CsvReportSink, KeeperIndexSink, TextReportSink, build_keeper_indexes, eligible_positions,
+                           format_position_keepers, render_reports, report_formats)
+from keeper_snapshot import atomic_open, publish_snapshot
+from league_config import default_league, get_league
+from offline_bundle import bundle_path, open_offline_bundle
+from player_store import open_player_store
+from player_table import PlayerTable, player_dict_rows, write_player_table
 from sleeper_wrapper import League, User, Stats, Players, Drafts
 from textwrap import dedent
 
+logger = get_logger(__name__)
+
+# Make all the Sleeper API requests over one shared connection pool
+sleeper_client.install()
+
+# Last week of the season that has transactions
+last_week = 17
+# Maximum number of weeks of transactions requested from the Sleeper API at the same time
+max_transaction_requests = 6
+# Name of YAFL 2.0 in Sleeper
+league_name = default_league.name
+# Sleeper API url with the current NFL season
+nfl_state_url = 'https://api.sleeper.app/v1/state/nfl'
+
+# Kept players of every season, worked out from the archived drafts. Past seasons are remembered between runs.
+keeper_chains = KeeperChains()
+# KeeperChains of each league. {league_id: KeeperChains}
+_league_keeper_chains = {default_league.league_id: keeper_chains}
+
 
 def nice_print(args):
-    """ Pretty print args
+    """ Pretty print args to the debug log
+
+    pformat is only run when debug logging is on.
 
     Args:
         args: Thing to pretty print
     """
-    print('{}'.format(pformat(args)))
+    logger.debug('%s', LazyPformat(args))
+
 
+def get_keeper_chains(league_config):
+    """ Get the KeeperChains of a league
 
-def get_league_id(user, year):
+    Args:
+        league_config (LeagueConfig): League to get the kept players of
+
+    Returns:
+        keeper_chains (KeeperChains): Kept players of every season of the league
+    """
+    if league_config.league_id not in _league_keeper_chains:
+        _league_keeper_chains[league_config.league_id] = league_keeper_chains(league_config)
+    return _league_keeper_chains[league_config.league_id]
+
+
+def get_league_id(user, year, name=league_name):
     """ Get the league object from a User object
 
-    Get all the leagues of the user. Find the league id for YAFL 2.0. Return the League obj for YAFL 2.0.
+    Get all the leagues of the user. Find the league id for the league. Return the League obj for the league.
 
     Args:
         user (obj): User object from sleeper_wrapper_api
         year (int): Year of the league to pull information from sleeper API
+        name (str): Name of the league in Sleeper. Defaults to YAFL 2.0.
 
     Returns:
         league (obj): League object from sleeper_wrapper_api
@@ -33,10 +84,10 @@ def get_league_id(user, year):
 
     for league_info in all_leagues:
         # print('{}'.format(pformat(league['league_id'])))
-        if league_info['name'] == 'YAFL 2.0':
+        if league_info['name'] == name:
             league_id = league_info['league_id']
         else:
-            print('User: {} is not part of YAFL 2.0. Exiting...'.format(user.get_username()))
+            logger.warning('User: %s is not part of %s. Exiting...', user.get_username(), name)
             continue
 
     league = League(league_id)
@@ -85,7 +136,7 @@ def get_drafted_players(league):
         drafted_players[player_id]['team_id'] = team_id
         drafted_players[player_id]['round'] = round
 
-    print('{}'.format(pformat(drafted_players)))
+    nice_print(drafted_players)
     return drafted_players
 
 
@@ -127,7 +178,7 @@ def get_rosters(league, user_name_dict):
         owner_name = user_name_dict[owner_id]
         roster_id = roster['roster_id']
         players = roster['players']
-        print('Roster: {}'.format(pformat(roster)))
+        logger.debug('Roster: %s', LazyPformat(roster))
 
         roster_dict[owner_name] = dict()
         roster_dict[owner_name]['owner_id'] = owner_id
@@ -160,90 +211,293 @@ def get_users(league):
     return user_to_ids
 
 
-def get_players(refresh, year):
-    """ Get all the players from Sleeper
+def season_stages(league):
+    """ Stages that get the information for one season of the league from the Sleeper API
 
-    Use the player obj from the Sleeper API and get all the players from Sleeper. The relevant information for a
-    player is stored in the player_dict, which has the following structure:
+    The stages are run with run_stages. Stages that do not depend on each other are run at the same time.
 
-    {player_key: {'player_name': player name, 'position': position}}
+    Args:
+        league (obj): League object from sleeper_wrapper_api
+
+    Returns:
+        stages (dict): {stage_name: (function, [names of stages it depends on])}
+    """
+    stages = dict()
+    # Get the username and id
+    stages['user_dict'] = (lambda: get_users(league), [])
+    # Get the trade deadline from the league settings
+    stages['trade_deadline'] = (lambda: get_trade_deadline(league), [])
+    # Get a dictionary of all the drafted players
+    stages['draft_dict'] = (lambda: get_drafted_players(league), [])
+    # Get a dictionary of all the rostered players
+    stages['roster_dict'] = (lambda user_dict: get_rosters(league, user_dict), ['user_dict'])
+    # Get the transactions for every week of the season. Each week is only requested once.
+    stages['weekly_transactions'] = (lambda: get_weekly_transactions(league), [])
+    # Get the transactions after the trade deadline
+    stages['transactions'] = (get_transactions, ['weekly_transactions', 'trade_deadline'])
+    # Get a list of traded players and dictionary of traded draft picks
+    stages['trades'] = (get_trades, ['weekly_transactions'])
+    return stages
+
+
+def ingest_season(store, league, results, kept_dict=None):
+    """ Store the information for one season in the history store
+
+    Args:
+        store (HistoryStore): History store
+        league (obj): League object from sleeper_wrapper_api
+        results (dict): Results of the season_stages
+        kept_dict (dict): Dictionary of the kept players for the season, if known
+    """
+    trades, traded_picks = results['trades']
+    store.ingest_season(
+        league.get_league(),
+        results['user_dict'],
+        results['roster_dict'],
+        results['draft_dict'],
+        results['transactions'],
+        trades,
+        traded_picks,
+        kept_dict
+    )
+
+
+def find_league(user, season, name=league_name):
+    """ Find a league in the leagues of a user for a season
+
+    Args:
+        user (obj): User object from sleeper_wrapper_api
+        season (int): Year of the season
+        name (str): Name of the league in Sleeper. Defaults to YAFL 2.0.
+
+    Returns:
+        league (obj): League object from sleeper_wrapper_api or None if the user is not in the league that season
+    """
+    all_leagues = user.get_all_leagues('nfl', season)
+    if not isinstance(all_leagues, list):
+        return None
+
+    for league_info in all_leagues:
+        if league_info['name'] == name:
+            return League(league_info['league_id'])
+    return None
+
+
+def update_history(user, league, results, manual_kept, league_config=default_league):
+    """ Store the season that was just run in the history store and discover the seasons that are missing
+
+    Past seasons are found by following previous_league_id back from the league. A new season is found by looking up
+    the current NFL season and the user's leagues in it. Seasons that are already stored and complete are skipped, so
+    each finished season is only requested from the Sleeper API once.
+
+    Args:
+        user (obj): User object from sleeper_wrapper_api
+        league (obj): League object from sleeper_wrapper_api of the season that was run
+        results (dict): Results of the season_stages for league
+        manual_kept (dict): Kept players from processed_kept_players.json for the season, or None
+        league_config (LeagueConfig): League of the season. Each league has its own history store.
+    """
+    store = HistoryStore(league_config.history_path)
+    try:
+        ingest_season(store, league, results, manual_kept)
+
+        # Walk back through the past seasons
+        previous_league_id = league.get_league().get('previous_league_id')
+        while previous_league_id and previous_league_id != '0':
+            previous_league = League(previous_league_id)
+            league_info = previous_league.get_league()
+            if not isinstance(league_info, dict):
+                logger.warning('Unable to get league %s from the Sleeper API', previous_league_id)
+                break
+            if store.needs_ingest(league_info):
+                logger.info('Getting the %s season from the Sleeper API', league_info['season'])
+                past_results, timings = run_stages(season_stages(previous_league))
+                ingest_season(store, previous_league, past_results)
+            previous_league_id = league_info.get('previous_league_id')
+
+        # Look for a season newer than the one that was run
+        state = sleeper_client.call(nfl_state_url)
+        if isinstance(state, dict) and int(state.get('league_season', 0)) > int(league.get_league()['season']):
+            new_league = find_league(user, int(state['league_season']), league_config.name)
+            if new_league is not None and store.needs_ingest(new_league.get_league()):
+                logger.info('Found the %s season in the Sleeper API', state['league_season'])
+                new_results, timings = run_stages(season_stages(new_league))
+                ingest_season(store, new_league, new_results)
+    finally:
+        store.close()
+
+
+def player_table_path(year, league_config=default_league):
+    """ Path of the player table for a year
 
     Args:
-        refresh (bool): Refresh flag from cmd line
         year (int): Year of YAFL 2.0
+        league_config (LeagueConfig): League of the player table
 
     Returns:
-        player_dict (dict): Dictionary of all the players
+        path (str): Path of the player table
     """
-    if refresh:
-        print('Getting all players from Sleeper API...')
-        players = Players().get_all_players()
+    return league_config.path(year, 'player_table.bin')
 
-        # If data_files doesn't exist, create the directory
-        path = Path('./data_files/{}'.format(year))
-        path.mkdir(parents=True, exist_ok=True)
 
-        with open('data_files/{}/dump_players.json'.format(year), 'w') as f:
-            f.write(json.dumps(players))
+def get_players(refresh, year, league_config=default_league):
+    """ Get all the players from Sleeper
+
+    Use the player store to get all the players from Sleeper. The relevant information for a player is stored in a
+    PlayerTable, which is used like a player_dict with the following structure:
+
+    {player_key: {'player_name': player name, 'position': position}}
 
-    # Try to open the data file for the players. If we can not access, assert and recommend them to use the
-    # --refresh flag
+    The player table is saved to {data_dir}/{year}/player_table.bin and is only rebuilt when the shared player store
+    changes.
+
+    Args:
+        refresh (bool): Refresh flag from cmd line. The player dump is only downloaded if it is older than the max age.
+        year (int): Year of YAFL 2.0
+        league_config (LeagueConfig): League of the player table
+
+    Returns:
+        player_dict (PlayerTable): Table of all the players
+    """
+    path = player_table_path(year, league_config)
+    store = open_player_store(year, refresh)
     try:
-        with open('data_files/{}/dump_players.json'.format(year)) as f:
-            data = json.load(f)
-    except Exception as e:
-        print(e)
-        assert False, 'Unable to open data_files/{}/dump_players.json. \n Use --refresh to get data from Sleeper API'.format(year)
+        # If the player store is empty, assert and recommend them to use the --refresh flag
+        assert store.count(), 'No players in {}. \n Use --refresh to get data from Sleeper API'.format(store.path)
+        source = '{}:{}'.format(store.path, store.get_meta('updated_at'))
+
+        if os.path.isfile(path):
+            player_dict = PlayerTable.open(path)
+            if player_dict.source == source:
+                metrics.cache('player_table', 'hit')
+                return player_dict
 
-    players = data
-    player_dict = dict()
+        metrics.cache('player_table', 'miss')
 
-    for player in players:
-        player_id = players[player]['player_id']
-        player_name = '{} {}'.format(players[player]['first_name'], players[player]['last_name'])
-        position = players[player]['position']
+        rows = list()
+        for player_id, first_name, last_name, position in store.get_player_names():
+            player_name = '{} {}'.format(first_name, last_name)
+            rows.append((player_id, player_name, position))
+    finally:
+        store.close()
 
-        player_dict[player_id] = dict()
-        player_dict[player_id]['player_name'] = player_name
-        player_dict[player_id]['position'] = position
+    write_player_table(path, rows, source)
+    player_dict = PlayerTable.open(path)
 
     nice_print(player_dict)
     return player_dict
 
 
-def get_transactions(league, trade_deadline):
+def load_players(year, league_config=default_league):
+    """ Load the saved player table for offline mode
+
+    If there is no player table, build it from a player_dict.json saved before player tables existed.
+
+    Args:
+        year (int): Year of YAFL 2.0
+        league_config (LeagueConfig): League of the player table
+
+    Returns:
+        player_dict (PlayerTable): Table of all the players
+    """
+    path = player_table_path(year, league_config)
+    if not os.path.isfile(path):
+        with open(league_config.path(year, 'player_dict.json')) as f:
+            text = f.read()
+        metrics.json_bytes('read', 'player_dict.json', len(text))
+        write_player_table(path, player_dict_rows(json.loads(text)), 'player_dict.json')
+
+    return PlayerTable.open(path)
+
+
+def load_offline_inputs(year, league_config=default_league):
+    """ Load everything determine_eligible_keepers needs for offline mode
+
+    A season in the history store is read from it. Any other season is read from the offline bundle, which is built
+    from the saved data files.
+
+    Args:
+        year (int): Year of YAFL 2.0
+        league_config (LeagueConfig): League of the season
+
+    Returns:
+        inputs (dict): {'player_dict', 'roster_dict', 'draft_dict', 'transactions', 'traded_picks'}
+    """
+    inputs = stored_keeper_inputs(year, league_config.history_path)
+    if inputs is not None:
+        metrics.cache('history_season', 'hit')
+        # Seasons found in the history store have no saved player table. Build one from the player store.
+        if os.path.isfile(player_table_path(year, league_config)) or \
+                os.path.isfile(league_config.path(year, 'player_dict.json')):
+            inputs['player_dict'] = load_players(year, league_config)
+        else:
+            inputs['player_dict'] = get_players(False, year, league_config)
+        return inputs
+
+    metrics.cache('history_season', 'miss')
+    # Make sure the player table exists. It is built from an old player_dict.json if needed.
+    load_players(year, league_config)
+    # The trades section is not needed to determine keepers, so it is never decoded
+    with open_offline_bundle(year, league_config.data_dir) as bundle:
+        inputs = dict()
+        inputs['player_dict'] = bundle['player_dict']
+        inputs['draft_dict'] = bundle['draft_dict']
+        inputs['roster_dict'] = bundle['rosters']
+        inputs['transactions'] = bundle['transactions']
+        inputs['traded_picks'] = bundle['traded_picks']
+    return inputs
+
+
+def get_weekly_transactions(league):
+    """ Get the transactions for every week of the season from the Sleeper API
+
+    The sleeper API breaks transactions up per week. Each week is only requested once, and the weeks are requested
+    concurrently. The result is shared by get_transactions and get_trades.
+
+    weekly_transactions: {week: [list of transactions]}
+
+    Args:
+        league (obj): Sleeper API league object
+
+    Returns:
+        weekly_transactions (dict): Dictionary of transactions for each week
+    """
+    weeks = list(range(0, last_week + 1))
+
+    with ThreadPoolExecutor(max_workers=max_transaction_requests) as executor:
+        transactions = executor.map(league.get_transactions, weeks)
+
+    weekly_transactions = dict(zip(weeks, transactions))
+    return weekly_transactions
+
+
+def get_transactions(weekly_transactions, trade_deadline):
     """ Go through the transactions and get dropped players after the trade deadline
 
     Go through all the transactions after the trade deadline and get the dropped and added players. Add those players
     to a 'drop' or 'add' list in the transactions_dict. The sleeper API breaks transactions up per week, so we have
-    to get the transactions for each week after the trade deadline until the last week of the season.
+    to go through the transactions for each week after the trade deadline until the last week of the season.
 
     transactions_dict:
     {'drops': [list of dropped player ids], 'adds':[list of added players]}
 
     Args:
-        league (obj): Sleeper API league object
+        weekly_transactions (dict): Dictionary of transactions for each week from get_weekly_transactions
         trade_deadline (int): Trade deadline for YAFL
 
     Returns:
-        drop_list (list): List of dropped players
+        transactions_dict (dict): Dictionary of dropped and added players
     """
-    # Add 1 to the trade deadline. This will be the first week to search for drops. If a player is dropped after
-    # that week, then the player is no longer eligible to be kept.
-    week = trade_deadline + 1
-
     transactions_dict = dict()
     transactions_dict['drops'] = list()
     transactions_dict['adds'] = list()
 
-    # Get the transactions from every week after the trade deadline until the last week of the season, which is 16
+    # Go through the transactions from every week after the trade deadline until the last week of the season.
     # Any player dropped after the trade deadline is not eligible to be kept.
-    # TODO: Change this to 17
-    while week != 18:
-        # TODO: Transactions are store by week
-        transactions = league.get_transactions(week)
+    for week in range(trade_deadline + 1, last_week + 1):
+        transactions = weekly_transactions[week]
 
-        print('Transactions for week {}'.format(week))
+        logger.debug('Transactions for week %s', week)
 
         for transaction in transactions:
             # Sleeper API will show the failed transactions also. We only want to process the successful transactions
@@ -252,23 +506,21 @@ def get_transactions(league, trade_deadline):
                 if transaction['drops']:
                     player_ids = transaction['drops'].keys()
                     for player_id in player_ids:
-                        print('Dropped player: {}'.format(player_id))
+                        logger.debug('Dropped player: %s', player_id)
                         # drop_list.append(player_id)
                         transactions_dict['drops'].append(player_id)
                 if transaction['adds']:
                     player_ids = transaction['adds'].keys()
                     for player_id in player_ids:
-                        print('Added player: {}'.format(player_id))
+                        logger.debug('Added player: %s', player_id)
                         # add_list.append(player_id)
                         transactions_dict['adds'].append(player_id)
 
-        week = week + 1
-
     # nice_print(transactions_dict)
     return transactions_dict
 
 
-def get_trades(league):
+def get_trades(weekly_transactions):
     """ Go through all the transactions. Get a list of traded players and traded draft picks.
 
     traded_picks: {week, [{owner_id, previous_owner_id, round}, {owner_id, previous_owner_id, round}]}
@@ -277,20 +529,19 @@ def get_trades(league):
     through the list to then access the dictionary directly.
 
     Args:
-        league (obj): League object from Sleeper API
+        weekly_transactions (dict): Dictionary of transactions for each week from get_weekly_transactions
 
     Returns:
         traded_players (list): List of player_ids of traded players
         traded_picks (dict): Dictionary of traded picks
     """
     traded_players = list()
-    week = 0
     traded_picks = dict()
 
-    while week != 18:
+    for week in range(0, last_week + 1):
         # Dictionary to hold the traded_picks from the transactions
         traded_picks[week] = dict()
-        transactions = league.get_transactions(week)
+        transactions = weekly_transactions[week]
 
         for transaction in transactions:
             if transaction['status'] == 'complete':
@@ -301,18 +552,18 @@ def get_trades(league):
                     if transaction['draft_picks']:
                         traded_picks[week] = transaction['draft_picks']
 
-        week = week + 1
-
     return traded_players, traded_picks
 
 
 def determine_eligible_keepers(
-        roster_dict, player_dict, draft_dict, transactions_dict, traded_picks_dict, kept_players_dict):
+        roster_dict, player_dict, draft_dict, transactions_dict, traded_picks_dict, kept_players_dict,
+        league_config=default_league):
     """ Go through the rostered players for a team and determine their keeper eligibility
 
     Go through the rostered players for each team. If that player was added or dropped, then they are not eligible to
     be kept. If that player was drafted, use the draft cost to determine their keeper cost. If that player was not
-    drafted they will cost a round 8 pick, which is determined by the rules of YAFL.
+    drafted they will cost a round 8 pick, which is determined by the rules of YAFL. Other leagues set their own
+    costs in their LeagueConfig.
 
     Args:
         roster_dict (dict): Dictionary of rostered players
@@ -321,261 +572,124 @@ def determine_eligible_keepers(
         transactions_dict (dict): Dictionary of all the transactions after the trade deadline
         traded_picks_dict (dict): Dictionary of all the traded picks
         kept_players_dict (dict): Dictionary of all the kept players
+        league_config (LeagueConfig): League with the keeper rules
 
     Returns:
-        keeper_dict (dict): Dictionary of eligible keepers
+        keeper_dict (dict): Dictionary of eligible keepers. {owner name: OwnerKeepers}
     """
+    # Build the indexes used while going through the rosters up front, so every lookup is constant time.
+    # Players that were dropped or added are not eligible to be kept.
+    ineligible_players = set(transactions_dict['drops'])
+    ineligible_players.update(transactions_dict['adds'])
+
+    # Map roster_id to owner name
+    roster_owners = dict()
+    for owner in roster_dict:
+        roster_owners[roster_dict[owner]['roster_id']] = owner
+
+    # Traded draft picks for each roster_id, in the order they were traded.
+    # {roster_id: [(gained_pick or lost_pick, traded pick, roster_id of the other owner)]}
+    # Since multiple trades can happen a week, need to loop through all the weeks and all the traded picks for each
+    # week.
+    pick_trades = dict()
+    for week in traded_picks_dict:
+        for weekly_traded_pick in traded_picks_dict[week]:
+            owner_id = weekly_traded_pick['owner_id']
+            previous_owner_id = weekly_traded_pick['previous_owner_id']
+            pick_trades.setdefault(owner_id, list()).append((gained_pick, weekly_traded_pick, previous_owner_id))
+            pick_trades.setdefault(previous_owner_id, list()).append((lost_pick, weekly_traded_pick, owner_id))
+
     keeper_dict = dict()
 
     for owner in roster_dict:
-        keeper_dict[owner] = dict()
-        keeper_dict[owner]['owner_id'] = roster_dict[owner]['owner_id']
+        owner_keepers = OwnerKeepers(roster_dict[owner]['owner_id'])
+        keeper_dict[owner] = owner_keepers
         nice_print(owner)
         for player_id in roster_dict[owner]['player_ids']:
             # If a player was dropped or added, he is not eligible to be kept. Do not add them to the keeper_dict
-            if player_id in transactions_dict['drops'] or player_id in transactions_dict['adds']:
+            if player_id in ineligible_players:
                 continue
-            keeper_dict[owner][player_id] = dict()
-            keeper_dict[owner][player_id] = player_dict[player_id]
-            if player_id in draft_dict:
-                keeper_dict[owner][player_id]['drafted'] = True
-                keeper_dict[owner][player_id]['pick_number'] = draft_dict[player_id]['pick_number']
-                keeper_dict[owner][player_id]['round'] = draft_dict[player_id]['round']
-                keeper_dict[owner][player_id]['is_keeper'] = draft_dict[player_id]['keeper']
+            # The player_dict entry is only read. Each keeper is a new record, so nothing leaks into the player_dict.
+            player = player_dict[player_id]
+            # If the player was kept, use his years_kept. If not set the years_kept to 0.
+            kept_player = kept_players_dict.get(player_id)
+            years_kept = kept_player['years_kept'] if kept_player is not None else 0
+            pick = draft_dict.get(player_id)
+            if pick is not None:
                 # The draft price for a player is an additional round pick. So if a player was drafted in round 4,
                 # they will cost a round 3 draft pick to keep. A player can be kept up to 3 year.
-                keeper_dict[owner][player_id]['keeper_cost'] = draft_dict[player_id]['round'] - 1
+                keeper = KeeperCandidate(player_id, player['player_name'], player['position'],
+                                         pick['round'] - league_config.draft_cost_offset, years_kept, True,
+                                         pick['round'], pick['pick_number'], pick['keeper'])
             else:
-                keeper_dict[owner][player_id]['drafted'] = False
                 # UDFA cost a round 8 pick to keep
-                keeper_dict[owner][player_id]['keeper_cost'] = 8
-            # If the player was kept, add years_kept to the keeper_dict. If not set the years_kept to 0.
-            if player_id in kept_players_dict:
-                keeper_dict[owner][player_id]['years_kept'] = kept_players_dict[player_id]['years_kept']
-            else:
-                keeper_dict[owner][player_id]['years_kept'] = 0
+                keeper = KeeperCandidate(player_id, player['player_name'], player['position'],
+                                         league_config.undrafted_cost, years_kept)
+            owner_keepers.add_keeper(keeper)
 
-        # Determine if an owner has traded a draft_pick
-        # Since multiple trades can happen a week, need to loop through all the weeks and all the traded picks for each
-        # week.
-        for week in traded_picks_dict:
-            for weekly_traded_pick in traded_picks_dict[week]:
-                if roster_dict[owner]['roster_id'] == weekly_traded_pick['owner_id']:
-                    keeper_dict[owner]['gained_draft_picks'] = dict()
-                    keeper_dict[owner]['gained_draft_picks']['round'] = weekly_traded_pick['round']
-                    keeper_dict[owner]['gained_draft_picks']['season'] = weekly_traded_pick['season']
-                    # To get the new owner, need to loop through rosters to map roster id to owner
-                    for map_owner in roster_dict:
-                        if roster_dict[map_owner]['roster_id'] == weekly_traded_pick['previous_owner_id']:
-                            keeper_dict[owner]['gained_draft_picks']['new_owner'] = map_owner
-                if roster_dict[owner]['roster_id'] == weekly_traded_pick['previous_owner_id']:
-                    keeper_dict[owner]['lost_draft_picks'] = dict()
-                    keeper_dict[owner]['lost_draft_picks']['round'] = weekly_traded_pick['round']
-                    keeper_dict[owner]['lost_draft_picks']['season'] = weekly_traded_pick['season']
-                    # To get the new owner, need to loop through rosters to map roster id to owner
-                    for map_owner in roster_dict:
-                        if roster_dict[map_owner]['roster_id'] == weekly_traded_pick['owner_id']:
-                            keeper_dict[owner]['lost_draft_picks']['new_owner'] = map_owner
+        # Add the draft picks the owner has gained or lost in a trade. Only the last trade of each kind is kept.
+        for kind, weekly_traded_pick, other_roster_id in pick_trades.get(roster_dict[owner]['roster_id'], []):
+            # new_owner is the owner on the other side of the trade
+            owner_keepers.add_pick_trade(PickTrade(kind, weekly_traded_pick['round'], weekly_traded_pick['season'],
+                                                   roster_owners.get(other_roster_id)))
 
     nice_print(keeper_dict)
     return keeper_dict
 
 
-def pretty_print_keepers(keeper_dict, year):
-    """ Print the final keeper information to a file in a human-readable format
+def position_keeper(keeper_dict, position, echo=True, indexes=None):
+    """ Generate a list of keepers for given position
 
-    Args:
-        keeper_dict (dict): Dictionary of final keeper information
-        year (int): Year of YAFL 2.0
-    """
-    with open('data_files/{}/final_keepers.txt'.format(year), 'w') as f:
-        print('The YAFL 2.0 Eligible Keepers for {}\n'.format(year))
-        f.write('The YAFL 2.0 Eligible Keepers for {}\n'.format(year))
-        for owner in keeper_dict:
-            print('Manager: {}\n'.format(owner))
-            f.write('Manager: {}\n'.format(owner))
-
-            for player_id in keeper_dict[owner]:
-                if player_id == 'owner_id':
-                    continue
-                # Print out traded away draft pick information
-                if player_id == 'lost_draft_picks':
-                    new_owner = keeper_dict[owner]['lost_draft_picks']['new_owner']
-                    draft_round = keeper_dict[owner]['lost_draft_picks']['round']
-                    season = keeper_dict[owner]['lost_draft_picks']['season']
-                    print('\t*Lost a {} round {} draft pick. Traded to {}\n'.format(season, draft_round, new_owner))
-                    f.write('\t*Lost a {} round {} draft pick. Traded to {}\n'.format(season, draft_round, new_owner))
-                    continue
-                # Print out gained draft pick information
-                if player_id == 'gained_draft_picks':
-                    previous_owner = keeper_dict[owner]['gained_draft_picks']['new_owner']
-                    draft_round = keeper_dict[owner]['gained_draft_picks']['round']
-                    season = keeper_dict[owner]['gained_draft_picks']['season']
-                    print('\t*Gained a {} round {} draft pick acquired from {}\n'.format(
-                        season,
-                        draft_round,
-                        previous_owner))
-                    f.write('\t*Gained a {} round {} draft pick acquired from {}\n'.format(
-                        season,
-                        draft_round,
-                        previous_owner))
-                    continue
-                player_name = keeper_dict[owner][player_id]['player_name']
-                keeper_cost = keeper_dict[owner][player_id]['keeper_cost']
-                position = keeper_dict[owner][player_id]['position']
-                years_kept = keeper_dict[owner][player_id]['years_kept']
-                # Only print the years kept if it not 0. Always printing the years kept cluttered the screen
-                if years_kept == 0:
-                    print('\t{} {} - Keeper Cost: Round {}.\n'.format(player_name, position, keeper_cost,))
-                    f.write('\t{} {} - Keeper Cost: Round {}.\n'.format(player_name, position, keeper_cost,))
-                else:
-                    print('\t{} {} - Keeper Cost: Round {}. Years Kept {}\n'.format(player_name,
-                                                                                    position,
-                                                                                    keeper_cost,
-                                                                                    years_kept
-                                                                                    ))
-                    f.write('\t{} {} - Keeper Cost: Round {}. Years Kept {}\n'.format(player_name,
-                                                                                      position,
-                                                                                      keeper_cost,
-                                                                                      years_kept
-                                                                                      ))
-
-
-def csv_print_keepers_original(keeper_dict, year):
-    """ Print the final keeper information to a csv file for Meat "Scope Creep" Wizard
-
-    This was how I originally formatted the keepers csv file. Updated to a new format for csv, but keeping this
-    in case the new one does not work well.
+    The list is saved to positional_keepers.txt.
 
     Args:
-        keeper_dict (dict): Dictionary of final keeper information
-        year (int): Year of YAFL 2.0
+        keeper_dict (dict): Dictionary of eligible keepers
+        position (str): Position for which to generate keeper list
+        echo (bool): Also print the keeper list to stdout
+        indexes (dict): Keeper indexes from keeper_report.KeeperIndexSink. Built from keeper_dict if not given.
     """
-    with open('data_files/{}/final_keepers_{}.csv'.format(year, year), 'w') as f:
-        print('The YAFL 2.0 Eligible Keepers,')
-        f.write('The YAFL 2.0 Eligible Keepers,')
-        print('MeatWizard is a little scope-creeping bitch,')
-        f.write('MeatWizard is a little scope-creeping bitch,')
-        for owner in keeper_dict:
-            print('Manager: {},'.format(owner))
-            f.write('Manager: {},'.format(owner))
-
-            for player_id in keeper_dict[owner]:
-                if player_id == 'owner_id':
-                    continue
-                # Print out traded away draft pick information
-                if player_id == 'lost_draft_picks':
-                    new_owner = keeper_dict[owner]['lost_draft_picks']['new_owner']
-                    draft_round = keeper_dict[owner]['lost_draft_picks']['round']
-                    season = keeper_dict[owner]['lost_draft_picks']['season']
-                    print('*Lost a {} round {} draft pick. Traded to {},'.format(season, draft_round, new_owner))
-                    f.write('*Lost a {} round {} draft pick. Traded to {},'.format(season, draft_round, new_owner))
-                    continue
-                # Print out gained draft pick information
-                if player_id == 'gained_draft_picks':
-                    previous_owner = keeper_dict[owner]['gained_draft_picks']['new_owner']
-                    draft_round = keeper_dict[owner]['gained_draft_picks']['round']
-                    season = keeper_dict[owner]['gained_draft_picks']['season']
-                    print('*Gained a {} round {} draft pick acquired from {},'.format(
-                        season,
-                        draft_round,
-                        previous_owner))
-                    f.write('*Gained a {} round {} draft pick acquired from {},'.format(
-                        season,
-                        draft_round,
-                        previous_owner))
-                    continue
-                player_name = keeper_dict[owner][player_id]['player_name']
-                keeper_cost = keeper_dict[owner][player_id]['keeper_cost']
-                print('{} - Keeper Cost: Round {},'.format(player_name, keeper_cost))
-                f.write('{} - Keeper Cost: Round {},'.format(player_name, keeper_cost))
-
-
-def csv_print_keepers(keeper_dict, year):
-    """ Print the final keeper information to a csv file for Meat "Scope Creep" Wizard
+    if position.upper() not in eligible_positions:
+        logger.warning('%s not an eligible position. Eligible positions are: QB, RB, WR, TE, or DEF', position)
+        return
+
+    if indexes is None:
+        indexes = build_keeper_indexes(keeper_dict)
+
+    text = format_position_keepers(indexes, position.upper())
+    with atomic_open('positional_keepers.txt') as f:
+        f.write(text)
+    if echo:
+        print(text, end='')
+
+
+def write_keeper_reports(keeper_dict, year, position, csv, formats, echo, league_config=default_league):
+    """ Generate all the keeper reports in one pass over the keeper_dict
 
     Args:
         keeper_dict (dict): Dictionary of final keeper information
         year (int): Year of YAFL 2.0
-    """
-    with open('data_files/{}/final_keepers_{}.csv'.format(year, year), 'w') as f:
-        print('The YAFL 2.0 Eligible Keepers for {}\n'.format(year))
-        f.write('The YAFL 2.0 Eligible Keepers for {}\n'.format(year))
-        print('MeatWizard is a little scope-creeping bitch\n')
-        f.write('MeatWizard is a little scope-creeping bitch\n')
-        print('Delete these first 3 lines and it will import nice as a CSV.\n')
-        f.write('Delete these first 3 lines and it will import nice as a CSV.\n')
-        print('Manager,Player_Name,Position,Keeper_Cost,Years_kept\n')
-        f.write('Manager,Player_Name,Position,Keeper_Cost,Years_kept\n')
-        for owner in keeper_dict:
-            for player_id in keeper_dict[owner]:
-                if player_id == 'owner_id':
-                    continue
-                # Print out traded away draft pick information
-                if player_id == 'lost_draft_picks':
-                    new_owner = keeper_dict[owner]['lost_draft_picks']['new_owner']
-                    draft_round = keeper_dict[owner]['lost_draft_picks']['round']
-                    season = keeper_dict[owner]['lost_draft_picks']['season']
-                    print('*Lost a {} round {} draft pick. Traded to {},'.format(season, draft_round, new_owner))
-                    f.write('*Lost a {} round {} draft pick. Traded to {},'.format(season, draft_round, new_owner))
-                    continue
-                # Print out gained draft pick information
-                if player_id == 'gained_draft_picks':
-                    previous_owner = keeper_dict[owner]['gained_draft_picks']['new_owner']
-                    draft_round = keeper_dict[owner]['gained_draft_picks']['round']
-                    season = keeper_dict[owner]['gained_draft_picks']['season']
-                    print('*Gained a {} round {} draft pick acquired from {},'.format(
-                        season,
-                        draft_round,
-                        previous_owner))
-                    f.write('*Gained a {} round {} draft pick acquired from {},'.format(
-                        season,
-                        draft_round,
-                        previous_owner))
-                    continue
-                player_name = keeper_dict[owner][player_id]['player_name']
-                keeper_cost = keeper_dict[owner][player_id]['keeper_cost']
-                position = keeper_dict[owner][player_id]['position']
-                years_kept = keeper_dict[owner][player_id]['years_kept']
-                print('{},{},{},{},{}\n'.format(owner, player_name, position, keeper_cost, years_kept))
-                f.write('{},{},{},{},{}\n'.format(owner, player_name, position, keeper_cost, years_kept))
-
-
-def position_keeper(keeper_dict, position):
-    """ Generate a list of keepers for given position
+        position (str): Position for the positional report. None to skip it.
+        csv (bool): Generate the csv report
+        formats (list): Names of optional report formats to generate. See keeper_report.report_formats.
+        echo (bool): Also print the reports to stdout
+        league_config (LeagueConfig): League of the reports
 
-    Args:
-        keeper_dict (dict): Dictionary of eligible keepers
-        position (str): Position for which to generate keeper list
+    Returns:
+        reports (dict): {report name: text of the report}. 'keeper_indexes' holds the keeper indexes.
     """
-    eligible_positions = ['QB', 'RB', 'WR', 'TE', 'DEF']
+    sinks = [TextReportSink(year, league_config=league_config), KeeperIndexSink()]
+    if csv:
+        sinks.append(CsvReportSink(year, league_config=league_config))
+    for report_format in formats or ():
+        sinks.append(report_formats[report_format](year, league_config=league_config))
 
-    if position.upper() not in eligible_positions:
-        print('{} not an eligible position. Eligible positions are: QB, RB, WR, TE, or DEF'.format(position))
-        return
+    reports = render_reports(keeper_dict, sinks, echo)
 
-    with open('positional_keepers.txt', 'w') as f:
-        print('{} keeper costs'.format(position))
-        f.write('{} keeper costs\n'.format(position))
-
-        for owner in keeper_dict:
-            print('Manager: {}'.format(owner))
-            f.write('Manager: {}\n'.format(owner))
-            for player_id in keeper_dict[owner]:
-                if player_id == 'owner_id':
-                    continue
-                if player_id == 'lost_draft_picks':
-                    continue
-                if player_id == 'gained_draft_picks':
-                    continue
-                # Only print keeper information, if the player plays the position
-                if position == keeper_dict[owner][player_id]['position']:
-                    player_name = keeper_dict[owner][player_id]['player_name']
-                    keeper_cost = keeper_dict[owner][player_id]['keeper_cost']
-                    print('\t{} - Keeper Cost: Round {}'.format(player_name, keeper_cost))
-                    f.write('\t{} - Keeper Cost: Round {}\n'.format(player_name, keeper_cost))
+    # The positional report is listed straight from the keeper indexes
+    if position:
+        position_keeper(keeper_dict, position, echo, reports['keeper_indexes'])
 
-    return
+    return reports
 
 
 def process_traded_picks(roster_dict, traded_picks):
@@ -589,35 +703,78 @@ def process_traded_picks(roster_dict, traded_picks):
     keeper_dict = dict()
     for week in traded_picks:
         for weekly_traded_pick in traded_picks[week]:
-            print('Owner_ID: {}'.format(weekly_traded_pick['owner_id']))
-            print('Previous_Owner_ID: {}'.format(weekly_traded_pick['previous_owner_id']))
+            logger.debug('Owner_ID: %s', weekly_traded_pick['owner_id'])
+            logger.debug('Previous_Owner_ID: %s', weekly_traded_pick['previous_owner_id'])
 
     for owner in roster_dict:
         keeper_dict[owner] = dict()
         keeper_dict[owner]['owner_id'] = roster_dict[owner]['owner_id']
         nice_print(owner)
 
-        print('Looking for traded_picks for {} with owner_id {}'.format(
-            roster_dict[owner],
+        logger.debug(
+            'Looking for traded_picks for %s with owner_id %s',
+            LazyPformat(roster_dict[owner]),
             roster_dict[owner]['owner_id']
-        ))
+        )
         for week in traded_picks:
             for weekly_traded_pick in traded_picks[week]:
                 if roster_dict[owner]['roster_id'] == weekly_traded_pick['owner_id']:
-                    print("Owner_ID: {} has gained a round {} in {}".format(
+                    logger.debug(
+                        'Owner_ID: %s has gained a round %s in %s',
                         weekly_traded_pick['owner_id'],
                         weekly_traded_pick['round'],
                         weekly_traded_pick['season']
-                    ))
+                    )
                 if roster_dict[owner]['roster_id'] == weekly_traded_pick['previous_owner_id']:
-                    print("Owner_ID: {} has lost a round {} in {}".format(
+                    logger.debug(
+                        'Owner_ID: %s has lost a round %s in %s',
                         weekly_traded_pick['previous_owner_id'],
                         weekly_traded_pick['round'],
                         weekly_traded_pick['season']
-                    ))
+                    )
+
 
+def write_profile(year, offline, counters, wall_seconds, cpu_seconds, league_config=default_league):
+    """ Log a profile of a run and save it to {data_dir}/{year}/profile.json
 
-def main_program(username, debug, refresh, position, offline, year):
+    Args:
+        year (int): Year of YAFL 2.0
+        offline (bool): The run was in offline mode
+        counters (dict): Metrics counters of the run from Metrics.diff
+        wall_seconds (float): Wall clock seconds the run took
+        cpu_seconds (float): CPU seconds the run took
+        league_config (LeagueConfig): League of the run
+    """
+    profile = summarize(counters)
+    profile['year'] = year
+    profile['mode'] = 'offline' if offline else 'online'
+    profile['wall_seconds'] = wall_seconds
+    profile['cpu_seconds'] = cpu_seconds
+    profile['log_bytes'] = bytes_logged()
+
+    path = league_config.path(year, 'profile.json')
+    with atomic_open(path) as f:
+        f.write(json.dumps(profile, indent=4))
+
+    logger.info('Profile of the %s %s run: %.3fs wall, %.3fs CPU', profile['mode'], year, wall_seconds, cpu_seconds)
+    logger.info('Stages (wall / CPU / runs):')
+    for stage, timing in sorted(profile['stages'].items(), key=lambda item: item[1]['wall_seconds'], reverse=True):
+        logger.info('\t%s: %.3fs / %.3fs / %s', stage, timing['wall_seconds'], timing['cpu_seconds'], timing['runs'])
+    logger.info('Sleeper API (requests / bytes):')
+    for endpoint, requests in sorted(profile['sleeper_requests'].items()):
+        logger.info('\t%s: %s / %s', endpoint, requests['requests'], requests['bytes'])
+    logger.info('Caches:')
+    for cache, results in sorted(profile['caches'].items()):
+        logger.info('\t%s: %s', cache,
+                    ', '.join('{} {}'.format(value, result) for result, value in sorted(results.items())))
+    logger.info('json bytes:')
+    for direction, files in sorted(profile['json_bytes'].items()):
+        logger.info('\t%s: %s', direction, sum(files.values()))
+    logger.info('Profile saved to %s', path)
+
+
+def main_program(username, debug, refresh, position, offline, year, echo=False, formats=None, profile=False,
+                 league_config=None):
     """ Run the main application
 
     Args:
@@ -627,183 +784,132 @@ def main_program(username, debug, refresh, position, offline, year):
         position (str): Position argument. Get keeper value for given position.
         offline (bool): Offline argument. Run in offline mode.
         year (int): Year of league information to acquire.
+        echo (bool): Print the keeper reports to stdout
+        formats (list): Names of optional report formats to generate. See keeper_report.report_formats.
+        profile (bool): Profile argument flag. Log where the time went and save it to {data_dir}/{year}/profile.json.
+        league_config (LeagueConfig): League to generate keeper results for. Defaults to YAFL 2.0.
     """
-    # 2019 was the first year of YAFL 2.0, so there was not kept player list. Load an empty kept_player dictionary
-    if year == 2019:
-        kept_dict = dict()
-    else:
-        try:
-            with open('data_files/{}/kept_players/processed_kept_players.json'.format(year)) as f:
-                kept_dict = json.load(f)
-        except Exception as e:
-            print(e)
-            assert False, 'Unable to open processed_kept_players.json. Run process_kept_csv.py.'
+    if league_config is None:
+        league_config = default_league
+    before = metrics.snapshot()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
 
-    if offline:
-        # For offline mode we need to get all the files from data_files. If the file does not exist, remind the user
-        # to use --refresh to get and store data
-        try:
-            with open('data_files/{}/player_dict.json'.format(year)) as f:
-                player_dict = json.load(f)
-        except Exception as e:
-            print(e)
-            assert False, 'Unable to open data_files/player_dict.json. \n Use --refresh to get data from Sleeper API'
+    with metrics.stage('main_program'):
+        generate_keepers(username, debug, refresh, position, offline, year, echo, formats, league_config)
 
-        try:
-            with open('data_files/{}/draft_dict.json'.format(year)) as f:
-                draft_dict = json.load(f)
-        except Exception as e:
-            print(e)
-            assert False, 'Unable to open data_files/draft_dict.json. \n Use --refresh to get data from Sleeper API'
+    if profile:
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+        # Include the saving done by the writer thread in the profile
+        wait_for_writes()
+        write_profile(year, offline, metrics.diff(before), wall_seconds, cpu_seconds, league_config)
 
-        try:
-            with open('data_files/{}/rosters.json'.format(year)) as f:
-                roster_dict = json.load(f)
-        except Exception as e:
-            print(e)
-            assert False, 'Unable to open data_files/rosters.json. \n Use --refresh to get data from Sleeper API'
 
-        try:
-            with open('data_files/{}/transactions.json'.format(year)) as f:
-                transactions = json.load(f)
-        except Exception as e:
-            print(e)
-            assert False, 'Unable to open data_files/transactions.json. \n Use --refresh to get data from Sleeper API'
+def generate_keepers(username, debug, refresh, position, offline, year, echo, formats, league_config):
+    """ Generate the keeper results and reports. Arguments are the same as main_program. """
+    reset_bytes_logged()
 
-        try:
-            with open('data_files/{}/trades.json'.format(year)) as f:
-                trades = json.load(f)
-        except Exception as e:
-            print(e)
-            assert False, 'Unable to open data_files/trades.json. \n Use --refresh to get data from Sleeper API'
+    if offline:
+        # Let the writer thread finish saving the data files of an earlier run first
+        wait_for_writes()
 
+        # For offline mode we need all the saved data from the history store or the offline bundle. If neither has
+        # the season, remind the user to use --refresh to get and store data
         try:
-            with open('data_files/{}/traded_picks.json'.format(year)) as f:
-                traded_picks = json.load(f)
+            with metrics.stage('load_offline_data'):
+                inputs = load_offline_inputs(year, league_config)
         except Exception as e:
-            print(e)
-            assert False, 'Unable to open data_files/traded_picks.json. \n Use --refresh to get data from Sleeper API'
-
-        keeper_dict = determine_eligible_keepers(
-            roster_dict,
-            player_dict,
-            draft_dict,
-            transactions,
-            traded_picks,
-            kept_dict
-        )
-        pretty_print_keepers(keeper_dict, year)
-
-        if position:
-            position_keeper(keeper_dict, position)
-
+            logger.error(e)
+            assert False, 'Unable to open {}. \n Use --refresh to get data from Sleeper API'.format(
+                bundle_path(year, league_config.data_dir))
+
+        # Get the kept players from the drafts of this season and the seasons before
+        with metrics.stage('determine_eligible_keepers'):
+            kept_dict = get_keeper_chains(league_config).kept_players(year, inputs['draft_dict'])
+
+            keeper_dict = determine_eligible_keepers(
+                inputs['roster_dict'],
+                inputs['player_dict'],
+                inputs['draft_dict'],
+                inputs['transactions'],
+                inputs['traded_picks'],
+                kept_dict,
+                league_config
+            )
+        with metrics.stage('write_keeper_reports'):
+            reports = write_keeper_reports(keeper_dict, year, position, False, formats, echo, league_config)
+        with metrics.stage('publish_snapshot'):
+            publish_snapshot(year, keeper_dict, reports, league_config.data_dir)
+
+        logger.info('Logged %s bytes', bytes_logged())
         return
 
     # Get the user object to get league info
     user_obj = User(username)
 
     # Get the league object. Will be used to get draft info, transactions, and rosters.
-    league = get_league_id(user_obj, year)
-
-    # Get the username and id
-    user_dict = get_users(league)
+    league = get_league_id(user_obj, year, league_config.name)
 
+    # Get everything needed from the Sleeper API. Stages that do not depend on each other are run at the same time.
+    stages = season_stages(league)
     # Get a dictionary of all the players
-    player_dict = get_players(refresh, year)
-
-    # Get the trade deadline from the league settings
-    trade_deadline = get_trade_deadline(league)
-
-    # Get a dictionary of all the drafted players
-    draft_dict = get_drafted_players(league)
-
-    # Get a dictionary of all the rostered players
-    roster_dict = get_rosters(league, user_dict)
+    stages['player_dict'] = (lambda: get_players(refresh, year, league_config), [])
 
-    # Get the transactions after the trade deadline
-    transactions = get_transactions(league, trade_deadline)
+    results, timings = run_stages(stages)
+    print_timings(timings)
 
-    # Get a list of traded players and dictionary of traded draft picks
-    trades, traded_picks = get_trades(league)
+    user_dict = results['user_dict']
+    player_dict = results['player_dict']
+    draft_dict = results['draft_dict']
+    roster_dict = results['roster_dict']
+    transactions = results['transactions']
+    trades, traded_picks = results['trades']
 
     # DEBUG code to process traded_picks
     # process_traded_picks(roster_dict, traded_picks)
 
-    # Get the final keeper list
-    keeper_dict = determine_eligible_keepers(
-        roster_dict,
-        player_dict,
-        draft_dict,
-        transactions,
-        traded_picks,
-        kept_dict
-    )
+    with metrics.stage('determine_eligible_keepers'):
+        # Get the kept players from the drafts of this season and the seasons before
+        kept_dict = get_keeper_chains(league_config).kept_players(year, draft_dict)
 
-    if debug:
-        # If debug_files doesn't exist, create the directory
-        # if not os.path.isdir('./debug_files'):
-        #     try:
-        #         os.mkdir('debug_files')
-        #     except Exception as e:
-        #         print(e)
-        #         assert False
-        path = Path('./debug_files')
-        path.mkdir(parents=True, exist_ok=True)
-
-        # Output everything to a file to figure out what is happening
-        with open('debug_files/user_dict.json', 'w') as f:
-            f.write('{}'.format(pformat(user_dict)))
-        with open('debug_files/draft_dict.json', 'w') as f:
-            f.write('{}'.format(pformat(draft_dict)))
-        with open('debug_files/rosters.json', 'w') as f:
-            f.write('{}'.format(pformat(roster_dict)))
-        with open('debug_files/player_dict.json', 'w') as f:
-            f.write('{}'.format(pformat(player_dict)))
-        with open('debug_files/keeper_dict.json', 'w') as f:
-            f.write('{}'.format(pformat(keeper_dict)))
-        with open('debug_files/transactions.json', 'w') as f:
-            f.write('{}'.format(pformat(transactions)))
-        with open('debug_files/trades.json', 'w') as f:
-            f.write('{}'.format(pformat(trades)))
-        with open('debug_files/traded_picks.json', 'w') as f:
-            f.write('{}'.format(pformat(traded_picks)))
-
-    if refresh:
-        # If data_files doesn't exist, create the directory
-        # if not os.path.isdir('./data_files'):
-        #     try:
-        #         os.mkdir('data_files')
-        #     except Exception as e:
-        #         print(e)
-        #         assert False
-
-        # New way to check for path. Keeping old way in comments for now. Delete it later.
-        path = Path('./data_files/{}'.format(year))
-        path.mkdir(parents=True, exist_ok=True)
-
-        with open('data_files/{}/user_dict.json'.format(year), 'w') as f:
-            f.write(json.dumps(user_dict))
-        with open('data_files/{}/draft_dict.json'.format(year), 'w') as f:
-            f.write(json.dumps(draft_dict))
-        with open('data_files/{}/rosters.json'.format(year), 'w') as f:
-            f.write(json.dumps(roster_dict))
-        with open('data_files/{}/player_dict.json'.format(year), 'w') as f:
-            f.write(json.dumps(player_dict))
-        with open('data_files/{}/keeper_dict.json'.format(year), 'w') as f:
-            f.write(json.dumps(keeper_dict))
-        with open('data_files/{}/transactions.json'.format(year), 'w') as f:
-            f.write(json.dumps(transactions))
-        with open('data_files/{}/trades.json'.format(year), 'w') as f:
-            f.write(json.dumps(trades))
-        with open('data_files/{}/traded_picks.json'.format(year), 'w') as f:
-            f.write(json.dumps(traded_picks))
-
-    csv_print_keepers(keeper_dict, year)
-    pretty_print_keepers(keeper_dict, year)
+        # Get the final keeper list
+        keeper_dict = determine_eligible_keepers(
+            roster_dict,
+            player_dict,
+            draft_dict,
+            transactions,
+            traded_picks,
+            kept_dict,
+            league_config
+        )
 
-    if position:
-        position_keeper(keeper_dict, position)
+    if refresh or debug:
+        # Save everything from the Sleeper API with --refresh, and to debug_files with --debug. The writer thread does
+        # the saving, so the keeper results are published without waiting on the disk. Nothing below changes these.
+        datasets = dict()
+        datasets['user_dict.json'] = user_dict
+        datasets['draft_dict.json'] = draft_dict
+        datasets['rosters.json'] = roster_dict
+        datasets['keeper_dict.json'] = keeper_dict
+        datasets['transactions.json'] = transactions
+        datasets['trades.json'] = trades
+        datasets['traded_picks.json'] = traded_picks
+        save_in_background(year, datasets, refresh, debug, {'player_dict.json': player_dict}, league_config.data_dir)
+
+    with metrics.stage('write_keeper_reports'):
+        reports = write_keeper_reports(keeper_dict, year, position, True, formats, echo, league_config)
+    with metrics.stage('publish_snapshot'):
+        publish_snapshot(year, keeper_dict, reports, league_config.data_dir)
+
+    # Keep the history of every season up to date. The keeper results do not depend on it, so a failure is only logged.
+    try:
+        with metrics.stage('update_history'):
+            update_history(user_obj, league, results, load_manual_kept(year, league_config), league_config)
+    except Exception as e:
+        logger.error('Unable to update the history store: %s', e)
 
+    logger.info('Logged %s bytes', bytes_logged())
     return
 
 
@@ -845,7 +951,7 @@ def save_draft_information(user):
         try:
             os.mkdir('saved_drafts')
         except Exception as e:
-            print(e)
+            logger.error(e)
             assert False
 
     with open('saved_drafts/draft_{}.json'.format(season), 'w') as f:
@@ -863,10 +969,14 @@ if __name__ == '__main__':
         You must run with a username from YAFL 2.0.
         You must run with a valid year for YAFL 2.0.
         To get new data from the Sleeper API, use the optional argument '--refresh'.
-        To print all output to files, use the optional argument '--debug'.
+        To print all output to files and log debug output, use the optional argument '--debug'.
         To run in offline mode, use the optional argument '--offline'.
         To get keeper values for a specific position, use the optional argument '--pos QB'.
-            Valid positions are QB, WR, RB, TE, and DEF. Results are saved to position_keepers.txt. '''
+            Valid positions are QB, WR, RB, TE, and DEF. Results are saved to position_keepers.txt.
+        To also save the results as json or html, use the optional argument '--report json' or '--report html'.
+        To not print the results, use the optional argument '--quiet'.
+        To log where the time went and save it to profile.json, use the optional argument '--profile'.
+        To run for another league from leagues.json, use the optional argument '--league dynasty'. '''
     )
     parser = argparse.ArgumentParser(description=main_help_text, formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('user', type=str, help='Username of owner in YAFL 2.0')
@@ -879,7 +989,7 @@ if __name__ == '__main__':
     parser.add_argument('--debug',
                         default=None,
                         action='store_true',
-                        help='Print everything to file for debug'
+                        help='Print everything to file and log debug output'
                         )
     parser.add_argument('--offline',
                         default=None,
@@ -888,6 +998,22 @@ if __name__ == '__main__':
                         )
     parser.add_argument('--pos', type=str, default=None, help='Get keeper values for specified position')
     parser.add_argument('--store_draft', default=None, action='store_true', help='Store draft for RUN.')
+    parser.add_argument('--report',
+                        action='append',
+                        choices=sorted(report_formats),
+                        help='Also save the keeper results in this format'
+                        )
+    parser.add_argument('--quiet', default=None, action='store_true', help='Do not print the keeper results')
+    parser.add_argument('--profile',
+                        default=None,
+                        action='store_true',
+                        help='Log the time, Sleeper API calls, cache hits and json bytes of the run'
+                        )
+    parser.add_argument('--league',
+                        type=str,
+                        default=None,
+                        help='Id of a league from leagues.json. Defaults to YAFL 2.0.'
+                        )
 
     args = parser.parse_args()
     user = args.user
@@ -897,11 +1023,22 @@ if __name__ == '__main__':
     position = args.pos
     offline = args.offline
     store_draft = args.store_draft
+    formats = args.report
+    echo = not args.quiet
+    profile = args.profile
+    league_config = get_league(args.league)
+
+    setup_logging(debug)
+
+    if league_config is None:
+        logger.error('League %s is not in leagues.json', args.league)
+        sys.exit(1)
 
     if store_draft:
         save_draft_information(user)
         sys.exit(0)
 
-    main_program(user, debug, refresh, position, offline, year)
+    main_program(user, debug, refresh, position, offline, year, echo, formats, profile, league_config)
+    wait_for_writes()
 
     sys.exit(0)